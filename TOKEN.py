@@ -1,14 +1,23 @@
 import os
-from functools import lru_cache
+import threading
+import time
+from concurrent.futures import Future
 
-from oauthlib.oauth2 import BackendApplicationClient
-from requests_oauthlib import OAuth2Session
+from oauthlib.oauth2 import BackendApplicationClient, MissingTokenError
 
+from metrics import increment, span
+from sentinel_http import REQUEST_TIMEOUT, SENTINEL_HUB_BASE_URL, get_session
+from sentinel_scheduler import INTERACTIVE
 
-TOKEN_URL = (
-    "https://services.sentinel-hub.com/auth/realms/main/protocol/"
-    "openid-connect/token"
-)
+
+TOKEN_URL = f"{SENTINEL_HUB_BASE_URL}/auth/realms/main/protocol/openid-connect/token"
+# Refresh in the background this long before the token expires...
+TOKEN_REFRESH_MARGIN_SECONDS = 300
+# ...and block callers for a new token once less than this is left.
+TOKEN_MIN_VALIDITY_SECONDS = 30
+# After a failed background refresh, wait this long before trying again.
+TOKEN_REFRESH_RETRY_SECONDS = 30
+DEFAULT_TOKEN_LIFETIME_SECONDS = 3600
 
 
 def _streamlit_secret(*keys):
@@ -50,16 +59,100 @@ def get_sentinel_credentials():
     return client_id, client_secret
 
 
-@lru_cache(maxsize=1)
 def _fetch_token(client_id, client_secret):
     client = BackendApplicationClient(client_id=client_id)
-    oauth = OAuth2Session(client=client)
-    token = oauth.fetch_token(
-        token_url=TOKEN_URL,
-        client_secret=client_secret,
-        include_client_id=True,
+    # Sent over the shared keep-alive session rather than a session per refresh.
+    response = get_session().post(
+        TOKEN_URL,
+        data=client.prepare_request_body(include_client_id=True, client_secret=client_secret),
+        headers={"Accept": "application/json"},
+        timeout=REQUEST_TIMEOUT,
     )
-    return token["access_token"]
+    try:
+        return client.parse_request_body_response(response.text)
+    except MissingTokenError:
+        # Failures without an OAuth error body (e.g. a proxy's 502 page) report the status.
+        response.raise_for_status()
+        raise
+
+
+class TokenManager:
+    """Cache an OAuth access token until shortly before it expires.
+
+    Tokens close to expiry are refreshed in a background thread while callers
+    keep using the current one. Concurrent callers share a single in-flight
+    refresh instead of each fetching their own token.
+    """
+
+    def __init__(self, fetch=_fetch_token, clock=time.monotonic):
+        self._fetch = fetch
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._credentials = None
+        self._token = None
+        self._expires_at = 0.0
+        self._refreshing = None
+        self._refresh_failed_at = None
+
+    def _refresh_due(self, remaining):
+        if remaining > TOKEN_REFRESH_MARGIN_SECONDS or self._refreshing is not None:
+            return False
+        failed_at = self._refresh_failed_at
+        return failed_at is None or self._clock() - failed_at >= TOKEN_REFRESH_RETRY_SECONDS
+
+    def get(self, client_id, client_secret):
+        credentials = (client_id, client_secret)
+        with self._lock:
+            if self._token and credentials == self._credentials:
+                remaining = self._expires_at - self._clock()
+                if remaining > TOKEN_MIN_VALIDITY_SECONDS:
+                    if self._refresh_due(remaining):
+                        self._refreshing = Future()
+                        threading.Thread(
+                            target=self._refresh,
+                            args=(credentials, self._refreshing),
+                            daemon=True,
+                        ).start()
+                    return self._token
+
+            future = self._refreshing
+            owner = future is None
+            if owner:
+                future = self._refreshing = Future()
+
+        if owner:
+            self._refresh(credentials, future)
+        return future.result()
+
+    def _refresh(self, credentials, future):
+        try:
+            token = self._fetch(*credentials)
+            access_token = token["access_token"]
+            lifetime = float(token.get("expires_in") or DEFAULT_TOKEN_LIFETIME_SECONDS)
+        except BaseException as exc:
+            with self._lock:
+                self._refreshing = None
+                self._refresh_failed_at = self._clock()
+            future.set_exception(exc)
+            return
+
+        with self._lock:
+            self._credentials = credentials
+            self._token = access_token
+            self._expires_at = self._clock() + lifetime
+            self._refreshing = None
+            self._refresh_failed_at = None
+        future.set_result(access_token)
+
+    def invalidate(self, token):
+        """Forget ``token`` (e.g. after a 401) so the next caller fetches a new one."""
+        with self._lock:
+            if self._token == token:
+                self._token = None
+                self._expires_at = 0.0
+
+
+_token_manager = TokenManager()
 
 
 def make_token():
@@ -70,4 +163,37 @@ def make_token():
             "SENTINEL_CLIENT_SECRET, or add them to .streamlit/secrets.toml."
         )
 
-    return _fetch_token(client_id, client_secret)
+    with span("token"):
+        return _token_manager.get(client_id, client_secret)
+
+
+def invalidate_token(token):
+    _token_manager.invalidate(token)
+
+
+def _post(session, url, token, headers, kwargs):
+    endpoint = url.rstrip("/").rsplit("/", 1)[-1]
+    with span("http_post", endpoint=endpoint):
+        response = session.post(
+            url, headers={**(headers or {}), "Authorization": f"Bearer {token}"}, **kwargs
+        )
+    increment("http_responses", endpoint=endpoint, status=response.status_code)
+    increment("http_bytes", len(response.request.body or b""), endpoint=endpoint, direction="sent")
+    increment("http_bytes", len(response.content), endpoint=endpoint, direction="received")
+    return response
+
+
+def post_with_token(url, headers=None, priority=INTERACTIVE, **kwargs):
+    """POST with a bearer token, retrying once with a fresh token on HTTP 401.
+
+    ``priority`` picks the retry budget for throttled and failed responses.
+    """
+    session = get_session(priority)
+    kwargs.setdefault("timeout", REQUEST_TIMEOUT)
+    token = make_token()
+    response = _post(session, url, token, headers, kwargs)
+    if response.status_code == 401:
+        invalidate_token(token)
+        token = make_token()
+        response = _post(session, url, token, headers, kwargs)
+    return response
@@ -0,0 +1,88 @@
+import hashlib
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image
+
+from sentinel_cache import get_image_cache
+
+
+ANIMATION_FORMATS = {"gif": "GIF", "webp": "WEBP"}
+ANIMATION_MIME_TYPES = {"gif": "image/gif", "webp": "image/webp"}
+DEFAULT_ANIMATION_SIZE = 512
+WEBP_QUALITY = 80
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def animation_payload(frame_paths, duration, size, fmt):
+    """Cache identity of an animation: frame contents plus encoding settings."""
+    return {
+        "animation": {
+            "frames": [_file_digest(path) for path in frame_paths],
+            "duration_ms": int(duration * 1000),
+            "size": size,
+            "format": fmt,
+        }
+    }
+
+
+def _encode(frame_paths, duration, size, fmt):
+    frames = []
+    for path in frame_paths:
+        with Image.open(path) as img:
+            frame = img.convert("RGB")
+        frame.thumbnail((size, size))
+        frames.append(frame)
+
+    buffer = BytesIO()
+    options = {"quality": WEBP_QUALITY} if fmt == "webp" else {}
+    frames[0].save(
+        buffer,
+        format=ANIMATION_FORMATS[fmt],
+        save_all=True,
+        append_images=frames[1:],
+        duration=int(duration * 1000),
+        loop=0,
+        **options,
+    )
+    return buffer.getvalue()
+
+
+def build_animation(
+    frame_paths,
+    duration,
+    date,
+    bbox,
+    cache_folder="cache",
+    size=DEFAULT_ANIMATION_SIZE,
+    fmt="gif",
+):
+    """Encode ``frame_paths`` into one looping animation and return its cached path.
+
+    Animations are stored in the image cache, keyed by frame hashes and
+    encoding settings, so the same frames are only encoded once. ``date``
+    and ``bbox`` tag the entry for selective eviction.
+    """
+    if fmt not in ANIMATION_FORMATS:
+        raise ValueError(f"Unsupported animation format: {fmt}")
+
+    frame_paths = [Path(path) for path in frame_paths if Path(path).exists()]
+    if not frame_paths:
+        return None
+
+    image_cache = get_image_cache(cache_folder)
+    payload = animation_payload(frame_paths, duration, size, fmt)
+    cached = image_cache.get(payload)
+    if cached:
+        return cached["path"]
+
+    content = _encode(frame_paths, duration, size, fmt)
+    entry = image_cache.put(payload, content, date=date, bbox=bbox, suffix=f".{fmt}")
+    return entry["path"]
@@ -0,0 +1,327 @@
+import math
+import queue
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image
+
+from sentinel_cache import get_image_cache
+from sentinel_catalog import bbox_key
+from sentinel_img import (
+    BIRCHGLETSCHER_BBOX,
+    MAX_PARALLEL_REQUESTS,
+    download_sentinel_composite,
+    download_sentinel_images,
+)
+from sentinel_scheduler import BULK, INTERACTIVE
+from villages import load_village_risk_data
+
+
+# Imagery for monitored sites is fetched per cell of one fixed lon/lat grid,
+# so areas that overlap reuse the same renders. A cell is roughly 3.8 x 3.9 km
+# in the Alps and rendered at the Birchgletscher ground resolution.
+TILE_SIZE_DEG = (0.05, 0.035)
+# Site areas span AOI_TILES x AOI_TILES cells, about the Birchgletscher extent.
+AOI_TILES = 2
+
+
+def tile_at(lon, lat):
+    """Return the ``(column, row)`` grid cell containing a point."""
+    tile_lon, tile_lat = TILE_SIZE_DEG
+    return math.floor(lon / tile_lon), math.floor(lat / tile_lat)
+
+
+def tile_bbox(tile):
+    column, row = tile
+    tile_lon, tile_lat = TILE_SIZE_DEG
+    return [
+        round(column * tile_lon, 5),
+        round(row * tile_lat, 5),
+        round((column + 1) * tile_lon, 5),
+        round((row + 1) * tile_lat, 5),
+    ]
+
+
+def tiles_for_bbox(bbox):
+    """Return the grid cells overlapping ``bbox``, north-west first."""
+    tile_lon, tile_lat = TILE_SIZE_DEG
+    west, south, east, north = (float(value) for value in bbox)
+    # Rounding keeps cells that only touch an aligned edge out of the result.
+    first_column = math.floor(round(west / tile_lon, 6))
+    last_column = math.ceil(round(east / tile_lon, 6)) - 1
+    first_row = math.floor(round(south / tile_lat, 6))
+    last_row = math.ceil(round(north / tile_lat, 6)) - 1
+    return [
+        (column, row)
+        for row in range(last_row, first_row - 1, -1)
+        for column in range(first_column, last_column + 1)
+    ]
+
+
+def is_tile_aligned(bbox):
+    return bbox_key(_cover_bbox(tiles_for_bbox(bbox))) == bbox_key(bbox)
+
+
+def _cover_bbox(tiles):
+    corners = [tile_bbox(tile) for tile in tiles]
+    return [
+        min(corner[0] for corner in corners),
+        min(corner[1] for corner in corners),
+        max(corner[2] for corner in corners),
+        max(corner[3] for corner in corners),
+    ]
+
+
+def site_aoi(lat, lon):
+    """Return the grid-aligned area of interest for a site.
+
+    The area is the block of cells around the grid corner nearest to the
+    site, so the site is never closer than a quarter of the area to an edge.
+    """
+    tile_lon, tile_lat = TILE_SIZE_DEG
+    half = AOI_TILES / 2
+    column = round(lon / tile_lon - half)
+    row = round(lat / tile_lat - half)
+    return _cover_bbox([(column, row), (column + AOI_TILES - 1, row + AOI_TILES - 1)])
+
+
+def _contains(bbox, lon, lat):
+    return bbox[0] <= lon <= bbox[2] and bbox[1] <= lat <= bbox[3]
+
+
+class AoiIndex:
+    """Grid index from tiles to the named areas of interest overlapping them."""
+
+    def __init__(self):
+        self._aois = {}
+        self._tiles = defaultdict(set)
+
+    def add(self, name, bbox):
+        self._aois[name] = list(bbox)
+        for tile in tiles_for_bbox(bbox):
+            self._tiles[tile].add(name)
+
+    def names(self):
+        return list(self._aois)
+
+    def bbox(self, name):
+        return self._aois[name]
+
+    def name_for(self, bbox):
+        """Return the name of the area with exactly ``bbox``, or None."""
+        key = bbox_key(bbox)
+        for name, aoi_bbox in self._aois.items():
+            if bbox_key(aoi_bbox) == key:
+                return name
+        return None
+
+    def tiles(self, name=None):
+        """Return the tiles of one area, or of all areas without duplicates."""
+        if name is not None:
+            return tiles_for_bbox(self._aois[name])
+        return sorted(self._tiles)
+
+    def at(self, lon, lat):
+        """Return the names of the areas containing a point."""
+        candidates = self._tiles.get(tile_at(lon, lat), ())
+        return sorted(name for name in candidates if _contains(self._aois[name], lon, lat))
+
+    def intersecting(self, bbox):
+        """Return the names of the areas overlapping ``bbox``."""
+        west, south, east, north = bbox
+        names = set()
+        for tile in tiles_for_bbox(bbox):
+            names.update(self._tiles.get(tile, ()))
+        return sorted(
+            name
+            for name in names
+            if self._aois[name][0] < east
+            and west < self._aois[name][2]
+            and self._aois[name][1] < north
+            and south < self._aois[name][3]
+        )
+
+
+def build_aoi_index(village_data=None):
+    """Index Birchgletscher and one grid-aligned area per village."""
+    village_data = load_village_risk_data() if village_data is None else village_data
+    index = AoiIndex()
+    index.add("Birchgletscher", BIRCHGLETSCHER_BBOX)
+    for row in village_data.itertuples(index=False):
+        index.add(row.village, site_aoi(row.lat, row.lon))
+    return index
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_aoi_index():
+    """Return the process-wide index of monitored areas."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = build_aoi_index()
+        return _index
+
+
+def cached_images_at(lon, lat, save_folder="cache"):
+    """Return cached Sentinel renders covering a point, newest acquisition first.
+
+    Mosaics, animations and band stacks derived from the renders are left out.
+    """
+    entries = get_image_cache(save_folder).entries().values()
+    covering = [
+        entry for entry in entries if "quality" in entry and _contains(entry["bbox"], lon, lat)
+    ]
+    return sorted(covering, key=lambda entry: entry["date"], reverse=True)
+
+
+def _mosaic(bbox, tile_infos, save_folder):
+    """Stitch tile renders into one image for ``bbox`` and cache it."""
+    tiles = tiles_for_bbox(bbox)
+    payload = {
+        "mosaic": {
+            "bbox": bbox_key(bbox),
+            "tiles": [Path(tile_infos[tile]["file_path"]).name for tile in tiles],
+        }
+    }
+    image_cache = get_image_cache(save_folder)
+    dates = sorted({tile_infos[tile]["date"] for tile in tiles})
+    cached = image_cache.get(payload)
+    if cached:
+        return cached["path"], dates, True
+
+    images = {}
+    for tile in tiles:
+        with Image.open(tile_infos[tile]["file_path"]) as img:
+            images[tile] = img.convert("RGB")
+    width, height = images[tiles[0]].size
+    first_column = min(column for column, _row in tiles)
+    last_row = max(row for _column, row in tiles)
+    columns = len({column for column, _row in tiles})
+    rows = len({row for _column, row in tiles})
+
+    canvas = Image.new("RGB", (width * columns, height * rows))
+    for (column, row), img in images.items():
+        canvas.paste(img, ((column - first_column) * width, (last_row - row) * height))
+    buffer = BytesIO()
+    canvas.save(buffer, format="PNG")
+    entry = image_cache.put(payload, buffer.getvalue(), date=dates[-1], bbox=bbox)
+    return entry["path"], dates, False
+
+
+def _mosaic_info(date, bbox, tile_infos, save_folder):
+    failed = [info for info in tile_infos.values() if not info.get("file_path")]
+    if failed:
+        info = {"date": str(date), "file_path": None, "error": failed[0].get("error")}
+        if any(tile_info.get("retryable") for tile_info in failed):
+            info["retryable"] = True
+        return info
+
+    path, dates, cached = _mosaic(bbox, tile_infos, save_folder)
+    tiles_cached = all(info.get("cached") for info in tile_infos.values())
+    info = {
+        "date": dates[-1],
+        "file_path": path,
+        "cached": cached and tiles_cached,
+        "tile_dates": dates,
+    }
+    contributing = sorted(
+        {day for info in tile_infos.values() for day in info.get("contributing_dates", [])}
+    )
+    if contributing:
+        info["contributing_dates"] = contributing
+    return info
+
+
+def download_aoi_images(
+    dates,
+    bbox,
+    save_folder="cache",
+    max_delta_days=5,
+    quality_thresholds=None,
+    priority=BULK,
+    max_workers=MAX_PARALLEL_REQUESTS,
+):
+    """Yield ``(date, info)`` for an area as each date finishes, fetching tile by tile.
+
+    Each tile is looked up on its own, so a tile shared by several areas is
+    rendered once; a date's mosaic is yielded as soon as all its tiles are
+    in. Tiles may settle on different acquisition dates; they are listed in
+    ``info["tile_dates"]``. Areas off the grid are fetched whole.
+    """
+    if not is_tile_aligned(bbox):
+        yield from download_sentinel_images(
+            dates, save_folder, bbox, max_delta_days, quality_thresholds, priority, max_workers
+        )
+        return
+
+    requested = list(dict.fromkeys(str(date) for date in dates))
+    tiles = tiles_for_bbox(bbox)
+    tile_workers = max(1, min(max_workers, len(tiles)))
+
+    finished = queue.Queue()
+    tile_done = object()
+
+    def fetch_tile(tile):
+        try:
+            for date, info in download_sentinel_images(
+                requested,
+                save_folder,
+                tile_bbox(tile),
+                max_delta_days,
+                quality_thresholds,
+                priority,
+                max(1, max_workers // tile_workers),
+            ):
+                finished.put((tile, date, info))
+        finally:
+            finished.put((tile, tile_done, None))
+
+    by_date = defaultdict(dict)
+    with ThreadPoolExecutor(max_workers=tile_workers) as pool:
+        futures = [pool.submit(fetch_tile, tile) for tile in tiles]
+        running = len(tiles)
+        while running:
+            tile, date, info = finished.get()
+            if date is tile_done:
+                running -= 1
+                continue
+            by_date[date][tile] = info
+            if len(by_date[date]) == len(tiles):
+                yield date, _mosaic_info(date, bbox, by_date.pop(date), save_folder)
+        for future in futures:
+            # Re-raise a tile lookup that failed outright.
+            future.result()
+
+
+def download_aoi_image(date, bbox, save_folder="cache", priority=INTERACTIVE, **kwargs):
+    """Single-date variant of :func:`download_aoi_images`."""
+    for _date, info in download_aoi_images([date], bbox, save_folder, priority=priority, **kwargs):
+        return info
+
+
+def download_aoi_composite(date, bbox, save_folder="cache", max_delta_days=5, priority=INTERACTIVE):
+    """Least-cloud composite for an area, built per tile when grid aligned."""
+    if not is_tile_aligned(bbox):
+        return download_sentinel_composite(date, save_folder, bbox, max_delta_days, priority)
+
+    tiles = tiles_for_bbox(bbox)
+    with ThreadPoolExecutor(max_workers=min(MAX_PARALLEL_REQUESTS, len(tiles))) as pool:
+        futures = {
+            tile: pool.submit(
+                download_sentinel_composite,
+                date,
+                save_folder,
+                tile_bbox(tile),
+                max_delta_days,
+                priority,
+            )
+            for tile in tiles
+        }
+        tile_infos = {tile: future.result() for tile, future in futures.items()}
+    return _mosaic_info(date, bbox, tile_infos, save_folder)
@@ -1,134 +1,142 @@
+import base64
 import html
-import json
+import os
 import re
 import time
-import uuid
-from datetime import date, datetime, timedelta, timezone
+from datetime import date, timedelta
 from pathlib import Path
 
-import pandas as pd
 import streamlit as st
-from PIL import Image
-from sentinel_img import download_sentinel_image
 from streamlit_option_menu import option_menu
 
+from metrics import get_metrics, start_metrics_server
+
+# Streamlit re-runs this script on every interaction. Modules used by only
+# one page (pandas, PIL, the Sentinel pipeline) are imported inside the
+# functions that need them, so a rerun only touches the selected page.
+
 
 CACHE_DIR = Path("cache")
 REPORTS_DIR = Path("reports")
+REPORTS_PER_PAGE = 20
+ATTACHMENT_THUMBNAILS_PER_ROW = 4
 LOGO_PATH = Path(__file__).with_name("git.png")
-MAX_ANIMATION_DAYS = 14
-
-RISK_COLORS = {
-    "Safe": "#10b981",
-    "Medium": "#f59e0b",
-    "High": "#ef4444",
+MAX_ANIMATION_DAYS = 31
+VILLAGE_CARDS_PER_PAGE = 20
+VILLAGE_SEARCH_LIMIT = 50
+RECENT_SPANS_SHOWN = 50
+APP_CSS = """<style>
+.block-container { padding-top: .6rem; }
+hr { margin: .6rem 0 1rem 0; }
+.centered {
+    display: flex;
+    align-items: center;
+    justify-content: center;
+}
+.hero { padding:.6rem 0 1rem 0; text-align:center; }
+.hero h1 { margin:0; font-size:2.0rem; }
+.hero p  { margin:.2rem 0 0 0; color:#4b5563; font-size:1.05rem; }
+.pill {
+    display:inline-block;
+    padding:.2rem .55rem;
+    border-radius:999px;
+    font-weight:600;
+    font-size:.82rem;
+    margin-right:.35rem;
+}
+.pill-safe {
+    background:rgba(16,185,129,.12);
+    color:#0f766e;
+    border:1px solid rgba(16,185,129,.35);
+}
+.pill-med {
+    background:rgba(245,158,11,.12);
+    color:#92400e;
+    border:1px solid rgba(245,158,11,.35);
+}
+.pill-high {
+    background:rgba(239,68,68,.13);
+    color:#991b1b;
+    border:1px solid rgba(239,68,68,.35);
+}
+.soft-card {
+    border:1px solid #e5e7eb;
+    border-radius:8px;
+    padding:14px;
+    background:#fff;
+    margin-bottom:.7rem;
+}
+.muted { color:#6b7280; font-size:.9rem; }
+.navbar {
+    position: sticky;
+    top: 0;
+    z-index: 999;
+    background: rgba(255,255,255,0.97);
+    border-bottom: 1px solid #e5e7eb;
+    padding: 0.3rem 0;
+}
+ul.streamlit-option-menu.navbar > li > a {
+    font-weight: 600;
+    font-size: 15px;
+    color: #333;
+    padding: 8px 16px;
 }
+ul.streamlit-option-menu.navbar > li.active > a {
+    border-bottom: 3px solid #0055a4;
+    color: #0055a4;
+}
+</style>
+"""
+FOOTER_HTML = """
+---
+<div style='text-align:center;color:gray;font-size:.9rem;margin-top:2em;'>
+  Developed by <b>Yuliia Melnychuk</b>, <b>Mike Dylan Poppelaars</b>, <b>Borys Tereschenko</b><br>
+  Substantially improved by <b>Mike Dylan Poppelaars</b><br>
+  &copy; 2026 Fachverein Physik der UZH - All rights reserved
+</div>
+"""
+
+
+@st.cache_resource
+def logo_bytes():
+    return LOGO_PATH.read_bytes()
 
 
-icon_img = Image.open(LOGO_PATH)
+render_started = time.perf_counter()
 st.set_page_config(
     page_title="Fachverein Physik der UZH",
-    page_icon=icon_img,
+    page_icon=str(LOGO_PATH),
     layout="wide",
 )
 
 
-def risk_level(score):
-    if score >= 0.66:
-        return "High"
-    if score >= 0.33:
-        return "Medium"
-    return "Safe"
+@st.cache_resource
+def prefetch_worker(interval_minutes):
+    from prefetch import start_prefetch_worker
 
+    return start_prefetch_worker(interval_minutes * 60, save_folder=str(CACHE_DIR))
 
-def load_village_risk_data():
-    """Fixed demonstration data until the prediction model is connected."""
-    data = [
-        {
-            "village": "Blatten (Loetschen)",
-            "lat": 46.417,
-            "lon": 7.822,
-            "risk_score": 0.82,
-            "signal": "Steep terrain and nearby glacier/rockfall exposure",
-        },
-        {
-            "village": "Zermatt",
-            "lat": 46.020,
-            "lon": 7.749,
-            "risk_score": 0.58,
-            "signal": "Glacier proximity and narrow valley corridors",
-        },
-        {
-            "village": "Saas-Fee",
-            "lat": 46.108,
-            "lon": 7.928,
-            "risk_score": 0.61,
-            "signal": "High alpine slopes and debris-flow pathways",
-        },
-        {
-            "village": "Grindelwald",
-            "lat": 46.624,
-            "lon": 8.036,
-            "risk_score": 0.70,
-            "signal": "Known unstable slopes and rapid meltwater channels",
-        },
-        {
-            "village": "Andermatt",
-            "lat": 46.639,
-            "lon": 8.594,
-            "risk_score": 0.34,
-            "signal": "Moderate slope exposure around transport corridors",
-        },
-        {
-            "village": "Pontresina",
-            "lat": 46.491,
-            "lon": 9.905,
-            "risk_score": 0.43,
-            "signal": "Avalanche paths and glacial catchments nearby",
-        },
-        {
-            "village": "Arosa",
-            "lat": 46.779,
-            "lon": 9.680,
-            "risk_score": 0.28,
-            "signal": "Lower current demo score for mapped settlement area",
-        },
-        {
-            "village": "Leukerbad",
-            "lat": 46.379,
-            "lon": 7.628,
-            "risk_score": 0.52,
-            "signal": "Rock-wall exposure and steep approach valleys",
-        },
-        {
-            "village": "Wengen",
-            "lat": 46.605,
-            "lon": 7.921,
-            "risk_score": 0.40,
-            "signal": "Slope exposure above transport routes",
-        },
-        {
-            "village": "Lauterbrunnen",
-            "lat": 46.593,
-            "lon": 7.907,
-            "risk_score": 0.67,
-            "signal": "Narrow valley floor beneath steep rock walls",
-        },
-    ]
-    df = pd.DataFrame(data)
-    df["risk_level"] = df["risk_score"].apply(risk_level)
-    df["marker_color"] = df["risk_level"].map(RISK_COLORS)
-    df["marker_size"] = (100 + df["risk_score"] * 180).round()
-    return df
+
+# Opt-in: keep the last week of imagery warm for all areas of interest.
+if os.getenv("SENTINEL_PREFETCH_INTERVAL_MINUTES"):
+    prefetch_worker(float(os.environ["SENTINEL_PREFETCH_INTERVAL_MINUTES"]))
+
+# Opt-in: serve Prometheus metrics on http://127.0.0.1:<port>/metrics.
+if os.getenv("SENTINEL_METRICS_PORT"):
+    start_metrics_server(int(os.environ["SENTINEL_METRICS_PORT"]))
 
 
 def clear_cache(folder_path=CACHE_DIR):
+    from sentinel_cache import get_image_cache, get_negative_cache
+
     image_extensions = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tiff", ".webp"}
     folder = Path(folder_path)
     if not folder.exists():
         return 0
 
-    deleted = 0
+    deleted = get_image_cache(folder).clear()
+    get_negative_cache(folder / "negative_cache.json").clear()
+    # Images cached before the content-addressed layout sit directly in the folder.
     for file_path in folder.iterdir():
         if file_path.is_file() and file_path.suffix.lower() in image_extensions:
             file_path.unlink()
@@ -136,36 +144,207 @@ def clear_cache(folder_path=CACHE_DIR):
     return deleted
 
 
-def animate_sentinel_images(image_paths, duration):
-    valid_images = [Path(path) for path in image_paths if Path(path).exists()]
-    if not valid_images:
-        st.warning("No valid image files found.")
-        return
+def aoi_label(bbox):
+    from aoi import get_aoi_index
+
+    name = get_aoi_index().name_for(bbox)
+    if name:
+        return name
+    return "bbox " + ", ".join(f"{value:.3f}" for value in bbox)
+
+
+def render_cache_controls(folder_path=CACHE_DIR):
+    from sentinel_cache import get_image_cache
+    from sentinel_scheduler import get_scheduler
+
+    image_cache = get_image_cache(folder_path)
+    entries = image_cache.entries().values()
+    used_mb = sum(entry["size_bytes"] for entry in entries) / (1024 * 1024)
+    budget_mb = image_cache.max_bytes / (1024 * 1024)
+    st.caption(
+        f"{len(entries)} cached image(s) using {used_mb:.1f} of {budget_mb:.0f} MB. "
+        "The least recently viewed images are evicted when the budget is exceeded."
+    )
+    scheduler = get_scheduler()
+    used_today, used_month = scheduler.usage()
+    st.caption(
+        f"Sentinel Hub processing units: {used_today:.0f} of {scheduler.daily_budget:.0f} "
+        f"today, {used_month:.0f} of {scheduler.monthly_budget:.0f} this month."
+    )
+
+    aois = {"All areas": None}
+    for bbox in sorted({tuple(entry["bbox"]) for entry in entries}):
+        aois[aoi_label(bbox)] = list(bbox)
+
+    aoi_col, range_col = st.columns(2)
+    with aoi_col:
+        aoi = st.selectbox("Area", list(aois), key="evict_aoi")
+    with range_col:
+        evict_range = st.date_input("Dates (optional)", value=(), key="evict_range")
+
+    start = str(evict_range[0]) if len(evict_range) > 0 else None
+    end = str(evict_range[1]) if len(evict_range) > 1 else start
+
+    evict_col, clear_col = st.columns(2)
+    with evict_col:
+        if st.button("Evict selected images"):
+            evicted = image_cache.evict(bbox=aois[aoi], start=start, end=end)
+            st.success(f"Evicted {evicted} cached image(s).")
+    with clear_col:
+        if st.button("Clear image cache"):
+            deleted = clear_cache(folder_path)
+            st.success(f"Cleared {deleted} cached image(s).")
+
+
+def render_cached_coverage(village, folder_path=CACHE_DIR):
+    from aoi import cached_images_at
+
+    cached = cached_images_at(float(village["lon"]), float(village["lat"]), folder_path)
+    if cached:
+        st.caption(
+            f"{len(cached)} cached render(s) cover {village['village']}, the latest from "
+            f"{cached[0]['date']}; they are reused without new requests."
+        )
+    else:
+        st.caption(f"No cached imagery covers {village['village']} yet.")
+
+
+def _label_text(labels, skip=()):
+    return ", ".join(f"{name}={value}" for name, value in labels.items() if name not in skip)
+
+
+def render_diagnostics():
+    """Process-wide stage timings and counters since start-up (hidden page)."""
+    import pandas as pd
 
-    img_placeholder = st.empty()
-    progress = st.progress(0)
-    status_text = st.empty()
+    st.header("Diagnostics")
+    metrics = get_metrics()
+    snapshot = metrics.snapshot()
+    st.caption(
+        "Collected in this server process since it started, across all sessions. "
+        "Set SENTINEL_METRICS_PORT to scrape the same data from /metrics."
+    )
+
+    stages = [
+        {
+            "stage": histogram["labels"].get("stage"),
+            "labels": _label_text(histogram["labels"], skip=("stage",)),
+            "count": histogram["count"],
+            "total_s": round(histogram["sum"], 3),
+            "mean_ms": round(histogram["sum"] / histogram["count"] * 1000, 2),
+            "max_ms": round(histogram["max"] * 1000, 2),
+        }
+        for histogram in snapshot["histograms"]
+        if histogram["name"] == "stage_seconds" and histogram["count"]
+    ]
+    st.subheader("Stage timings")
+    if stages:
+        st.dataframe(
+            pd.DataFrame(stages).sort_values("total_s", ascending=False),
+            hide_index=True,
+            use_container_width=True,
+        )
+    else:
+        st.info("No stages recorded yet.")
+
+    probes = next(
+        (h for h in snapshot["histograms"] if h["name"] == "lookup_candidates_probed"), None
+    )
+    if probes and probes["count"]:
+        st.caption(
+            f"{probes['count']} lookups probed {probes['sum'] / probes['count']:.2f} "
+            f"candidate dates on average (max {probes['max']:.0f})."
+        )
 
-    total = len(valid_images)
-    for idx, path in enumerate(valid_images):
-        img_placeholder.image(
-            str(path),
+    st.subheader("Counters")
+    if snapshot["counters"]:
+        st.dataframe(
+            pd.DataFrame(
+                {
+                    "counter": counter["name"],
+                    "labels": _label_text(counter["labels"]),
+                    "value": counter["value"],
+                }
+                for counter in snapshot["counters"]
+            ),
+            hide_index=True,
             use_container_width=True,
-            caption=f"Frame {idx + 1} of {total}",
         )
-        status_text.text(f"Showing image {idx + 1}/{total}")
-        progress.progress((idx + 1) / total)
-        time.sleep(duration)
 
-    progress.empty()
-    status_text.empty()
-    st.success("Animation finished.")
+    st.subheader("Recent spans")
+    spans = snapshot["spans"][-RECENT_SPANS_SHOWN:][::-1]
+    if spans:
+        st.dataframe(
+            pd.DataFrame(
+                {
+                    "stage": recorded["stage"],
+                    "labels": _label_text(recorded["labels"]),
+                    "parent": recorded["parent"] or "",
+                    "thread": recorded["thread"],
+                    "duration_ms": recorded["duration_ms"],
+                }
+                for recorded in spans
+            ),
+            hide_index=True,
+            use_container_width=True,
+        )
+
+    exposition = metrics.render()
+    st.download_button(
+        "Download metrics", exposition, file_name="metrics.prom", mime="text/plain"
+    )
+    with st.expander("Prometheus text"):
+        st.code(exposition, language="text")
+    if st.button("Reset metrics"):
+        metrics.reset()
+        st.rerun()
+
+
+def show_animation(path, fmt):
+    from animation import ANIMATION_MIME_TYPES
+
+    if fmt == "gif":
+        st.image(path, use_container_width=True)
+        return
+
+    # st.image re-encodes non-GIF images to a still frame, so embed WebP directly.
+    encoded = base64.b64encode(Path(path).read_bytes()).decode("ascii")
+    st.markdown(
+        f'<img src="data:{ANIMATION_MIME_TYPES[fmt]};base64,{encoded}" style="width:100%">',
+        unsafe_allow_html=True,
+    )
+
+
+def cached_animation(frames, duration, size, fmt, bbox):
+    """Build (or reuse) the animation for ``frames``, memoized per session."""
+    from animation import build_animation
+
+    key = (tuple(path for _date, path in frames), duration, size, fmt)
+    built = st.session_state.setdefault("built_animations", {})
+    if key not in built or not Path(built[key]).exists():
+        built[key] = build_animation(
+            [path for _date, path in frames],
+            duration,
+            date=frames[-1][0],
+            bbox=bbox,
+            cache_folder=CACHE_DIR,
+            size=size,
+            fmt=fmt,
+        )
+    return built[key]
 
 
 def show_sentinel_result(info, requested_date, label="Birchgletscher"):
     if info and info.get("file_path"):
         source = "cached" if info.get("cached") else "downloaded"
-        st.caption(f"{label} on {info['date']} ({source})")
+        if info.get("contributing_dates"):
+            dates = ", ".join(info["contributing_dates"])
+            st.caption(f"{label}, least-cloud composite of {dates} ({source})")
+        elif len(info.get("tile_dates", [])) > 1:
+            dates = ", ".join(info["tile_dates"])
+            st.caption(f"{label}, mosaic of tiles acquired on {dates} ({source})")
+        else:
+            st.caption(f"{label} on {info['date']} ({source})")
         st.image(info["file_path"], use_container_width=True)
         return
 
@@ -173,50 +352,116 @@ def show_sentinel_result(info, requested_date, label="Birchgletscher"):
     st.warning(f"No image found for {requested_date}. {error}")
 
 
+def show_change_result(change):
+    summary = change["summary"]
+    st.markdown("#### Detected changes")
+    area_col, share_col, region_col = st.columns(3)
+    area_col.metric("Changed area", f"{summary['changed_area_km2']:.2f} km²")
+    share_col.metric("Share of compared area", f"{summary['changed_fraction']:.1%}")
+    region_col.metric("Changed regions", summary["region_count"])
+    st.caption(
+        f"Changes from {summary['before_date']} to {summary['after_date']} in red; "
+        f"{summary['compared_fraction']:.0%} of the area was cloud-free in both images."
+    )
+    st.image(change["file_path"], use_container_width=True)
+    if summary["regions"]:
+        st.dataframe(summary["regions"], use_container_width=True)
+
+
 def is_valid_email(email):
     return re.fullmatch(r"[^@\s]+@[^@\s]+\.[^@\s]+", email or "") is not None
 
 
-def safe_attachment_name(uploaded_file, index):
-    original = Path(uploaded_file.name)
-    stem = re.sub(r"[^A-Za-z0-9._-]+", "_", original.stem).strip("._")
-    suffix = original.suffix.lower()
-    return f"{index:02d}_{stem or 'attachment'}{suffix}"
-
-
-def save_report(name, email, message, uploaded_files):
-    created_at = datetime.now(timezone.utc)
-    report_id = f"{created_at:%Y%m%dT%H%M%SZ}_{uuid.uuid4().hex[:8]}"
-    report_dir = REPORTS_DIR / report_id
-    report_dir.mkdir(parents=True, exist_ok=False)
-
-    saved_files = []
-    for index, uploaded_file in enumerate(uploaded_files or [], start=1):
-        file_name = safe_attachment_name(uploaded_file, index)
-        file_data = uploaded_file.getbuffer()
-        (report_dir / file_name).write_bytes(file_data)
-        saved_files.append(
-            {
-                "original_name": uploaded_file.name,
-                "stored_name": file_name,
-                "content_type": uploaded_file.type,
-                "size_bytes": len(file_data),
-            }
+def render_report_status():
+    from report_queue import FAILED, STORED, UNKNOWN, get_report_queue
+
+    report_id = st.text_input(
+        "Check a report by reference",
+        value=st.session_state.get("last_report_id", ""),
+        key="status_reference",
+    ).strip()
+    if not report_id:
+        return
+    state, error = get_report_queue(REPORTS_DIR).status(report_id)
+    if state == STORED:
+        st.caption(f"Report {report_id} is saved." + (f" {error}" if error else ""))
+    elif state == FAILED:
+        st.caption(
+            f"Report {report_id} could not be saved: {error} "
+            "It will be retried when the app restarts."
         )
+    elif state == UNKNOWN:
+        st.caption(f"No report with reference {report_id}.")
+    elif error:
+        st.caption(f"Saving report {report_id} failed ({error}); it will be retried shortly.")
+    else:
+        st.caption(f"Report {report_id} is {state}; check again in a moment.")
+
+
+def render_report_attachments(attachments):
+    """Show attachment thumbnails; originals are only read when downloaded."""
+    columns = st.columns(ATTACHMENT_THUMBNAILS_PER_ROW)
+    for index, attachment in enumerate(attachments):
+        with columns[index % len(columns)]:
+            name = attachment["original_name"]
+            if attachment.get("thumbnail"):
+                caption = name
+                if attachment.get("captured_at"):
+                    caption += f" · taken {attachment['captured_at'][:16].replace('T', ' ')}"
+                st.image(attachment["thumbnail"], caption=caption)
+            elif attachment.get("details") and attachment["details"].get("error"):
+                st.caption(f"{name}: no preview ({attachment['details']['error']})")
+            else:
+                st.caption(f"{name}: preview pending")
 
-    payload = {
-        "id": report_id,
-        "created_at_utc": created_at.isoformat(),
-        "name": name.strip(),
-        "email": email.strip(),
-        "message": message.strip(),
-        "attachments": saved_files,
-    }
-    (report_dir / "report.json").write_text(
-        json.dumps(payload, indent=2),
-        encoding="utf-8",
-    )
-    return report_id, report_dir
+
+def render_report_triage(page_size=REPORTS_PER_PAGE):
+    import pandas as pd
+    from report_store import get_report_store
+
+    store = get_report_store(REPORTS_DIR)
+    query = st.text_input("Search messages", key="triage_query")
+    report_range = st.date_input("Received between", value=(), key="triage_range")
+    start = str(report_range[0]) if len(report_range) > 0 else None
+    end_day = report_range[1] if len(report_range) > 1 else report_range[0] if start else None
+    end = str(end_day + timedelta(days=1)) if end_day else None
+
+    total = store.count_reports(query, start, end)
+    if not total:
+        st.info("No reports match.")
+        return
+
+    pages = max(1, -(-total // page_size))
+    page = 1
+    if pages > 1:
+        page = st.number_input(
+            f"Page (of {pages})",
+            min_value=1,
+            max_value=pages,
+            value=1,
+            key=f"triage_page:{query}:{start}:{end}",
+        )
+    reports = store.list_reports(query, start, end, limit=page_size, offset=(page - 1) * page_size)
+    st.caption(f"{total} report(s), newest first.")
+    locations = store.report_locations([report["id"] for report in reports])
+    if locations:
+        st.map(
+            pd.DataFrame(list(locations.values()), columns=["lat", "lon"]),
+            latitude="lat",
+            longitude="lon",
+            size=300,
+            height=300,
+        )
+    for report in reports:
+        received = report["created_at"][:16].replace("T", " ")
+        attachments = f" · {report['attachments']} attachment(s)" if report["attachments"] else ""
+        located = " · 📍 located from photo" if report["id"] in locations else ""
+        st.markdown(
+            f"**{html.escape(report['name'])}** · {received} UTC{attachments}{located}  \n"
+            f"{html.escape(report['message'][:300])}"
+        )
+        if report["attachments"]:
+            render_report_attachments(store.attachments(report["id"]))
 
 
 def render_risk_pill(level):
@@ -228,6 +473,39 @@ def render_risk_pill(level):
     return f"<span class='pill {css_class}'>{level}</span>"
 
 
+def village_card(row):
+    return f"""
+        <div class="soft-card">
+          <div style="display:flex;justify-content:space-between;gap:1rem;align-items:center;">
+            <div>
+              <b>{html.escape(row.village)}</b><br>
+              <span class="muted">lat {row.lat:.3f}, lon {row.lon:.3f}</span>
+            </div>
+            <div>{render_risk_pill(str(row.risk_level))}</div>
+          </div>
+          <div class="muted" style="margin-top:.4rem;">
+            Risk score (0-1): {row.risk_score:.2f}<br>
+            Signal: {html.escape(row.signal)}
+          </div>
+        </div>
+    """
+
+
+def render_village_cards(village_data, key="village_page"):
+    """Render one page of village cards as a single markdown block."""
+    pages = max(1, -(-len(village_data) // VILLAGE_CARDS_PER_PAGE))
+    page = 1
+    if pages > 1:
+        page = st.number_input(
+            f"Page (of {pages})", min_value=1, max_value=pages, value=1, key=key
+        )
+    start = (page - 1) * VILLAGE_CARDS_PER_PAGE
+    rows = village_data.iloc[start : start + VILLAGE_CARDS_PER_PAGE]
+    st.caption(f"Showing {start + 1}-{start + len(rows)} of {len(village_data)} villages.")
+    cards = "".join(village_card(row) for row in rows.itertuples(index=False))
+    st.markdown(cards, unsafe_allow_html=True)
+
+
 def selected_dates(start, end):
     current = start
     while current <= end:
@@ -235,102 +513,21 @@ def selected_dates(start, end):
         current += timedelta(days=1)
 
 
-st.markdown(
-    """
-<style>
-.block-container { padding-top: .6rem; }
-hr { margin: .6rem 0 1rem 0; }
-.centered {
-    display: flex;
-    align-items: center;
-    justify-content: center;
-}
-.hero { padding:.6rem 0 1rem 0; text-align:center; }
-.hero h1 { margin:0; font-size:2.0rem; }
-.hero p  { margin:.2rem 0 0 0; color:#4b5563; font-size:1.05rem; }
-.pill {
-    display:inline-block;
-    padding:.2rem .55rem;
-    border-radius:999px;
-    font-weight:600;
-    font-size:.82rem;
-    margin-right:.35rem;
-}
-.pill-safe {
-    background:rgba(16,185,129,.12);
-    color:#0f766e;
-    border:1px solid rgba(16,185,129,.35);
-}
-.pill-med {
-    background:rgba(245,158,11,.12);
-    color:#92400e;
-    border:1px solid rgba(245,158,11,.35);
-}
-.pill-high {
-    background:rgba(239,68,68,.13);
-    color:#991b1b;
-    border:1px solid rgba(239,68,68,.35);
-}
-.soft-card {
-    border:1px solid #e5e7eb;
-    border-radius:8px;
-    padding:14px;
-    background:#fff;
-    margin-bottom:.7rem;
-}
-.muted { color:#6b7280; font-size:.9rem; }
-.navbar {
-    position: sticky;
-    top: 0;
-    z-index: 999;
-    background: rgba(255,255,255,0.97);
-    border-bottom: 1px solid #e5e7eb;
-    padding: 0.3rem 0;
-}
-ul.streamlit-option-menu.navbar > li > a {
-    font-weight: 600;
-    font-size: 15px;
-    color: #333;
-    padding: 8px 16px;
-}
-ul.streamlit-option-menu.navbar > li.active > a {
-    border-bottom: 3px solid #0055a4;
-    color: #0055a4;
-}
-</style>
-""",
-    unsafe_allow_html=True,
-)
+def render_header():
+    st.markdown(APP_CSS, unsafe_allow_html=True)
+    c1, c2 = st.columns([1, 6], gap="small")
+    with c1:
+        st.image(logo_bytes(), width=120)
+    with c2:
+        st.markdown('<div class="centered">', unsafe_allow_html=True)
+        st.markdown("## Fachverein Physik der UZH")
+        st.markdown("</div>", unsafe_allow_html=True)
 
-c1, c2 = st.columns([1, 6], gap="small")
-with c1:
-    st.image(icon_img, width=120)
-with c2:
-    st.markdown('<div class="centered">', unsafe_allow_html=True)
-    st.markdown("## Fachverein Physik der UZH")
-    st.markdown("</div>", unsafe_allow_html=True)
 
-st.divider()
+def page_main_site():
+    from report_queue import QueueFull, get_report_queue
+    from villages import load_village_risk_data, village_search_index
 
-selected = option_menu(
-    None,
-    ["Main Site", "Find Previous Data", "AI Prediction"],
-    icons=["house", "calendar3", "cpu"],
-    orientation="horizontal",
-    styles={
-        "container": {"padding": "0!important", "background-color": "transparent"},
-        "nav": {"justify-content": "center"},
-        "nav-link": {"text-align": "center", "margin": "0px"},
-        "nav-link-selected": {
-            "color": "#0055a4",
-            "border-bottom": "3px solid #0055a4",
-        },
-    },
-)
-
-st.divider()
-
-if selected == "Main Site":
     st.markdown(
         """
     <div class="hero">
@@ -363,13 +560,11 @@ if selected == "Main Site":
             unsafe_allow_html=True,
         )
 
-        df_show = (
-            village_data[
-                village_data["village"].str.contains(q, case=False, na=False)
-            ]
-            if q
-            else village_data
-        )
+        if q:
+            matches = village_search_index().search(q, limit=VILLAGE_SEARCH_LIMIT)
+            df_show = village_data.iloc[[position for position, _score in matches]]
+        else:
+            df_show = village_data
 
         if df_show.empty:
             st.info("No village matches that search.")
@@ -385,26 +580,9 @@ if selected == "Main Site":
             )
 
         st.markdown("#### Villages and Risk Levels")
-        for _, row in df_show.iterrows():
-            level = str(row["risk_level"])
-            st.markdown(
-                f"""
-                <div class="soft-card">
-                  <div style="display:flex;justify-content:space-between;gap:1rem;align-items:center;">
-                    <div>
-                      <b>{html.escape(row['village'])}</b><br>
-                      <span class="muted">lat {row['lat']:.3f}, lon {row['lon']:.3f}</span>
-                    </div>
-                    <div>{render_risk_pill(level)}</div>
-                  </div>
-                  <div class="muted" style="margin-top:.4rem;">
-                    Risk score (0-1): {row['risk_score']:.2f}<br>
-                    Signal: {html.escape(row['signal'])}
-                  </div>
-                </div>
-                """,
-                unsafe_allow_html=True,
-            )
+        if not df_show.empty:
+            # A new search starts again on its first page.
+            render_village_cards(df_show, key=f"village_page:{q}")
 
     with col_right:
         st.subheader("Contact Form")
@@ -430,15 +608,23 @@ if selected == "Main Site":
                 elif not is_valid_email(email.strip()):
                     st.warning("Please enter a valid email address.")
                 else:
-                    report_id, _report_dir = save_report(name, email, message, files)
-                    st.success(f"Report saved. Reference: {report_id}")
-                    st.toast("Report saved successfully")
+                    try:
+                        report_id = get_report_queue(REPORTS_DIR).submit(
+                            name, email, message, files
+                        )
+                    except QueueFull as exc:
+                        st.warning(str(exc))
+                    else:
+                        st.session_state["last_report_id"] = report_id
+                        st.success(f"Report received. Reference: {report_id}")
+                        st.toast("Report received")
+
+        render_report_status()
 
         st.markdown("---")
         st.subheader("Today's Summary")
-        safe = int((village_data["risk_level"] == "Safe").sum())
-        med = int((village_data["risk_level"] == "Medium").sum())
-        high = int((village_data["risk_level"] == "High").sum())
+        counts = village_data["risk_level"].value_counts()
+        safe, med, high = (int(counts[level]) for level in ("Safe", "Medium", "High"))
         st.write(
             f"<span class='pill pill-safe'>Safe: {safe}</span> "
             f"<span class='pill pill-med'>Medium: {med}</span> "
@@ -446,16 +632,25 @@ if selected == "Main Site":
             unsafe_allow_html=True,
         )
 
-elif selected == "Find Previous Data":
+        st.markdown("---")
+        with st.expander("Report triage"):
+            render_report_triage()
+
+
+def page_find_previous_data():
+    from animation import ANIMATION_FORMATS
+    from aoi import download_aoi_composite, download_aoi_image, download_aoi_images, get_aoi_index
+    from change_detection import detect_changes
+    from sentinel_scheduler import INTERACTIVE
+    from villages import load_village_risk_data, village_search_index
+
     pad_left, main, pad_right = st.columns([1, 8, 1])
     with main:
         with st.expander("Image cache"):
-            st.caption("Downloaded Sentinel images are reused until the cache is cleared.")
-            if st.button("Clear image cache"):
-                deleted = clear_cache()
-                st.success(f"Cleared {deleted} cached image(s).")
+            render_cache_controls()
 
-        col_mode, _col_date = st.columns([3, 2], gap="large")
+        aoi_index = get_aoi_index()
+        col_mode, col_area = st.columns([3, 2], gap="large")
         with col_mode:
             option_prev = st.radio(
                 "Visualization mode",
@@ -463,6 +658,24 @@ elif selected == "Find Previous Data":
                 horizontal=True,
                 label_visibility="collapsed",
             )
+        with col_area:
+            place = st.text_input(
+                "Find areas covering a village",
+                placeholder="Village name, e.g. Zermatt",
+                key="imagery_place",
+            )
+            names, village = aoi_index.names(), None
+            matches = village_search_index().search(place, limit=1) if place else []
+            if matches:
+                village = load_village_risk_data().iloc[matches[0][0]]
+                covering = aoi_index.at(float(village["lon"]), float(village["lat"]))
+                if covering:
+                    # The village's own area first, then areas that overlap it.
+                    names = sorted(covering, key=lambda name: name != village["village"])
+            area = st.selectbox("Area", names, key="imagery_area")
+            if village is not None:
+                render_cached_coverage(village)
+        area_bbox = aoi_index.bbox(area)
 
         if option_prev == "Photo by date":
             tdate = st.date_input(
@@ -472,11 +685,21 @@ elif selected == "Find Previous Data":
                 key="analysis_date",
             )
 
+            lookup_mode = st.radio(
+                "Image source",
+                ("Least-cloud composite (+/- 5 days)", "Nearest clear acquisition"),
+                horizontal=True,
+                key="lookup_mode",
+            )
+
             if tdate:
                 if st.button("Show image"):
                     with st.spinner("Looking up Sentinel imagery..."):
-                        data = download_sentinel_image(str(tdate))
-                    show_sentinel_result(data, str(tdate))
+                        if lookup_mode.startswith("Least-cloud"):
+                            data = download_aoi_composite(str(tdate), area_bbox)
+                        else:
+                            data = download_aoi_image(str(tdate), area_bbox)
+                    show_sentinel_result(data, str(tdate), label=area)
             else:
                 st.info("Please select a date to display the image.")
 
@@ -488,16 +711,30 @@ elif selected == "Find Previous Data":
             with right_col:
                 date_right = st.date_input("Select date 2", value=None, key="date_right")
 
+            detect = st.checkbox("Highlight changes between the dates", key="detect_changes")
+
             if date_left and date_right:
                 if st.button("Show images"):
                     with st.spinner("Looking up Sentinel imagery..."):
-                        info_left = download_sentinel_image(str(date_left))
-                        info_right = download_sentinel_image(str(date_right))
+                        results = dict(
+                            download_aoi_images(
+                                [str(date_left), str(date_right)],
+                                area_bbox,
+                                priority=INTERACTIVE,
+                            )
+                        )
+                    info_left = results[str(date_left)]
+                    info_right = results[str(date_right)]
 
                     with left_col:
-                        show_sentinel_result(info_left, str(date_left))
+                        show_sentinel_result(info_left, str(date_left), label=area)
                     with right_col:
-                        show_sentinel_result(info_right, str(date_right))
+                        show_sentinel_result(info_right, str(date_right), label=area)
+
+                    if detect and info_left.get("file_path") and info_right.get("file_path"):
+                        with st.spinner("Detecting changes..."):
+                            change = detect_changes(info_left, info_right, area_bbox, CACHE_DIR)
+                        show_change_result(change)
             else:
                 st.info("Please select both dates to display images.")
 
@@ -515,9 +752,23 @@ elif selected == "Find Previous Data":
                 key="animation_end",
             )
             duration = st.slider("Display time per image (s)", 0.5, 5.0, 1.5, 0.5)
-
-            st.session_state.setdefault("animation_images", [])
-            st.session_state.setdefault("animation_duration", duration)
+            size_col, format_col = st.columns(2)
+            with size_col:
+                animation_size = st.select_slider(
+                    "Animation size (px)", options=[256, 512, 768, 1024], value=512
+                )
+            with format_col:
+                animation_format = st.radio(
+                    "Format",
+                    list(ANIMATION_FORMATS),
+                    format_func=str.upper,
+                    horizontal=True,
+                )
+
+            # Frames belong to one area; switching areas starts over.
+            if st.session_state.get("animation_area") != area:
+                st.session_state["animation_area"] = area
+                st.session_state["animation_frames"] = []
 
             if end < start:
                 st.warning("End date must be on or after start date.")
@@ -529,59 +780,144 @@ elif selected == "Find Previous Data":
                         "to avoid excessive Sentinel API calls."
                     )
                 elif st.button("Start Animation"):
-                    unique_images = []
-                    seen_dates = set()
+                    found = {}
                     progress = st.progress(0)
                     status_text = st.empty()
 
                     st.info("Downloading available Sentinel images...")
-                    for index, current_date in enumerate(dates, start=1):
-                        date_str = str(current_date)
-                        info = download_sentinel_image(date_str)
+                    date_strs = [str(current_date) for current_date in dates]
+                    results = download_aoi_images(date_strs, area_bbox)
+                    for index, (date_str, info) in enumerate(results, start=1):
+                        if info and info.get("file_path"):
+                            found.setdefault(info["date"], info["file_path"])
 
-                        if info and info.get("file_path") and info["date"] not in seen_dates:
-                            unique_images.append(info["file_path"])
-                            seen_dates.add(info["date"])
-
-                        progress.progress(index / len(dates))
+                        progress.progress(index / len(date_strs))
                         status_text.text(f"Processed date: {date_str}")
 
                     progress.empty()
                     status_text.empty()
-                    st.session_state["animation_images"] = unique_images
-                    st.session_state["animation_duration"] = duration
+                    frames = [(image_date, found[image_date]) for image_date in sorted(found)]
+                    st.session_state["animation_frames"] = frames
 
-                    if not unique_images:
+                    if not frames:
                         st.warning("No unique images found in the selected date range.")
                     else:
-                        st.success(
-                            f"Found {len(unique_images)} unique images. Starting animation..."
-                        )
-                        animate_sentinel_images(unique_images, duration)
+                        st.success(f"Found {len(frames)} unique images.")
 
-            if st.session_state.get("animation_images"):
-                if st.button("Replay Animation"):
-                    animate_sentinel_images(
-                        st.session_state["animation_images"],
-                        st.session_state["animation_duration"],
+            frames = st.session_state.get("animation_frames")
+            if frames:
+                with st.spinner("Encoding animation..."):
+                    animation_path = cached_animation(
+                        frames, duration, animation_size, animation_format, area_bbox
                     )
+                if animation_path:
+                    st.caption(
+                        f"{len(frames)} frames from {frames[0][0]} to {frames[-1][0]}, "
+                        "looping."
+                    )
+                    show_animation(animation_path, animation_format)
+                else:
+                    st.warning("No valid image files found.")
+
+
+def page_ai_prediction():
+    from risk_model import village_scores
 
-elif selected == "AI Prediction":
     st.header("AI Prediction")
     st.write(
-        "This section will later display automatic model predictions for landslide "
-        "and rockfall risks, based on data patterns detected in previous observations."
+        "Risk scores for every village from the baseline model, combining the "
+        "registry score with brightness and snow changes in cached imagery and "
+        "the distance to Birchgletscher. Villages without cached imagery keep "
+        "their registry score."
+    )
+    st.caption(
+        "The baseline model is a placeholder for a trained model; only imagery that "
+        "has already been looked up or prefetched contributes."
     )
-    st.info("The AI prediction model is under development.")
 
-st.markdown(
-    """
----
-<div style='text-align:center;color:gray;font-size:.9rem;margin-top:2em;'>
-  Developed by <b>Yuliia Melnychuk</b>, <b>Mike Dylan Poppelaars</b>, <b>Borys Tereschenko</b><br>
-  Substantially improved by <b>Mike Dylan Poppelaars</b><br>
-  &copy; 2026 Fachverein Physik der UZH - All rights reserved
-</div>
-""",
-    unsafe_allow_html=True,
+    scores, timings = village_scores(CACHE_DIR)
+    st.caption(
+        f"Scored {len(scores)} villages in {timings['features_ms']:.1f} ms "
+        f"(features) + {timings['inference_ms']:.1f} ms (model)"
+        + (", reused until the imagery or registry changes." if timings["cached"] else ".")
+    )
+
+    st.map(
+        scores,
+        latitude="lat",
+        longitude="lon",
+        color="model_color",
+        size=1500,
+        zoom=7,
+        height=420,
+    )
+    st.dataframe(
+        scores.sort_values("model_score", ascending=False)[
+            [
+                "village",
+                "model_score",
+                "model_level",
+                "risk_score",
+                "observations",
+                "brightness_change",
+                "snow_change",
+                "snow_trend",
+                "distance_km",
+            ]
+        ],
+        hide_index=True,
+        use_container_width=True,
+        column_config={
+            "model_score": st.column_config.ProgressColumn(
+                "Model score", min_value=0.0, max_value=1.0, format="%.2f"
+            ),
+            "model_level": "Model level",
+            "risk_score": st.column_config.NumberColumn("Registry score", format="%.2f"),
+            "observations": st.column_config.NumberColumn("Image dates", format="%d"),
+            "brightness_change": st.column_config.NumberColumn("Brightness change", format="%.1f"),
+            "snow_change": st.column_config.NumberColumn("Snow change", format="%.2f"),
+            "snow_trend": st.column_config.NumberColumn("Snow trend / 30 d", format="%.3f"),
+            "distance_km": st.column_config.NumberColumn("Distance (km)", format="%.1f"),
+        },
+    )
+
+
+# Page name -> (menu icon, render function).
+PAGES = {
+    "Main Site": ("house", page_main_site),
+    "Find Previous Data": ("calendar3", page_find_previous_data),
+    "AI Prediction": ("cpu", page_ai_prediction),
+}
+# Hidden page: open the app with ?diagnostics=1 to show it.
+HIDDEN_PAGES = {"Diagnostics": ("speedometer2", render_diagnostics)}
+
+
+render_header()
+st.divider()
+
+pages = dict(PAGES)
+if st.query_params.get("diagnostics"):
+    pages.update(HIDDEN_PAGES)
+
+selected = option_menu(
+    None,
+    list(pages),
+    icons=[icon for icon, _render in pages.values()],
+    orientation="horizontal",
+    styles={
+        "container": {"padding": "0!important", "background-color": "transparent"},
+        "nav": {"justify-content": "center"},
+        "nav-link": {"text-align": "center", "margin": "0px"},
+        "nav-link-selected": {
+            "color": "#0055a4",
+            "border-bottom": "3px solid #0055a4",
+        },
+    },
 )
+
+st.divider()
+pages[selected][1]()
+st.markdown(FOOTER_HTML, unsafe_allow_html=True)
+
+# Recorded last, so the diagnostics page shows the previous reruns.
+get_metrics().record_stage("page_render", time.perf_counter() - render_started, page=selected)
@@ -0,0 +1,204 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from PIL import Image, ImageOps
+
+try:
+    import pypdfium2
+except ImportError:  # Environments installed without it skip PDF previews.
+    pypdfium2 = None
+
+
+THUMBNAIL_SIZE = (256, 256)
+PREVIEW_SIZE = (1280, 1280)
+DERIVED_JPEG_QUALITY = 82
+PDF_RENDER_SCALE = 1.5
+DERIVED_DIR_NAME = "derived"
+ATTACHMENT_WORKERS = 2
+# Refuse decompression bombs rather than letting a worker run out of memory.
+MAX_IMAGE_PIXELS = 80_000_000
+EXIF_IFD = 0x8769
+GPS_IFD = 0x8825
+EXIF_DATETIME_ORIGINAL = 36867
+EXIF_DATETIME = 306
+EXIF_CAMERA_MODEL = 272
+PDF_MAGIC = b"%PDF-"
+
+
+def _degrees(value, ref):
+    degrees, minutes, seconds = (float(part) for part in value)
+    decimal = degrees + minutes / 60 + seconds / 3600
+    return -decimal if ref in ("S", "W") else decimal
+
+
+def read_exif(img):
+    """Return capture time, GPS position and camera model from an image's EXIF."""
+    exif = img.getexif()
+    details = {}
+    taken = exif.get_ifd(EXIF_IFD).get(EXIF_DATETIME_ORIGINAL) or exif.get(EXIF_DATETIME)
+    if taken:
+        try:
+            details["captured_at"] = datetime.strptime(
+                str(taken).strip("\x00 "), "%Y:%m:%d %H:%M:%S"
+            ).isoformat()
+        except ValueError:
+            pass
+    gps = exif.get_ifd(GPS_IFD)
+    try:
+        latitude = _degrees(gps[2], gps.get(1, "N"))
+        longitude = _degrees(gps[4], gps.get(3, "E"))
+    except (KeyError, TypeError, ValueError, ZeroDivisionError):
+        pass
+    else:
+        details["latitude"], details["longitude"] = round(latitude, 6), round(longitude, 6)
+    if exif.get(EXIF_CAMERA_MODEL):
+        details["camera"] = str(exif[EXIF_CAMERA_MODEL]).strip("\x00 ")
+    details["had_exif"] = bool(exif)
+    return details
+
+
+def _render_pdf(path):
+    if pypdfium2 is None:
+        raise RuntimeError("PDF previews need the pypdfium2 package.")
+    document = pypdfium2.PdfDocument(str(path))
+    try:
+        page = document[0]
+        img = page.render(scale=PDF_RENDER_SCALE).to_pil()
+        return img, {"pages": len(document)}
+    finally:
+        document.close()
+
+
+def _save_jpeg(img, path, size):
+    copy = img.copy()
+    copy.thumbnail(size, Image.LANCZOS)
+    # Saved without exif=..., so derivatives carry no metadata.
+    copy.save(path, format="JPEG", quality=DERIVED_JPEG_QUALITY, optimize=True)
+
+
+def _is_pdf(path, content_type):
+    if content_type == "application/pdf":
+        return True
+    # Reports imported from the old folder layout have no content type.
+    with open(path, "rb") as handle:
+        return handle.read(len(PDF_MAGIC)) == PDF_MAGIC
+
+
+def process_attachment(blob_path, content_type, out_dir):
+    """Build a thumbnail and preview for one attachment blob.
+
+    Runs in a worker process. Returns what was derived: ``thumbnail`` and
+    ``preview`` file names inside ``out_dir``, the source size, and for
+    photos the EXIF capture time and GPS position; or ``{"error"}``.
+    """
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    out_dir = Path(out_dir)
+    derived = {"content_type": content_type}
+    try:
+        if _is_pdf(blob_path, content_type):
+            img, info = _render_pdf(blob_path)
+            derived.update(info)
+        else:
+            with Image.open(blob_path) as source:
+                derived.update(read_exif(source))
+                # Bake the EXIF orientation into the pixels before it is dropped.
+                img = ImageOps.exif_transpose(source).convert("RGB")
+        derived["width"], derived["height"] = img.size
+        out_dir.mkdir(parents=True, exist_ok=True)
+        _save_jpeg(img, out_dir / "thumbnail.jpg", THUMBNAIL_SIZE)
+        _save_jpeg(img, out_dir / "preview.jpg", PREVIEW_SIZE)
+    except Exception as exc:
+        derived["error"] = str(exc)
+        return derived
+    derived["thumbnail"] = "thumbnail.jpg"
+    derived["preview"] = "preview.jpg"
+    return derived
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+# Blobs being processed; an upload shared by several reports is done once.
+_in_progress = set()
+
+
+def get_attachment_pool(max_workers=ATTACHMENT_WORKERS):
+    """Return the process-wide worker pool for attachment processing."""
+    with _pools_lock:
+        pool = _pools.get("pool")
+        # A worker that died (e.g. out of memory) breaks the pool for good; replace it.
+        if pool is None or getattr(pool, "_broken", False):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+            # Spawned workers do not inherit the app's threads and locks.
+            _pools["pool"] = ProcessPoolExecutor(
+                max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pools["pool"]
+
+
+def derived_dir(sha256):
+    """Directory of an attachment's derivatives, relative to the store root."""
+    return Path(DERIVED_DIR_NAME) / sha256[:2] / sha256
+
+
+def _record(store, sha256, relative_dir, future):
+    try:
+        derived = future.result()
+    except Exception as exc:
+        derived = {"error": str(exc)}
+    for name in ("thumbnail", "preview"):
+        if derived.get(name):
+            derived[name] = str(relative_dir / derived[name])
+    try:
+        store.record_derivatives(sha256, derived)
+    finally:
+        with _pools_lock:
+            _in_progress.discard(sha256)
+
+
+def process_report_attachments(report_id, store, pool=None):
+    """Queue thumbnails, previews and EXIF extraction for a report's attachments.
+
+    Usable as a :class:`report_queue.ReportQueue` post-process hook: the work
+    runs in the worker pool and results are recorded in the store as each
+    attachment finishes. Returns the futures.
+    """
+    return _submit(store, store.unprocessed_attachments(report_id), pool)
+
+
+def process_pending(store, pool=None):
+    """Queue every stored attachment that has not been processed yet."""
+    return _submit(store, store.unprocessed_attachments(), pool)
+
+
+def _submit(store, attachments, pool):
+    pool = pool or get_attachment_pool()
+    futures = []
+    for sha256, content_type in attachments:
+        with _pools_lock:
+            if sha256 in _in_progress:
+                continue
+            _in_progress.add(sha256)
+        relative_dir = derived_dir(sha256)
+        try:
+            future = pool.submit(
+                process_attachment,
+                str(store.blob_path(sha256)),
+                content_type,
+                str(store.root / relative_dir),
+            )
+        except Exception:
+            # Left unprocessed, so the next hook or start-up catch-up submits it again.
+            with _pools_lock:
+                _in_progress.discard(sha256)
+            raise
+        future.add_done_callback(
+            lambda done, sha256=sha256, relative_dir=relative_dir: _record(
+                store, sha256, relative_dir, done
+            )
+        )
+        futures.append(future)
+    return futures
@@ -0,0 +1,52 @@
+"""Time a cold start and reruns of one app page with Streamlit's AppTest.
+
+Run in a fresh process so the cold start includes module imports; prints
+one JSON object. Used by run.py, which starts one process per page:
+
+    python benchmarks/app_timing.py --page "AI Prediction" --reruns 10
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+APP_PATH = REPO_ROOT / "app.py"
+APP_TIMEOUT_SECONDS = 120
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--page", default="Main Site")
+    parser.add_argument("--reruns", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, str(REPO_ROOT))
+    import streamlit_option_menu
+    from streamlit.testing.v1 import AppTest
+
+    # AppTest cannot click the menu component, so it always returns the page.
+    streamlit_option_menu.option_menu = lambda *_args, **_kwargs: args.page
+
+    started = time.perf_counter()
+    app = AppTest.from_file(str(APP_PATH), default_timeout=APP_TIMEOUT_SECONDS)
+    app.run()
+    cold_ms = (time.perf_counter() - started) * 1000
+    if app.exception:
+        print(json.dumps({"error": str(app.exception[0].message)}))
+        return 1
+
+    reruns = []
+    for _rerun in range(args.reruns):
+        started = time.perf_counter()
+        app.run()
+        reruns.append((time.perf_counter() - started) * 1000)
+    print(json.dumps({"cold_start_ms": cold_ms, "rerun_ms": reruns}))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
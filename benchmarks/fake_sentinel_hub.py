@@ -0,0 +1,330 @@
+"""Local stand-in for the Sentinel Hub token, catalog and process APIs.
+
+Serves synthetic renders with configurable latency, throttling and
+dark-image rates so lookups can be measured without credentials:
+
+    python benchmarks/fake_sentinel_hub.py --port 8765 --latency-ms 150
+    SENTINEL_HUB_BASE_URL=http://127.0.0.1:8765 OAUTHLIB_INSECURE_TRANSPORT=1 \\
+        SENTINEL_CLIENT_ID=x SENTINEL_CLIENT_SECRET=x streamlit run app.py
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import tarfile
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+
+TOKEN_PATH = "/auth/realms/main/protocol/openid-connect/token"
+CATALOG_PATH = "/api/v1/catalog/1.0.0/search"
+PROCESS_PATH = "/api/v1/process"
+TOKEN_LIFETIME_SECONDS = 3600
+# Typical digital numbers (reflectance * 10000) of the synthetic band data.
+BAND_LEVELS = {"B02": 900, "B03": 1100, "B04": 1200, "B08": 2600, "B11": 1800, "B12": 1300}
+BAND_DEFAULT_LEVEL = 1500
+SCL_VEGETATION = 4
+
+
+@dataclass
+class FakeHubConfig:
+    latency_ms: float = 100.0
+    latency_jitter_ms: float = 20.0
+    # Share of process requests answered with 429 (and a short Retry-After).
+    throttle_rate: float = 0.0
+    # Share of acquisition dates that render black.
+    dark_rate: float = 0.1
+    # 0 gives flat, tiny PNGs; 255 gives incompressible noise (large payloads).
+    noise: int = 48
+    # One acquisition every this many days, with seeded cloud cover.
+    revisit_days: int = 2
+    seed: int = 0
+
+
+def _day_hash(day, seed, salt):
+    digest = hashlib.sha256(f"{seed}:{salt}:{day}".encode()).digest()
+    return int.from_bytes(digest[:8], "big") / 2**64
+
+
+def _days(start, end):
+    day = date.fromisoformat(start[:10])
+    last = date.fromisoformat(end[:10])
+    while day <= last:
+        yield day.isoformat()
+        day += timedelta(days=1)
+
+
+def _bands(evalscript):
+    """Bands requested by an analysis evalscript, or None for other renders."""
+    marker = "var BANDS = "
+    if marker not in evalscript:
+        return None
+    return json.loads(evalscript.split(marker, 1)[1].split(";", 1)[0])
+
+
+def _frames(evalscript):
+    """``{response id: day}`` of a time-series evalscript, or None for single renders."""
+    marker = "var FRAMES = "
+    if marker not in evalscript:
+        return None
+    days = json.loads(evalscript.split(marker, 1)[1].split(";", 1)[0])
+    return {"t" + day.replace("-", ""): day for day in days}
+
+
+class FakeSentinelHub:
+    """Threaded HTTP server answering like Sentinel Hub; counts every request."""
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.config = config or FakeHubConfig()
+        self._random = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self._renders = {}
+        self.counts = {"token": 0, "catalog": 0, "process": 0, "throttled": 0, "bytes": 0}
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset_counts(self):
+        with self._lock:
+            for key in self.counts:
+                self.counts[key] = 0
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.counts[key] += amount
+
+    def acquisitions(self, start, end):
+        """Return ``{day: cloud_cover}`` of the synthetic acquisitions in a range."""
+        config = self.config
+        return {
+            day: round(_day_hash(day, config.seed, "cloud") * 40, 1)
+            for day in _days(start, end)
+            if date.fromisoformat(day).toordinal() % config.revisit_days == 0
+        }
+
+    def is_dark(self, day):
+        return _day_hash(day, self.config.seed, "dark") < self.config.dark_rate
+
+    def render(self, day, size, mode="RGB"):
+        """PNG bytes for one acquisition; encoded once per day, size and mode."""
+        key = (day, size, mode)
+        with self._lock:
+            cached = self._renders.get(key)
+        if cached is not None:
+            return cached
+
+        bands = 3 if mode == "RGB" else 1
+        if day is None or self.is_dark(day):
+            pixels = np.zeros((size, size, bands), dtype=np.uint8)
+        else:
+            rng = np.random.default_rng(int(_day_hash(day, self.config.seed, "pixels") * 2**32))
+            base = rng.integers(60, 160, size=(1, 1, bands))
+            gradient = np.linspace(0, 60, size, dtype=np.float32)[None, :, None]
+            noise = rng.integers(0, self.config.noise + 1, size=(size, size, bands))
+            pixels = np.clip(base + gradient + noise, 0, 255).astype(np.uint8)
+        buffer = BytesIO()
+        Image.fromarray(pixels.squeeze(axis=2) if bands == 1 else pixels).save(buffer, "PNG")
+        content = buffer.getvalue()
+        with self._lock:
+            self._renders[key] = content
+        return content
+
+    def render_band(self, day, band, size):
+        """16-bit greyscale PNG bytes of one raw band, encoded once per day, band and size."""
+        key = (day, size, band)
+        with self._lock:
+            cached = self._renders.get(key)
+        if cached is not None:
+            return cached
+
+        if day is None or self.is_dark(day):
+            pixels = np.zeros((size, size), dtype=np.uint16)
+        elif band == "SCL":
+            pixels = np.full((size, size), SCL_VEGETATION, dtype=np.uint16)
+        else:
+            seed = int(_day_hash(day, self.config.seed, band) * 2**32)
+            rng = np.random.default_rng(seed)
+            level = BAND_LEVELS.get(band, BAND_DEFAULT_LEVEL)
+            gradient = np.linspace(0, level / 4, size, dtype=np.float32)[None, :]
+            noise = rng.integers(0, self.config.noise * 8 + 1, size=(size, size))
+            pixels = np.clip(level + gradient + noise, 1, 10000).astype(np.uint16)
+        buffer = BytesIO()
+        Image.fromarray(pixels).save(buffer, "PNG")
+        content = buffer.getvalue()
+        with self._lock:
+            self._renders[key] = content
+        return content
+
+    def _wait(self):
+        config = self.config
+        with self._lock:
+            jitter = self._random.uniform(-1, 1) * config.latency_jitter_ms
+            throttled = self._random.random() < config.throttle_rate
+        time.sleep(max(0.0, config.latency_ms + jitter) / 1000)
+        return throttled
+
+    def _process(self, body, accept):
+        data = body["input"]["data"][0]
+        time_range = data["dataFilter"]["timeRange"]
+        max_cloud = data["dataFilter"].get("maxCloudCoverage", 100)
+        days = [
+            day
+            for day, cloud in self.acquisitions(time_range["from"], time_range["to"]).items()
+            if cloud <= max_cloud
+        ]
+        size = int(body["output"]["width"])
+        responses = body["output"]["responses"]
+        frames = _frames(body["evalscript"])
+        bands = _bands(body["evalscript"])
+
+        def part(response):
+            identifier = response["identifier"]
+            if response["format"]["type"] == "application/json":
+                return f"{identifier}.json", json.dumps({"dates": days}).encode()
+            if identifier == "scene":
+                return f"{identifier}.png", self.render(None, size, mode="L")
+            if bands is not None:
+                day = days[0] if days else None
+                return f"{identifier}.png", self.render_band(day, identifier, size)
+            if frames is not None:
+                day = frames.get(identifier)
+                day = day if day in days else None
+            else:
+                day = days[0] if days else None
+            return f"{identifier}.png", self.render(day, size)
+
+        if len(responses) == 1 and accept != "application/x-tar":
+            return "image/png", part(responses[0])[1]
+        buffer = BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w") as archive:
+            for response in responses:
+                name, content = part(response)
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                archive.addfile(info, BytesIO(content))
+        return "application/x-tar", buffer.getvalue()
+
+    def _handler(self):
+        hub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, content_type, content, headers=()):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(content)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(content)
+                hub._count("bytes", len(content))
+
+            def _json(self, status, value):
+                self._reply(status, "application/json", json.dumps(value).encode())
+
+            def do_POST(self):
+                raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if self.path == TOKEN_PATH:
+                    hub._count("token")
+                    self._json(
+                        200,
+                        {
+                            "access_token": "fake-token",
+                            "token_type": "Bearer",
+                            "expires_in": TOKEN_LIFETIME_SECONDS,
+                        },
+                    )
+                elif self.path == CATALOG_PATH:
+                    hub._count("catalog")
+                    body = json.loads(raw)
+                    start, end = body["datetime"].split("/")
+                    features = [
+                        {"properties": {"datetime": f"{day}T10:20:00Z", "eo:cloud_cover": cloud}}
+                        for day, cloud in hub.acquisitions(start, end).items()
+                    ]
+                    self._json(200, {"features": features, "context": {}})
+                elif self.path == PROCESS_PATH:
+                    hub._count("process")
+                    if hub._wait():
+                        hub._count("throttled")
+                        self._reply(
+                            429,
+                            "application/json",
+                            b'{"error": "throttled"}',
+                            [("Retry-After", "0")],
+                        )
+                        return
+                    content_type, content = hub._process(
+                        json.loads(raw), self.headers.get("Accept", "")
+                    )
+                    self._reply(200, content_type, content)
+                else:
+                    self._json(404, {"error": f"Unknown path {self.path}"})
+
+        return Handler
+
+
+def main(argv=None):
+    defaults = FakeHubConfig()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=defaults.latency_ms)
+    parser.add_argument("--throttle-rate", type=float, default=defaults.throttle_rate)
+    parser.add_argument("--dark-rate", type=float, default=defaults.dark_rate)
+    parser.add_argument("--noise", type=int, default=defaults.noise)
+    parser.add_argument("--revisit-days", type=int, default=defaults.revisit_days)
+    args = parser.parse_args(argv)
+    config = FakeHubConfig(
+        latency_ms=args.latency_ms,
+        throttle_rate=args.throttle_rate,
+        dark_rate=args.dark_rate,
+        noise=args.noise,
+        revisit_days=args.revisit_days,
+    )
+    hub = FakeSentinelHub(config, args.host, args.port)
+    print(f"Fake Sentinel Hub listening on {hub.base_url}")
+    try:
+        hub.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
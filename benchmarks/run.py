@@ -0,0 +1,390 @@
+"""Offline benchmarks for image lookups, band data, darkness checks, animations and app reruns.
+
+Starts a local fake Sentinel Hub (see fake_sentinel_hub.py), points the app
+modules at it and writes the measurements as JSON:
+
+    python benchmarks/run.py --output bench.json
+    python benchmarks/run.py --latency-ms 250 --throttle-rate 0.1 --compare bench.json
+
+With ``--compare``, metrics more than ``--tolerance`` worse than the
+baseline are listed and the exit status is 1.
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+
+from fake_sentinel_hub import FakeHubConfig, FakeSentinelHub
+
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+LOOKUP_DATES = 8
+RANGE_DAYS = 30
+DARKNESS_SIZES = (256, 512, 1024, 2048)
+DARKNESS_REPEATS = 20
+# Pixel window read from the memory-mapped analysis stack.
+ANALYSIS_WINDOW = 256
+APP_PAGES = ("Main Site", "Find Previous Data", "AI Prediction")
+APP_RERUNS = 10
+DEFAULT_TOLERANCE = 0.2
+# Metrics compared against a baseline, by suffix.
+LOWER_IS_BETTER = ("_ms", "_mb")
+HIGHER_IS_BETTER = ("_per_s",)
+
+
+def _configure_environment(base_url, work_dir):
+    """Point the app modules at the fake server; must run before importing them."""
+    os.environ.update(
+        {
+            "SENTINEL_HUB_BASE_URL": base_url,
+            "OAUTHLIB_INSECURE_TRANSPORT": "1",
+            "SENTINEL_CLIENT_ID": "benchmark",
+            "SENTINEL_CLIENT_SECRET": "benchmark",
+            "SENTINEL_REQUESTS_PER_MINUTE": "100000",
+            "SENTINEL_PU_PER_MINUTE": "100000",
+            "SENTINEL_DAILY_PU_BUDGET": "1000000",
+            "SENTINEL_MONTHLY_PU_BUDGET": "10000000",
+            "SENTINEL_USAGE_FILE": str(Path(work_dir) / "pu_usage.json"),
+        }
+    )
+    sys.path.insert(0, str(REPO_ROOT))
+
+
+def _summary(samples_ms):
+    ordered = sorted(samples_ms)
+    return {
+        "count": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered), 3),
+        "p50_ms": round(ordered[len(ordered) // 2], 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+        "max_ms": round(ordered[-1], 3),
+    }
+
+
+def _max_rss_mb():
+    # ru_maxrss is in KiB on Linux and bytes on macOS.
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(max_rss / 2**20 if sys.platform == "darwin" else max_rss / 2**10, 1)
+
+
+def _measure(function, trace_memory=False):
+    """Run ``function`` and return ``(result, elapsed_ms, memory)``.
+
+    ``memory`` holds the process high-water mark and, with ``trace_memory``,
+    the peak of Python allocations; tracing slows the timed code down.
+    """
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        result = function()
+    finally:
+        elapsed = (time.perf_counter() - started) * 1000
+        memory = {"max_rss_mb": _max_rss_mb()}
+        if trace_memory:
+            memory["peak_traced_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 2)
+            tracemalloc.stop()
+    return result, elapsed, memory
+
+
+def _lookup_dates(start, count):
+    # Far enough apart that no two lookups share a +/- 5 day window.
+    return [(start + timedelta(days=12 * index)).isoformat() for index in range(count)]
+
+
+def bench_lookups(hub, work_dir, start, trace_memory=False):
+    from sentinel_img import download_sentinel_image
+
+    cache = Path(work_dir) / "lookups"
+    dates = _lookup_dates(start, LOOKUP_DATES)
+    results = {}
+    for phase in ("cold", "warm"):
+        hub.reset_counts()
+        samples, failures, memory = [], 0, {}
+        for day in dates:
+            info, elapsed, used = _measure(
+                lambda day=day: download_sentinel_image(day, cache), trace_memory
+            )
+            samples.append(elapsed)
+            failures += not info.get("file_path")
+            for key, value in used.items():
+                memory[key] = max(value, memory.get(key, 0))
+        results[f"lookup_{phase}"] = {
+            **_summary(samples),
+            **memory,
+            "failed_lookups": failures,
+            "process_requests": hub.counts["process"],
+            "throttled_responses": hub.counts["throttled"],
+        }
+    return results
+
+
+def bench_range(hub, work_dir, start, trace_memory=False):
+    from sentinel_img import download_sentinel_images
+
+    cache = Path(work_dir) / "range"
+    dates = [(start + timedelta(days=offset)).isoformat() for offset in range(RANGE_DAYS)]
+    hub.reset_counts()
+    infos, elapsed, memory = _measure(
+        lambda: dict(download_sentinel_images(dates, cache)), trace_memory
+    )
+    frames = sorted({info["file_path"] for info in infos.values() if info.get("file_path")})
+    result = {
+        "dates": len(dates),
+        "frames": len(frames),
+        "elapsed_ms": round(elapsed, 3),
+        "dates_per_s": round(len(dates) / (elapsed / 1000), 3),
+        **memory,
+        "process_requests": hub.counts["process"],
+        "catalog_requests": hub.counts["catalog"],
+        "throttled_responses": hub.counts["throttled"],
+        "received_mb": round(hub.counts["bytes"] / 2**20, 3),
+    }
+    return {"range_throughput": result}, frames
+
+
+def bench_darkness(hub):
+    from sentinel_img import is_image_dark
+
+    results = {}
+    day = next(day for day in hub.acquisitions("2024-06-01", "2024-06-30") if not hub.is_dark(day))
+    for size in DARKNESS_SIZES:
+        content = hub.render(day, size)
+        samples = []
+        for _repeat in range(DARKNESS_REPEATS):
+            started = time.perf_counter()
+            is_image_dark(content)
+            samples.append((time.perf_counter() - started) * 1000)
+        summary = _summary(samples)
+        megapixels = size * size / 1e6
+        results[f"darkness_{size}px"] = {
+            **summary,
+            "png_kb": round(len(content) / 1024, 1),
+            "per_megapixel_ms": round(summary["p50_ms"] / megapixels, 3),
+        }
+    return results
+
+
+def bench_animation(work_dir, frames, trace_memory=False):
+    from animation import build_animation
+
+    if not frames:
+        return {"animation_build": {"error": "The range benchmark produced no frames."}}
+
+    cache = Path(work_dir) / "range"
+    results = {}
+    for phase in ("cold", "warm"):
+        _path, elapsed, memory = _measure(
+            lambda: build_animation(frames, 500, "benchmark", [0, 0, 1, 1], cache), trace_memory
+        )
+        results[f"animation_{phase}"] = {
+            "frames": len(frames),
+            "elapsed_ms": round(elapsed, 3),
+            **memory,
+        }
+    return results
+
+
+def bench_analysis(hub, work_dir, start, trace_memory=False):
+    from sentinel_img import MAX_CLOUD_COVERAGE, download_analysis_bands, spectral_index
+
+    cache = Path(work_dir) / "analysis"
+    end = start + timedelta(days=RANGE_DAYS)
+    day = next(
+        day
+        for day, cloud in hub.acquisitions(start.isoformat(), end.isoformat()).items()
+        if cloud <= MAX_CLOUD_COVERAGE and not hub.is_dark(day)
+    )
+    hub.reset_counts()
+    info, elapsed, memory = _measure(lambda: download_analysis_bands(day, cache), trace_memory)
+    if not info.get("file_path"):
+        return {"analysis_cold": {"error": info.get("error")}}
+    results = {
+        "analysis_cold": {
+            "bands": len(info["bands"]),
+            "elapsed_ms": round(elapsed, 3),
+            **memory,
+            "process_requests": hub.counts["process"],
+            "received_mb": round(hub.counts["bytes"] / 2**20, 3),
+        }
+    }
+
+    window = slice(0, ANALYSIS_WINDOW)
+    samples = []
+    for _repeat in range(DARKNESS_REPEATS):
+        started = time.perf_counter()
+        spectral_index(info, "NDSI", window, window)
+        samples.append((time.perf_counter() - started) * 1000)
+    results[f"analysis_ndsi_{ANALYSIS_WINDOW}px_window"] = _summary(samples)
+    return results
+
+
+def bench_app(work_dir):
+    """Cold start and rerun time per page, each page in a fresh interpreter."""
+    app_dir = Path(work_dir) / "app"
+    app_dir.mkdir(exist_ok=True)
+    results = {}
+    for page in APP_PAGES:
+        name = "app_" + page.lower().replace(" ", "_")
+        completed = subprocess.run(
+            [
+                sys.executable,
+                str(Path(__file__).with_name("app_timing.py")),
+                "--page",
+                page,
+                "--reruns",
+                str(APP_RERUNS),
+            ],
+            cwd=app_dir,
+            capture_output=True,
+            text=True,
+        )
+        try:
+            timing = json.loads(completed.stdout.strip().splitlines()[-1])
+        except (IndexError, ValueError):
+            timing = {"error": completed.stderr.strip()[-500:] or "no output"}
+        if "error" in timing:
+            results[name] = timing
+            continue
+        rerun = _summary(timing["rerun_ms"])
+        results[name] = {
+            "cold_start_ms": round(timing["cold_start_ms"], 3),
+            "rerun_p50_ms": rerun["p50_ms"],
+            "rerun_mean_ms": rerun["mean_ms"],
+            "reruns": rerun["count"],
+        }
+    return results
+
+
+def _stage_breakdown():
+    """Time per instrumented stage across all benchmarks, from the metrics registry."""
+    from metrics import get_metrics
+
+    stages = {}
+    for histogram in get_metrics().snapshot()["histograms"]:
+        if histogram["name"] != "stage_seconds" or not histogram["count"]:
+            continue
+        labels = histogram["labels"]
+        name = ":".join([labels.get("stage", ""), *(v for k, v in labels.items() if k != "stage")])
+        stages[name] = {
+            "count": histogram["count"],
+            "total_ms": round(histogram["sum"] * 1000, 3),
+            "mean_ms": round(histogram["sum"] / histogram["count"] * 1000, 3),
+        }
+    return stages
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(config, start, trace_memory=False):
+    with FakeSentinelHub(config) as hub, tempfile.TemporaryDirectory() as work_dir:
+        _configure_environment(hub.base_url, work_dir)
+        results = {}
+        results.update(bench_lookups(hub, work_dir, start, trace_memory))
+        range_results, frames = bench_range(
+            hub, work_dir, start + timedelta(days=200), trace_memory
+        )
+        results.update(range_results)
+        results.update(bench_darkness(hub))
+        results.update(bench_analysis(hub, work_dir, start + timedelta(days=300), trace_memory))
+        results.update(bench_animation(work_dir, frames, trace_memory))
+        results.update(bench_app(work_dir))
+        stages = _stage_breakdown()
+
+    return {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": vars(config),
+            "trace_memory": trace_memory,
+            "max_rss_mb": _max_rss_mb(),
+        },
+        "results": results,
+        "stages": stages,
+    }
+
+
+def compare(current, baseline, tolerance):
+    """Return human-readable lines for metrics worse than ``baseline`` by > tolerance."""
+    regressions = []
+    for name, metrics in current["results"].items():
+        for metric, value in metrics.items():
+            if not metric.endswith(LOWER_IS_BETTER + HIGHER_IS_BETTER):
+                continue
+            before = baseline.get("results", {}).get(name, {}).get(metric)
+            if not isinstance(before, (int, float)) or not before:
+                continue
+            change = (value - before) / before
+            if metric.endswith(HIGHER_IS_BETTER):
+                change = -change
+            if change > tolerance:
+                regressions.append(f"{name}.{metric}: {before} -> {value} ({change:+.0%} worse)")
+    return regressions
+
+
+def main(argv=None):
+    defaults = FakeHubConfig()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", type=Path, default=Path("benchmark-results.json"))
+    parser.add_argument("--compare", type=Path, help="Baseline results to check against.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="Also record peak Python allocations (slows the timed code).",
+    )
+    parser.add_argument("--start", type=date.fromisoformat, default=date(2024, 5, 1))
+    parser.add_argument("--latency-ms", type=float, default=defaults.latency_ms)
+    parser.add_argument("--throttle-rate", type=float, default=defaults.throttle_rate)
+    parser.add_argument("--dark-rate", type=float, default=defaults.dark_rate)
+    parser.add_argument("--noise", type=int, default=defaults.noise)
+    parser.add_argument("--revisit-days", type=int, default=defaults.revisit_days)
+    args = parser.parse_args(argv)
+
+    config = FakeHubConfig(
+        latency_ms=args.latency_ms,
+        throttle_rate=args.throttle_rate,
+        dark_rate=args.dark_rate,
+        noise=args.noise,
+        revisit_days=args.revisit_days,
+    )
+    report = run(config, args.start, args.trace_memory)
+    args.output.write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+    for name, metrics in report["results"].items():
+        print(name, json.dumps(metrics))
+    print(f"Wrote {args.output}")
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text(encoding="utf-8"))
+        regressions = compare(report, baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,277 @@
+import math
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from image_quality import CLOUD_MAX_SPREAD, CLOUD_MIN_VALUE, NODATA_MAX_VALUE
+from sentinel_cache import get_image_cache
+
+
+# True-colour renders carry no near-infrared band, so vegetation change is
+# measured with the normalized green-red difference instead of NDVI.
+BRIGHTNESS_CHANGE_THRESHOLD = 40.0
+GREENNESS_CHANGE_THRESHOLD = 0.15
+# Changes are decided per block, which removes single-pixel noise and keeps
+# region labelling cheap.
+CHANGE_BLOCK_SIZE = 4
+BLOCK_MIN_CHANGED_FRACTION = 0.5
+MIN_REGION_BLOCKS = 4
+MAX_REPORTED_REGIONS = 10
+# Larger offsets are treated as a failed co-registration and ignored.
+MAX_SHIFT_FRACTION = 0.1
+OVERLAY_COLOR = (239, 68, 68)
+OVERLAY_ALPHA = 0.55
+KM_PER_DEGREE = 111.32
+OVERLAY_PNG_COMPRESSION = 3
+
+
+def _load_rgb(path, size=None):
+    # Images are handled as planar (3, height, width) float32 arrays, which keeps
+    # per-pixel channel operations on contiguous memory.
+    with Image.open(path) as img:
+        img = img.convert("RGB")
+        if size and img.size != size:
+            img = img.resize(size, Image.BILINEAR)
+        return np.ascontiguousarray(np.asarray(img).transpose(2, 0, 1), dtype=np.float32)
+
+
+def estimate_shift(reference, moving):
+    """Return the integer ``(dy, dx)`` that aligns ``moving`` to ``reference``.
+
+    Uses phase correlation on the grey-level images.
+    """
+    ref_fft = np.fft.rfft2(reference - reference.mean())
+    mov_fft = np.fft.rfft2(moving - moving.mean())
+    cross = ref_fft * np.conj(mov_fft)
+    cross /= np.maximum(np.abs(cross), 1e-9)
+    correlation = np.fft.irfft2(cross, s=reference.shape)
+    dy, dx = np.unravel_index(np.argmax(correlation), correlation.shape)
+    height, width = reference.shape
+    dy = dy - height if dy > height // 2 else dy
+    dx = dx - width if dx > width // 2 else dx
+    if abs(dy) > height * MAX_SHIFT_FRACTION or abs(dx) > width * MAX_SHIFT_FRACTION:
+        return 0, 0
+    return int(dy), int(dx)
+
+
+def _shift(image, dy, dx):
+    """Shift ``image`` by ``(dy, dx)``, filling uncovered pixels with zeros."""
+    shifted = np.zeros_like(image)
+    height, width = image.shape[-2:]
+    src_y = slice(max(0, -dy), min(height, height - dy))
+    dst_y = slice(max(0, dy), min(height, height + dy))
+    src_x = slice(max(0, -dx), min(width, width - dx))
+    dst_x = slice(max(0, dx), min(width, width + dx))
+    shifted[..., dst_y, dst_x] = image[..., src_y, src_x]
+    return shifted
+
+
+def _usable(rgb):
+    """Pixels with data that do not look like cloud."""
+    red, green, blue = rgb
+    low = np.minimum(np.minimum(red, green), blue)
+    high = np.maximum(np.maximum(red, green), blue)
+    cloud = (low >= CLOUD_MIN_VALUE) & (high - low <= CLOUD_MAX_SPREAD)
+    return (high > NODATA_MAX_VALUE) & ~cloud
+
+
+def _brightness(rgb):
+    red, green, blue = rgb
+    return (red + green + blue) / 3
+
+
+def _greenness(rgb):
+    red, green, _blue = rgb
+    return (green - red) / np.maximum(green + red, 1.0)
+
+
+def _block_mask(changed, usable, block):
+    height, width = changed.shape
+    height, width = height - height % block, width - width % block
+    shape = (height // block, block, width // block, block)
+    changed_blocks = changed[:height, :width].reshape(shape).sum(axis=(1, 3))
+    usable_blocks = usable[:height, :width].reshape(shape).sum(axis=(1, 3))
+    return changed_blocks >= np.maximum(usable_blocks, 1) * BLOCK_MIN_CHANGED_FRACTION
+
+
+def label_regions(mask):
+    """Label 8-connected regions of a boolean mask.
+
+    Row runs are found with NumPy and merged with a union-find over runs,
+    so the Python work scales with the number of runs, not pixels.
+    Returns ``(labels, count)`` with labels ``1..count`` and 0 for background.
+    """
+    height, width = mask.shape
+    edges = np.diff(np.pad(mask.astype(np.int8), ((0, 0), (1, 1))), axis=1)
+    run_rows, run_starts = np.nonzero(edges == 1)
+    _end_rows, run_ends = np.nonzero(edges == -1)
+    labels = np.zeros(mask.shape, dtype=np.int32)
+    if not len(run_rows):
+        return labels, 0
+
+    parent = list(range(len(run_rows)))
+
+    def find(run):
+        while parent[run] != run:
+            parent[run] = parent[parent[run]]
+            run = parent[run]
+        return run
+
+    row_bounds = np.searchsorted(run_rows, np.arange(height + 1))
+    starts, ends = run_starts.tolist(), run_ends.tolist()
+    for row in range(1, height):
+        above, above_end = row_bounds[row - 1], row_bounds[row]
+        current, current_end = above_end, row_bounds[row + 1]
+        while above < above_end and current < current_end:
+            # Runs touch (diagonals included) when they overlap by one column.
+            if starts[current] <= ends[above] and starts[above] <= ends[current]:
+                root_a, root_b = find(above), find(current)
+                if root_a != root_b:
+                    parent[max(root_a, root_b)] = min(root_a, root_b)
+            if ends[above] < ends[current]:
+                above += 1
+            else:
+                current += 1
+
+    roots = np.array([find(run) for run in range(len(parent))])
+    unique_roots, run_labels = np.unique(roots, return_inverse=True)
+    lengths = run_ends - run_starts
+    flat_starts = run_rows * width + run_starts
+    offsets = np.repeat(flat_starts - np.cumsum(lengths) + lengths, lengths)
+    flat = offsets + np.arange(lengths.sum())
+    labels.ravel()[flat] = np.repeat(run_labels + 1, lengths)
+    return labels, len(unique_roots)
+
+
+def _overlay(after, mask):
+    overlay = after.transpose(1, 2, 0).astype(np.uint8)
+    color = np.asarray(OVERLAY_COLOR, dtype=np.float32)
+    blended = overlay[mask] * (1 - OVERLAY_ALPHA) + color * OVERLAY_ALPHA
+    overlay[mask] = blended.astype(np.uint8)
+    buffer = BytesIO()
+    Image.fromarray(overlay).save(buffer, format="PNG", compress_level=OVERLAY_PNG_COMPRESSION)
+    return buffer.getvalue()
+
+
+def _pixel_km(bbox, shape):
+    height, width = shape
+    west, south, east, north = (float(value) for value in bbox)
+    mid_lat = math.radians((south + north) / 2)
+    return (
+        (east - west) * KM_PER_DEGREE * math.cos(mid_lat) / width,
+        (north - south) * KM_PER_DEGREE / height,
+    )
+
+
+def detect_changes_arrays(before, after, bbox):
+    """Compare two co-sized planar RGB arrays; return ``(changed_mask, summary)``."""
+    after_brightness = _brightness(after)
+    shift = estimate_shift(after_brightness, _brightness(before))
+    before = _shift(before, *shift)
+
+    usable = _usable(before) & _usable(after)
+    brightness_change = after_brightness - _brightness(before)
+    greenness_change = _greenness(after) - _greenness(before)
+    changed = usable & (
+        (np.abs(brightness_change) > BRIGHTNESS_CHANGE_THRESHOLD)
+        | (np.abs(greenness_change) > GREENNESS_CHANGE_THRESHOLD)
+    )
+
+    block = CHANGE_BLOCK_SIZE
+    blocks, count = label_regions(_block_mask(changed, usable, block))
+    sizes = np.bincount(blocks.ravel(), minlength=count + 1)
+    keep = sizes >= MIN_REGION_BLOCKS
+    keep[0] = False
+    kept_blocks = keep[blocks]
+
+    mask = np.zeros(changed.shape, dtype=bool)
+    block_pixels = np.repeat(np.repeat(kept_blocks, block, axis=0), block, axis=1)
+    mask[: block_pixels.shape[0], : block_pixels.shape[1]] = block_pixels
+
+    height, width = changed.shape
+    pixel_width_km, pixel_height_km = _pixel_km(bbox, (height, width))
+    pixel_area = pixel_width_km * pixel_height_km
+    west, south, east, north = (float(value) for value in bbox)
+    pixel_lon, pixel_lat = (east - west) / width, (north - south) / height
+
+    rows, cols = np.nonzero(kept_blocks)
+    region_ids = blocks[rows, cols]
+    regions = []
+    for region_id in np.argsort(sizes * keep)[::-1][: MAX_REPORTED_REGIONS]:
+        if not keep[region_id]:
+            break
+        members = region_ids == region_id
+        center_y = (rows[members].mean() + 0.5) * block
+        center_x = (cols[members].mean() + 0.5) * block
+        regions.append(
+            {
+                "area_km2": round(float(sizes[region_id]) * block * block * pixel_area, 4),
+                "centroid_lat": round(float(north - center_y * pixel_lat), 5),
+                "centroid_lon": round(float(west + center_x * pixel_lon), 5),
+            }
+        )
+
+    usable_count = int(usable.sum())
+    changed_count = int(mask.sum())
+    summary = {
+        "shift_px": list(shift),
+        "changed_area_km2": round(changed_count * pixel_area, 4),
+        "changed_fraction": round(changed_count / usable_count, 4) if usable_count else 0.0,
+        "compared_fraction": round(usable_count / usable.size, 4),
+        "region_count": int(keep.sum()),
+        "regions": regions,
+    }
+    if changed_count:
+        center_y, center_x = (float(values.mean()) for values in np.nonzero(mask))
+        summary["centroid_lat"] = round(north - center_y * pixel_lat, 5)
+        summary["centroid_lon"] = round(west + center_x * pixel_lon, 5)
+    return mask, summary
+
+
+def change_payload(before_path, after_path):
+    """Cache identity of a comparison: both (content-addressed) inputs and the settings."""
+    return {
+        "change": {
+            "before": Path(before_path).name,
+            "after": Path(after_path).name,
+            "brightness_threshold": BRIGHTNESS_CHANGE_THRESHOLD,
+            "greenness_threshold": GREENNESS_CHANGE_THRESHOLD,
+            "block_size": CHANGE_BLOCK_SIZE,
+            "min_region_blocks": MIN_REGION_BLOCKS,
+        }
+    }
+
+
+def detect_changes(before_info, after_info, bbox, cache_folder="cache"):
+    """Detect changes between two lookup results of the same area.
+
+    Returns ``{"file_path", "cached", "summary"}`` where ``file_path`` is an
+    overlay of the changed regions on the later image, or ``{"error"}``.
+    The result is cached per image pair.
+    """
+    if not (before_info.get("file_path") and after_info.get("file_path")):
+        return {"file_path": None, "error": "Both dates need an image to compare."}
+
+    if before_info["date"] > after_info["date"]:
+        before_info, after_info = after_info, before_info
+    image_cache = get_image_cache(cache_folder)
+    payload = change_payload(before_info["file_path"], after_info["file_path"])
+    cached = image_cache.get(payload)
+    if cached:
+        return {"file_path": cached["path"], "cached": True, "summary": cached["summary"]}
+
+    after = _load_rgb(after_info["file_path"])
+    before = _load_rgb(before_info["file_path"], size=(after.shape[2], after.shape[1]))
+    mask, summary = detect_changes_arrays(before, after, bbox)
+    summary["before_date"] = before_info["date"]
+    summary["after_date"] = after_info["date"]
+    entry = image_cache.put(
+        payload,
+        _overlay(after, mask),
+        date=after_info["date"],
+        bbox=bbox,
+        summary=summary,
+    )
+    return {"file_path": entry["path"], "cached": False, "summary": summary}
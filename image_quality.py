@@ -0,0 +1,78 @@
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+
+# Scoring works on a reduced copy; 256 px keeps every check well under a
+# millisecond-scale cost while still seeing clouds and snow fields.
+QUALITY_SAMPLE_SIZE = 256
+
+# Pixel classes on the stretched true-colour render (0-255 per channel).
+NODATA_MAX_VALUE = 0
+CLOUD_MIN_VALUE = 230
+CLOUD_MAX_SPREAD = 25
+SNOW_MIN_VALUE = 150
+
+# The 2.5x stretch saturates snow and cloud tops alike, so a bright, neutral
+# pixel cannot be told apart here. Scenes are already limited by the
+# catalogue's SCL-based cloud cover; ``max_cloud_fraction`` is opt-in.
+DEFAULT_QUALITY_THRESHOLDS = {
+    "min_mean_brightness": 10.0,
+    "max_nodata_fraction": 0.5,
+    "max_cloud_fraction": 1.0,
+    "max_snow_fraction": 1.0,
+}
+
+
+def _load_rgb(image_bytes, sample_size):
+    img = Image.open(BytesIO(image_bytes))
+    # JPEG can decode straight to a smaller size; PNG ignores the hint.
+    img.draft("RGB", (sample_size, sample_size))
+    img = img.convert("RGB")
+    factor = min(img.size) // sample_size
+    if factor > 1:
+        img = img.reduce(factor)
+    return np.asarray(img, dtype=np.uint8)
+
+
+def score_image(image_bytes, sample_size=QUALITY_SAMPLE_SIZE):
+    """Return a small quality record for a true-colour Sentinel render.
+
+    Fractions of cloud- and snow-like pixels are relative to pixels that
+    carry data. Saturated white pixels count towards both, since the render
+    cannot separate them. Raises if the bytes cannot be decoded.
+    """
+    rgb = _load_rgb(image_bytes, sample_size)
+    low = rgb.min(axis=2)
+    high = rgb.max(axis=2)
+    valid = high > NODATA_MAX_VALUE
+    valid_count = int(valid.sum())
+
+    cloud = valid & (low >= CLOUD_MIN_VALUE) & (high - low <= CLOUD_MAX_SPREAD)
+    # Unsaturated snow keeps a bluish tint; saturated snow looks like cloud.
+    snow = valid & (low >= SNOW_MIN_VALUE) & ((rgb[..., 2] >= rgb[..., 0]) | cloud)
+
+    def fraction(mask):
+        return round(float(mask.sum()) / valid_count, 4) if valid_count else 0.0
+
+    return {
+        "mean_brightness": round(float(rgb.mean()), 2),
+        "nodata_fraction": round(1.0 - valid_count / valid.size, 4),
+        "cloud_fraction": fraction(cloud),
+        "snow_fraction": fraction(snow),
+    }
+
+
+def quality_rejection(quality, thresholds=None):
+    """Return why ``quality`` fails ``thresholds``, or None if it is acceptable."""
+    limits = {**DEFAULT_QUALITY_THRESHOLDS, **(thresholds or {})}
+    if quality["nodata_fraction"] > limits["max_nodata_fraction"]:
+        return f"{quality['nodata_fraction']:.0%} of the image has no data"
+    if quality["mean_brightness"] < limits["min_mean_brightness"]:
+        return "the image is mostly dark"
+    if quality["cloud_fraction"] > limits["max_cloud_fraction"]:
+        return f"{quality['cloud_fraction']:.0%} of the image looks cloud covered"
+    if quality["snow_fraction"] > limits["max_snow_fraction"]:
+        return f"{quality['snow_fraction']:.0%} of the image looks snow covered"
+    return None
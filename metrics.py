@@ -0,0 +1,224 @@
+import bisect
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+
+METRIC_PREFIX = "sentinel_"
+# Upper bounds in seconds for stage durations.
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Upper bounds for small counts, e.g. candidate dates probed per lookup.
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13)
+RECENT_SPANS = 200
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(label_key, extra=()):
+    pairs = [*label_key, *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """In-process counters, histograms and recent tracing spans.
+
+    Cheap enough to leave on: every update is a dict lookup under one lock.
+    :meth:`render` produces the Prometheus text exposition format.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._spans = deque(maxlen=RECENT_SPANS)
+        self._local = threading.local()
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, buckets=DURATION_BUCKETS, **labels):
+        key = (name, _label_key(labels))
+        index = bisect.bisect_left(buckets, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {
+                    "buckets": buckets,
+                    "counts": [0] * (len(buckets) + 1),
+                    "sum": 0.0,
+                    "count": 0,
+                    "max": value,
+                }
+            histogram["counts"][index] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+            histogram["max"] = max(histogram["max"], value)
+
+    def record_stage(self, stage, seconds, **labels):
+        """Record a finished stage that was timed by the caller."""
+        self.observe("stage_seconds", seconds, stage=stage, **labels)
+        parents = getattr(self._local, "stack", None)
+        with self._lock:
+            self._spans.append(
+                {
+                    "stage": stage,
+                    "labels": dict(labels),
+                    "parent": parents[-1] if parents else None,
+                    "thread": threading.current_thread().name,
+                    "ended_at": time.time(),
+                    "duration_ms": round(seconds * 1000, 3),
+                }
+            )
+
+    @contextmanager
+    def span(self, stage, **labels):
+        """Time the enclosed block as ``stage``; nested spans record their parent."""
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        started = self._clock()
+        stack.append(stage)
+        try:
+            yield
+        finally:
+            stack.pop()
+            self.record_stage(stage, self._clock() - started, **labels)
+
+    def snapshot(self):
+        """Return plain-data copies of all counters, histograms and recent spans."""
+        with self._lock:
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+            histograms = [
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": histogram["count"],
+                    "sum": histogram["sum"],
+                    "max": histogram["max"],
+                    "buckets": list(zip(histogram["buckets"], histogram["counts"])),
+                }
+                for (name, labels), histogram in sorted(self._histograms.items())
+            ]
+            spans = list(self._spans)
+        return {"counters": counters, "histograms": histograms, "spans": spans}
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = []
+        typed = set()
+        for counter in snapshot["counters"]:
+            name = f"{METRIC_PREFIX}{counter['name']}_total"
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            labels = _format_labels(_label_key(counter["labels"]))
+            lines.append(f"{name}{labels} {_format_value(counter['value'])}")
+        for histogram in snapshot["histograms"]:
+            name = f"{METRIC_PREFIX}{histogram['name']}"
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            label_key = _label_key(histogram["labels"])
+            cumulative = 0
+            for bound, count in histogram["buckets"]:
+                cumulative += count
+                labels = _format_labels(label_key, [("le", _format_value(float(bound)))])
+                lines.append(f"{name}_bucket{labels} {cumulative}")
+            labels = _format_labels(label_key, [("le", "+Inf")])
+            lines.append(f"{name}_bucket{labels} {histogram['count']}")
+            labels = _format_labels(label_key)
+            lines.append(f"{name}_sum{labels} {_format_value(histogram['sum'])}")
+            lines.append(f"{name}_count{labels} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self._spans.clear()
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics():
+    return _registry
+
+
+def span(stage, **labels):
+    return _registry.span(stage, **labels)
+
+
+def increment(name, amount=1, **labels):
+    _registry.increment(name, amount, **labels)
+
+
+def observe(name, value, buckets=DURATION_BUCKETS, **labels):
+    _registry.observe(name, value, buckets, **labels)
+
+
+def write_metrics(path):
+    """Write the current metrics to ``path`` atomically (for node-exporter style scraping)."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp_path.write_text(_registry.render(), encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        content = _registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", METRICS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+_servers = {}
+_servers_lock = threading.Lock()
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """Serve ``/metrics`` from a daemon thread; one server per address and process."""
+    address = (host, int(port))
+    with _servers_lock:
+        if address not in _servers:
+            server = ThreadingHTTPServer(address, _MetricsHandler)
+            server.daemon_threads = True
+            threading.Thread(
+                target=server.serve_forever, name="metrics-server", daemon=True
+            ).start()
+            _servers[address] = server
+        return _servers[address]
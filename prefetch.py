@@ -0,0 +1,243 @@
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+from aoi import get_aoi_index, tile_bbox
+from metrics import write_metrics
+from sentinel_catalog import INGESTION_LAG_DAYS, bbox_key
+from sentinel_img import BIRCHGLETSCHER_BBOX, MAX_PARALLEL_REQUESTS, download_sentinel_images
+from sentinel_scheduler import PREFETCH
+
+
+PREFETCH_DAYS = 7
+PREFETCH_STATE_FILE = "prefetch_state.json"
+# Finished lookups are written out once per AOI, or after this many marks.
+PREFETCH_STATE_FLUSH_EVERY = 100
+
+logger = logging.getLogger(__name__)
+
+
+class PrefetchState:
+    """Persistent record of (AOI, date) lookups that are finished, for resuming.
+
+    Marks are kept in memory and written by :meth:`flush`, which also runs
+    every PREFETCH_STATE_FLUSH_EVERY marks.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._unsaved = 0
+        try:
+            self._done = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            self._done = {}
+
+    @staticmethod
+    def _key(bbox, date_str):
+        return f"{bbox_key(bbox)}|{date_str}"
+
+    def is_done(self, bbox, date_str):
+        with self._lock:
+            return self._key(bbox, date_str) in self._done
+
+    def mark_done(self, bbox, date_str):
+        with self._lock:
+            self._done[self._key(bbox, date_str)] = time.time()
+            self._unsaved += 1
+            if self._unsaved >= PREFETCH_STATE_FLUSH_EVERY:
+                self._save()
+
+    def flush(self):
+        with self._lock:
+            if self._unsaved:
+                self._save()
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(self._done, sort_keys=True), encoding="utf-8")
+        os.replace(tmp_path, self.path)
+        self._unsaved = 0
+
+
+def default_aois(include_villages=True):
+    """Birchgletscher plus every grid tile used by a village, each listed once."""
+    aois = {"Birchgletscher": BIRCHGLETSCHER_BBOX}
+    if include_villages:
+        index = get_aoi_index()
+        village_tiles = {
+            tile for name in index.names() if name != "Birchgletscher" for tile in index.tiles(name)
+        }
+        for column, row in sorted(village_tiles):
+            aois[f"tile {column},{row}"] = tile_bbox((column, row))
+    return aois
+
+
+def _date_range(start, end):
+    current = start
+    while current <= end:
+        yield current.strftime("%Y-%m-%d")
+        current += timedelta(days=1)
+
+
+def _is_final(info, date_str):
+    """Whether a lookup result should not be repeated when resuming."""
+    if info.get("file_path"):
+        return True
+    if info.get("retryable"):
+        return False
+    # Recent days may still receive scenes, so misses there are retried.
+    settled = (date.today() - timedelta(days=INGESTION_LAG_DAYS)).isoformat()
+    return date_str < settled
+
+
+def prefetch(
+    aois,
+    start,
+    end,
+    save_folder="cache",
+    max_workers=MAX_PARALLEL_REQUESTS,
+    progress=None,
+):
+    """Warm the image cache for every AOI and day in ``start``..``end``.
+
+    Finished (AOI, date) pairs are recorded in the cache folder, so an
+    interrupted run resumes where it stopped. ``progress`` is called with
+    ``(aoi_name, date, info)`` after each lookup. Returns a count summary.
+    """
+    state = PrefetchState(Path(save_folder) / PREFETCH_STATE_FILE)
+    summary = {"found": 0, "missing": 0, "skipped": 0}
+    for name, bbox in aois.items():
+        dates = []
+        for date_str in _date_range(start, end):
+            if state.is_done(bbox, date_str):
+                summary["skipped"] += 1
+            else:
+                dates.append(date_str)
+
+        results = download_sentinel_images(
+            dates,
+            save_folder=save_folder,
+            bbox=bbox,
+            priority=PREFETCH,
+            max_workers=max_workers,
+        )
+        try:
+            for date_str, info in results:
+                summary["found" if info.get("file_path") else "missing"] += 1
+                if _is_final(info, date_str):
+                    state.mark_done(bbox, date_str)
+                if progress:
+                    progress(name, date_str, info)
+        finally:
+            state.flush()
+    return summary
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def start_prefetch_worker(
+    interval_seconds,
+    days=PREFETCH_DAYS,
+    save_folder="cache",
+    include_villages=True,
+    max_workers=2,
+):
+    """Start (once per process) a daemon thread that prefetches the last ``days`` days."""
+    global _worker
+
+    def run():
+        while True:
+            end = date.today()
+            try:
+                prefetch(
+                    default_aois(include_villages),
+                    end - timedelta(days=days - 1),
+                    end,
+                    save_folder=save_folder,
+                    max_workers=max_workers,
+                )
+            except Exception:
+                logger.warning("Sentinel prefetch failed", exc_info=True)
+            time.sleep(interval_seconds)
+
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=run, name="sentinel-prefetch", daemon=True)
+            _worker.start()
+        return _worker
+
+
+def _parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m sentinel_img",
+        description="Warm the local Sentinel image cache without the Streamlit app.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    warm = commands.add_parser("prefetch", help="download images for a date range")
+    warm.add_argument(
+        "--bbox",
+        nargs=4,
+        type=float,
+        action="append",
+        metavar=("WEST", "SOUTH", "EAST", "NORTH"),
+        help="area to prefetch; may be repeated (default: Birchgletscher and all villages)",
+    )
+    warm.add_argument("--from", dest="start", type=_parse_date, help="first date, YYYY-MM-DD")
+    warm.add_argument("--to", dest="end", type=_parse_date, help="last date, YYYY-MM-DD")
+    warm.add_argument(
+        "--days",
+        type=int,
+        default=PREFETCH_DAYS,
+        help=f"days back from --to when --from is omitted (default: {PREFETCH_DAYS})",
+    )
+    warm.add_argument("--no-villages", action="store_true", help="skip the village AOIs")
+    warm.add_argument("--cache", default="cache", help="cache folder (default: cache)")
+    warm.add_argument("--workers", type=int, default=MAX_PARALLEL_REQUESTS)
+    warm.add_argument(
+        "--metrics-file", help="write stage timings and counters here (Prometheus text format)"
+    )
+    args = parser.parse_args(argv)
+
+    end = args.end or date.today()
+    start = args.start or end - timedelta(days=args.days - 1)
+    if start > end:
+        parser.error("--from must be on or before --to")
+
+    if args.bbox:
+        aois = {f"bbox {index}": bbox for index, bbox in enumerate(args.bbox, start=1)}
+    else:
+        aois = default_aois(include_villages=not args.no_villages)
+
+    def report(name, date_str, info):
+        if info.get("file_path"):
+            print(f"{name} {date_str}: {info['date']} ({'cached' if info['cached'] else 'new'})")
+        else:
+            print(f"{name} {date_str}: {info.get('error')}")
+
+    summary = prefetch(
+        aois, start, end, save_folder=args.cache, max_workers=args.workers, progress=report
+    )
+    print(
+        f"Done: {summary['found']} found, {summary['missing']} missing, "
+        f"{summary['skipped']} already finished."
+    )
+    if args.metrics_file:
+        write_metrics(args.metrics_file)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,255 @@
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from attachments import process_pending, process_report_attachments
+from report_store import DEFAULT_REPORTS_DIR, get_report_store, new_report_id
+
+
+QUEUE_MAX_REPORTS = 500
+# The writer commits up to WRITE_BATCH_SIZE reports at once, waiting at most
+# WRITE_BATCH_SECONDS for a batch to fill after the first report arrives.
+WRITE_BATCH_SIZE = 50
+WRITE_BATCH_SECONDS = 0.2
+WAL_NAME = "ingest.wal"
+# Failed writes are retried in-process after WRITE_RETRY_SECONDS times the
+# attempt number; after WRITE_MAX_ATTEMPTS they wait for the next restart.
+WRITE_MAX_ATTEMPTS = 3
+WRITE_RETRY_SECONDS = 5.0
+
+QUEUED = "queued"
+SAVING = "saving"
+STORED = "stored"
+FAILED = "failed"
+UNKNOWN = "unknown"
+
+
+class QueueFull(RuntimeError):
+    """Too many reports are waiting to be written; the submit should be retried."""
+
+
+class ReportQueue:
+    """Bounded in-process queue in front of the report store.
+
+    :meth:`submit` appends the report to a write-ahead log and returns its
+    id at once; a writer thread fsyncs the log and stores reports in
+    batches, then runs ``post_process(report_id, store)`` hooks. A report
+    that fails to write is retried alone a few times; reports still in the
+    log after a restart are stored on start-up. Attachments
+    only live in memory until written, so those are lost if the process dies
+    first; the recovered report then carries an error naming them.
+    """
+
+    def __init__(
+        self, store, root=DEFAULT_REPORTS_DIR, maxsize=QUEUE_MAX_REPORTS, post_process=()
+    ):
+        self.store = store
+        self.wal_path = Path(root) / WAL_NAME
+        self.wal_path.parent.mkdir(parents=True, exist_ok=True)
+        self.post_process = list(post_process)
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._status = {}
+        self._errors = {}
+        self._in_flight = 0
+        self._attempts = {}
+        # Reports that ran out of attempts stay in the log and are retried on restart.
+        self._unwritten = set()
+        recovered = self._recover()
+        self._wal = open(self.wal_path, "a", encoding="utf-8")
+        self._writer = threading.Thread(target=self._run, name="report-writer", daemon=True)
+        self._writer.start()
+        for record in recovered:
+            self._track(record["id"])
+            self._queue.put((record, []))
+
+    def _recover(self):
+        pending = {}
+        try:
+            with open(self.wal_path, encoding="utf-8") as handle:
+                for line in handle:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn final line from a crash mid-append.
+                        continue
+                    if record["op"] == "submit":
+                        pending[record["id"]] = record
+                    else:
+                        pending.pop(record["id"], None)
+        except OSError:
+            return []
+        return list(pending.values())
+
+    def _append(self, record):
+        self._wal.write(json.dumps(record) + "\n")
+        self._wal.flush()
+
+    def _track(self, report_id):
+        self._status[report_id] = QUEUED
+        self._in_flight += 1
+
+    def submit(self, name, email, message, uploaded_files=()):
+        """Queue a report and return its id without waiting for it to be stored."""
+        created_at = datetime.now(timezone.utc)
+        record = {
+            "op": "submit",
+            "id": new_report_id(created_at),
+            "created_at": created_at.isoformat(),
+            "name": name,
+            "email": email,
+            "message": message,
+            "attachments": [uploaded_file.name for uploaded_file in uploaded_files or []],
+        }
+        with self._lock:
+            if self._queue.full():
+                raise QueueFull("Too many reports are being saved right now. Please retry.")
+            self._append(record)
+            self._track(record["id"])
+            self._queue.put_nowait((record, list(uploaded_files or [])))
+        return record["id"]
+
+    def status(self, report_id):
+        """Return ``(state, error)`` for a report id; state is one of the module constants."""
+        with self._lock:
+            state = self._status.get(report_id)
+            error = self._errors.get(report_id)
+        if state is None:
+            state = STORED if self.store.has_report(report_id) else UNKNOWN
+        return state, error
+
+    def pending(self):
+        with self._lock:
+            return self._in_flight
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + WRITE_BATCH_SECONDS
+        while len(batch) < WRITE_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                with self._lock:
+                    for record, _files in batch:
+                        self._status[record["id"]] = SAVING
+                    # Group commit: one fsync makes the whole batch durable.
+                    os.fsync(self._wal.fileno())
+                self._write(batch)
+            except Exception as exc:
+                # Keep the writer alive; reports the batch did not finish are retried.
+                for record, files in batch:
+                    with self._lock:
+                        unfinished = self._status.get(record["id"]) == SAVING
+                    if unfinished:
+                        self._failed(record, files, str(exc))
+
+    def _failed(self, record, files, error):
+        report_id = record["id"]
+        with self._lock:
+            attempts = self._attempts[report_id] = self._attempts.get(report_id, 0) + 1
+            self._errors[report_id] = error
+            retry = attempts < WRITE_MAX_ATTEMPTS
+            if retry:
+                self._status[report_id] = QUEUED
+            else:
+                self._status[report_id] = FAILED
+                self._unwritten.add(report_id)
+                self._in_flight -= 1
+        if retry:
+            timer = threading.Timer(
+                WRITE_RETRY_SECONDS * attempts, self._queue.put, args=((record, files),)
+            )
+            timer.daemon = True
+            timer.start()
+
+    @staticmethod
+    def _report_fields(record, files):
+        return {
+            "name": record["name"],
+            "email": record["email"],
+            "message": record["message"],
+            "uploaded_files": files,
+            "created_at": datetime.fromisoformat(record["created_at"]),
+            "report_id": record["id"],
+        }
+
+    def _write(self, batch):
+        # Reports replayed from the log may already have been stored.
+        new = [item for item in batch if not self.store.has_report(item[0]["id"])]
+        failures = {}
+        try:
+            self.store.add_reports(self._report_fields(record, files) for record, files in new)
+        except Exception:
+            # Store one at a time so a bad report does not fail the rest of the batch.
+            for record, files in new:
+                try:
+                    self.store.add_reports([self._report_fields(record, files)])
+                except Exception as exc:
+                    failures[record["id"]] = str(exc)
+
+        for record, files in batch:
+            report_id = record["id"]
+            error = failures.get(report_id)
+            if error:
+                self._failed(record, files, error)
+                continue
+
+            if record["attachments"] and not files:
+                # Replayed from the log after a restart; the uploads were only in memory.
+                with self._lock:
+                    self._errors[report_id] = (
+                        "Its attachments were lost in a restart before they were saved: "
+                        f"{', '.join(record['attachments'])}."
+                    )
+            for hook in self.post_process:
+                try:
+                    hook(report_id, self.store)
+                except Exception as exc:
+                    # The report itself is stored; only the extra work is missing.
+                    with self._lock:
+                        self._errors[report_id] = f"Post-processing failed: {exc}"
+            with self._lock:
+                # Stored reports are answered from the store from now on.
+                self._status.pop(report_id, None)
+                self._attempts.pop(report_id, None)
+                self._in_flight -= 1
+                self._append({"op": "done", "id": report_id})
+        self._compact()
+
+    def _compact(self):
+        """Truncate the log once everything in it has been written."""
+        with self._lock:
+            if self._in_flight == 0 and not self._unwritten:
+                self._wal.truncate(0)
+                self._wal.seek(0)
+
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+def get_report_queue(root=DEFAULT_REPORTS_DIR):
+    """Return the process-wide queue (and writer thread) for ``root``."""
+    root = Path(root)
+    with _queues_lock:
+        if root not in _queues:
+            _queues[root] = ReportQueue(
+                get_report_store(root), root, post_process=(process_report_attachments,)
+            )
+            # Catch up on attachments stored before processing existed.
+            process_pending(_queues[root].store)
+        return _queues[root]
@@ -0,0 +1,366 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+
+DEFAULT_REPORTS_DIR = Path("reports")
+DATABASE_NAME = "reports.sqlite"
+COPY_CHUNK_BYTES = 1024 * 1024
+# Ids bound per "IN (...)" query; older SQLite builds allow 999 parameters.
+QUERY_ID_CHUNK = 500
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    id TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    name TEXT NOT NULL,
+    email TEXT NOT NULL,
+    message TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reports_created_at ON reports (created_at);
+CREATE TABLE IF NOT EXISTS attachments (
+    report_id TEXT NOT NULL REFERENCES reports (id),
+    position INTEGER NOT NULL,
+    original_name TEXT NOT NULL,
+    stored_name TEXT NOT NULL,
+    content_type TEXT,
+    size_bytes INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    PRIMARY KEY (report_id, position)
+);
+CREATE INDEX IF NOT EXISTS attachments_sha256 ON attachments (sha256);
+CREATE TABLE IF NOT EXISTS derivatives (
+    sha256 TEXT PRIMARY KEY,
+    thumbnail TEXT,
+    preview TEXT,
+    width INTEGER,
+    height INTEGER,
+    captured_at TEXT,
+    latitude REAL,
+    longitude REAL,
+    details TEXT NOT NULL
+);
+"""
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS reports_fts
+USING fts5 (message, name, content='reports', content_rowid='rowid');
+"""
+
+
+def safe_attachment_name(file_name, index):
+    original = Path(file_name)
+    stem = re.sub(r"[^A-Za-z0-9._-]+", "_", original.stem).strip("._")
+    suffix = original.suffix.lower()
+    return f"{index:02d}_{stem or 'attachment'}{suffix}"
+
+
+def new_report_id(created_at):
+    return f"{created_at:%Y%m%dT%H%M%SZ}_{uuid.uuid4().hex[:8]}"
+
+
+def _match_query(text):
+    """Turn free text into an FTS5 query matching all words as prefixes."""
+    return " ".join(f'"{word}"*' for word in re.findall(r"\w+", text))
+
+
+class ReportStore:
+    """Contact reports indexed in SQLite, with attachments stored by content hash.
+
+    Attachments are streamed to ``root/blobs`` in chunks while being hashed,
+    so identical uploads are kept once however many reports include them.
+    """
+
+    def __init__(self, root=DEFAULT_REPORTS_DIR):
+        self.root = Path(root)
+        self.blobs_dir = self.root / "blobs"
+        self.blobs_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.root / DATABASE_NAME, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+        try:
+            self._db.executescript(FTS_SCHEMA)
+            self.full_text = True
+        except sqlite3.OperationalError:
+            # SQLite builds without FTS5 fall back to substring search.
+            self.full_text = False
+        self._import_legacy_reports()
+
+    def blob_path(self, sha256):
+        return self.blobs_dir / sha256[:2] / sha256
+
+    def _store_blob(self, stream):
+        """Copy ``stream`` into the blob store; return ``(sha256, size)``."""
+        digest = hashlib.sha256()
+        size = 0
+        tmp_path = self.blobs_dir / f".{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as handle:
+                for chunk in iter(lambda: stream.read(COPY_CHUNK_BYTES), b""):
+                    digest.update(chunk)
+                    handle.write(chunk)
+                    size += len(chunk)
+
+            sha256 = digest.hexdigest()
+            path = self.blob_path(sha256)
+            if not path.exists():
+                path.parent.mkdir(exist_ok=True)
+                os.replace(tmp_path, path)
+        finally:
+            # Already moved into place, or a duplicate or failed copy to discard.
+            tmp_path.unlink(missing_ok=True)
+        return sha256, size
+
+    def _insert(self, rows):
+        """Insert ``(report, attachments)`` pairs in one transaction."""
+        with self._lock, self._db:
+            for report, attachments in rows:
+                cursor = self._db.execute(
+                    "INSERT INTO reports (id, created_at, name, email, message) "
+                    "VALUES (:id, :created_at, :name, :email, :message)",
+                    report,
+                )
+                if self.full_text:
+                    self._db.execute(
+                        "INSERT INTO reports_fts (rowid, message, name) VALUES (?, ?, ?)",
+                        (cursor.lastrowid, report["message"], report["name"]),
+                    )
+                self._db.executemany(
+                    "INSERT INTO attachments (report_id, position, original_name, stored_name, "
+                    "content_type, size_bytes, sha256) VALUES (:report_id, :position, "
+                    ":original_name, :stored_name, :content_type, :size_bytes, :sha256)",
+                    [{"report_id": report["id"], **attachment} for attachment in attachments],
+                )
+
+    def add_report(
+        self, name, email, message, uploaded_files=(), created_at=None, report_id=None
+    ):
+        """Store a report and its attachments; return the report id.
+
+        ``uploaded_files`` are file-like objects with ``name``, ``type`` and
+        ``read`` (e.g. Streamlit uploads); they are never read into memory whole.
+        """
+        row = self._prepare(name, email, message, uploaded_files, created_at, report_id)
+        self._insert([row])
+        return row[0]["id"]
+
+    def add_reports(self, reports):
+        """Store several reports (dicts of :meth:`add_report` arguments) in one commit."""
+        rows = [self._prepare(**report) for report in reports]
+        self._insert(rows)
+        return [report["id"] for report, _attachments in rows]
+
+    def _prepare(
+        self, name, email, message, uploaded_files=(), created_at=None, report_id=None
+    ):
+        created_at = created_at or datetime.now(timezone.utc)
+        report_id = report_id or new_report_id(created_at)
+        attachments = []
+        for index, uploaded_file in enumerate(uploaded_files or [], start=1):
+            uploaded_file.seek(0)
+            sha256, size = self._store_blob(uploaded_file)
+            attachments.append(
+                {
+                    "position": index,
+                    "original_name": uploaded_file.name,
+                    "stored_name": safe_attachment_name(uploaded_file.name, index),
+                    "content_type": getattr(uploaded_file, "type", None),
+                    "size_bytes": size,
+                    "sha256": sha256,
+                }
+            )
+
+        report = {
+            "id": report_id,
+            "created_at": created_at.isoformat(),
+            "name": name.strip(),
+            "email": email.strip(),
+            "message": message.strip(),
+        }
+        return report, attachments
+
+    def _filters(self, query, start, end):
+        clauses, params = [], []
+        if query and query.strip():
+            if self.full_text:
+                match = _match_query(query)
+                if match:
+                    clauses.append(
+                        "r.rowid IN (SELECT rowid FROM reports_fts WHERE reports_fts MATCH ?)"
+                    )
+                    params.append(match)
+            else:
+                clauses.append("(r.message LIKE ? OR r.name LIKE ?)")
+                params.extend([f"%{query.strip()}%"] * 2)
+        if start:
+            clauses.append("r.created_at >= ?")
+            params.append(str(start))
+        if end:
+            clauses.append("r.created_at < ?")
+            params.append(str(end))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return where, params
+
+    def has_report(self, report_id):
+        with self._lock:
+            row = self._db.execute("SELECT 1 FROM reports WHERE id = ?", (report_id,)).fetchone()
+        return row is not None
+
+    def count_reports(self, query=None, start=None, end=None):
+        where, params = self._filters(query, start, end)
+        with self._lock:
+            return self._db.execute(f"SELECT COUNT(*) FROM reports r {where}", params).fetchone()[0]
+
+    def list_reports(self, query=None, start=None, end=None, limit=50, offset=0):
+        """Return reports matching the filters, newest first.
+
+        ``query`` is matched against message and name words (prefixes);
+        ``start`` and ``end`` bound ``created_at`` as ISO timestamps or dates,
+        ``end`` exclusive.
+        """
+        where, params = self._filters(query, start, end)
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT r.id, r.created_at, r.name, r.email, r.message, "
+                "(SELECT COUNT(*) FROM attachments a WHERE a.report_id = r.id) AS attachments "
+                f"FROM reports r {where} ORDER BY r.created_at DESC LIMIT ? OFFSET ?",
+                [*params, limit, offset],
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def attachments(self, report_id):
+        """Return a report's attachments with their derivatives, if processed yet."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT a.*, d.thumbnail, d.preview, d.width, d.height, d.captured_at, "
+                "d.latitude, d.longitude, d.details FROM attachments a "
+                "LEFT JOIN derivatives d ON d.sha256 = a.sha256 "
+                "WHERE a.report_id = ? ORDER BY a.position",
+                (report_id,),
+            ).fetchall()
+        attachments = []
+        for row in rows:
+            attachment = {**dict(row), "path": str(self.blob_path(row["sha256"]))}
+            attachment["details"] = json.loads(row["details"]) if row["details"] else None
+            for name in ("thumbnail", "preview"):
+                if row[name]:
+                    attachment[name] = str(self.root / row[name])
+            attachments.append(attachment)
+        return attachments
+
+    def unprocessed_attachments(self, report_id=None):
+        """Return ``(sha256, content_type)`` of stored blobs without derivatives."""
+        query = (
+            "SELECT DISTINCT a.sha256, a.content_type FROM attachments a "
+            "LEFT JOIN derivatives d ON d.sha256 = a.sha256 WHERE d.sha256 IS NULL"
+        )
+        params = ()
+        if report_id is not None:
+            query += " AND a.report_id = ?"
+            params = (report_id,)
+        with self._lock:
+            return [tuple(row) for row in self._db.execute(query, params).fetchall()]
+
+    def record_derivatives(self, sha256, derived):
+        """Store what attachment processing produced for one blob.
+
+        ``thumbnail`` and ``preview`` are paths relative to the store root.
+        """
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO derivatives (sha256, thumbnail, preview, width, height, "
+                "captured_at, latitude, longitude, details) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    sha256,
+                    derived.get("thumbnail"),
+                    derived.get("preview"),
+                    derived.get("width"),
+                    derived.get("height"),
+                    derived.get("captured_at"),
+                    derived.get("latitude"),
+                    derived.get("longitude"),
+                    json.dumps(derived),
+                ),
+            )
+
+    def report_locations(self, report_ids=None):
+        """Return ``{report_id: (lat, lon)}`` from the GPS tags of report photos."""
+        query = (
+            "SELECT a.report_id, d.latitude, d.longitude FROM attachments a "
+            "JOIN derivatives d ON d.sha256 = a.sha256 WHERE d.latitude IS NOT NULL"
+        )
+        order = " ORDER BY a.report_id, a.position"
+        rows = []
+        with self._lock:
+            if report_ids is None:
+                rows = self._db.execute(query + order).fetchall()
+            else:
+                report_ids = list(dict.fromkeys(report_ids))
+                for offset in range(0, len(report_ids), QUERY_ID_CHUNK):
+                    chunk = report_ids[offset : offset + QUERY_ID_CHUNK]
+                    placeholders = ", ".join("?" * len(chunk))
+                    rows.extend(
+                        self._db.execute(
+                            f"{query} AND a.report_id IN ({placeholders}){order}", chunk
+                        ).fetchall()
+                    )
+        locations = {}
+        for report_id, latitude, longitude in rows:
+            locations.setdefault(report_id, (latitude, longitude))
+        return locations
+
+    def _import_legacy_reports(self):
+        """Index reports saved as ``<id>/report.json`` directories before this store."""
+        for report_json in sorted(self.root.glob("*/report.json")):
+            report_id = report_json.parent.name
+            if self.has_report(report_id):
+                continue
+            try:
+                payload = json.loads(report_json.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                continue
+
+            attachments = []
+            for index, saved in enumerate(payload.get("attachments", []), start=1):
+                source = report_json.parent / saved["stored_name"]
+                if not source.exists():
+                    continue
+                with open(source, "rb") as handle:
+                    sha256, size = self._store_blob(handle)
+                attachments.append(
+                    {
+                        "position": index,
+                        "original_name": saved["original_name"],
+                        "stored_name": saved["stored_name"],
+                        "content_type": saved.get("content_type"),
+                        "size_bytes": size,
+                        "sha256": sha256,
+                    }
+                )
+            report = {
+                "id": report_id,
+                "created_at": payload["created_at_utc"],
+                "name": payload.get("name", ""),
+                "email": payload.get("email", ""),
+                "message": payload.get("message", ""),
+            }
+            self._insert([(report, attachments)])
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_report_store(root=DEFAULT_REPORTS_DIR):
+    """Return the shared store for ``root`` so all sessions reuse one connection."""
+    root = Path(root)
+    with _stores_lock:
+        if root not in _stores:
+            _stores[root] = ReportStore(root)
+        return _stores[root]
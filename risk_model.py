@@ -0,0 +1,239 @@
+import importlib
+import math
+import os
+import threading
+import time
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from aoi import get_aoi_index
+from sentinel_cache import get_image_cache
+from sentinel_catalog import bbox_key
+from sentinel_img import BIRCHGLETSCHER_BBOX
+from villages import (
+    RISK_BINS,
+    RISK_COLORS,
+    RISK_LEVELS,
+    load_village_risk_data,
+    registry_version,
+)
+
+
+FEATURE_WINDOW_DAYS = 90
+EARTH_RADIUS_KM = 6371.0
+# Distance at which the hazard-proximity feature has dropped to 1/e.
+PROXIMITY_SCALE_KM = 15.0
+FEATURE_COLUMNS = [
+    "observations",
+    "brightness_change",
+    "snow_change",
+    "brightness_trend",
+    "snow_trend",
+    "distance_km",
+    "proximity",
+]
+# RISK_MODEL selects a model: a built-in name or "module:attribute" for a
+# class or object with ``predict(features, prior) -> scores``.
+DEFAULT_RISK_MODEL = "baseline"
+
+
+def _haversine_km(lat, lon, ref_lat, ref_lon):
+    lat, lon = np.radians(lat), np.radians(lon)
+    ref_lat, ref_lon = math.radians(ref_lat), math.radians(ref_lon)
+    a = (
+        np.sin((lat - ref_lat) / 2) ** 2
+        + np.cos(lat) * math.cos(ref_lat) * np.sin((lon - ref_lon) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def _observations(cache_folder, start):
+    """Quality records of cached renders since ``start``, one row per image."""
+    rows = [
+        (
+            bbox_key(entry["bbox"]),
+            entry["date"],
+            entry["quality"]["mean_brightness"],
+            entry["quality"]["snow_fraction"],
+        )
+        for entry in get_image_cache(cache_folder).entries().values()
+        if "quality" in entry and entry["date"] >= start
+    ]
+    obs = pd.DataFrame(rows, columns=["bbox_key", "date", "brightness", "snow"])
+    obs["date"] = pd.to_datetime(obs["date"])
+    return obs
+
+
+def _bbox_villages(bbox_keys, village_names):
+    """Map each cached bbox to the villages whose area it overlaps."""
+    index = get_aoi_index()
+    wanted = set(village_names)
+    pairs = []
+    for key in bbox_keys:
+        bbox = [float(value) for value in key.split(",")]
+        pairs.extend((key, name) for name in index.intersecting(bbox) if name in wanted)
+    return pd.DataFrame(pairs, columns=["bbox_key", "village"])
+
+
+def extract_features(village_data, cache_folder="cache", today=None):
+    """Return one feature row per village, in registry order.
+
+    Image features come from the quality records of cached renders overlapping
+    each village area within the last FEATURE_WINDOW_DAYS; trends are
+    least-squares slopes per 30 days. All aggregation is done per group, not
+    per village.
+    """
+    today = today or date.today()
+    start = today - timedelta(days=FEATURE_WINDOW_DAYS)
+    names = village_data["village"]
+    features = pd.DataFrame(0.0, index=pd.Index(names, name="village"), columns=FEATURE_COLUMNS)
+
+    obs = _observations(cache_folder, start.isoformat())
+    if not obs.empty:
+        links = _bbox_villages(obs["bbox_key"].unique(), names)
+        per_day = (
+            obs.merge(links, on="bbox_key")
+            .groupby(["village", "date"], sort=True)[["brightness", "snow"]]
+            .mean()
+            .reset_index()
+        )
+        if not per_day.empty:
+            per_day["t"] = (per_day["date"] - pd.Timestamp(start)).dt.days / 30.0
+            for column in ("brightness", "snow"):
+                per_day[f"t_{column}"] = per_day["t"] * per_day[column]
+            per_day["tt"] = per_day["t"] ** 2
+            grouped = per_day.groupby("village")
+            sums = grouped[["t", "brightness", "snow", "t_brightness", "t_snow", "tt"]].sum()
+            count = grouped.size()
+            first, last = grouped.first(), grouped.last()
+
+            denominator = (count * sums["tt"] - sums["t"] ** 2).replace(0, np.nan)
+            features.loc[count.index, "observations"] = count
+            for column in ("brightness", "snow"):
+                features.loc[count.index, f"{column}_change"] = last[column] - first[column]
+                slope = (count * sums[f"t_{column}"] - sums["t"] * sums[column]) / denominator
+                features.loc[count.index, f"{column}_trend"] = slope.fillna(0.0)
+
+    west, south, east, north = BIRCHGLETSCHER_BBOX
+    distance = _haversine_km(
+        village_data["lat"].to_numpy(),
+        village_data["lon"].to_numpy(),
+        (south + north) / 2,
+        (west + east) / 2,
+    )
+    features["distance_km"] = distance
+    features["proximity"] = np.exp(-distance / PROXIMITY_SCALE_KM)
+    return features
+
+
+class BaselineRiskModel:
+    """Logistic adjustment of the registry risk score by the image features.
+
+    Snow loss, surface brightness change and hazard proximity raise the
+    score; proximity only counts for villages with observations, so without
+    imagery the registry value is returned unchanged.
+    """
+
+    weights = {
+        "snow_change": -2.0,
+        "brightness_change": 0.02,
+        "snow_trend": -1.0,
+        "proximity": 1.0,
+    }
+
+    def predict(self, features, prior):
+        prior = np.clip(np.asarray(prior, dtype=float), 0.01, 0.99)
+        logit = np.log(prior / (1 - prior))
+        observed = features["observations"].to_numpy() > 0
+        for column, weight in self.weights.items():
+            values = features[column].to_numpy()
+            if column == "brightness_change":
+                values = np.abs(values)
+            elif column == "proximity":
+                values = np.where(observed, values, 0.0)
+            logit = logit + weight * values
+        return 1 / (1 + np.exp(-logit))
+
+
+RISK_MODELS = {"baseline": BaselineRiskModel}
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def get_risk_model(name=None):
+    """Return the model for ``name`` (default: RISK_MODEL env var), loaded once."""
+    name = name or os.getenv("RISK_MODEL", DEFAULT_RISK_MODEL)
+    with _models_lock:
+        if name not in _models:
+            if name in RISK_MODELS:
+                model = RISK_MODELS[name]
+            else:
+                module_name, _sep, attribute = name.partition(":")
+                model = getattr(importlib.import_module(module_name), attribute)
+            _models[name] = model() if isinstance(model, type) else model
+        return _models[name]
+
+
+def score_villages(village_data, cache_folder="cache", model=None, today=None):
+    """Score every village at once.
+
+    Returns ``(scores, timings)``: a frame with the features, ``model_score``,
+    ``model_level`` and ``model_color`` per village, and the milliseconds
+    spent on feature extraction and inference.
+    """
+    model = model or get_risk_model()
+    started = time.perf_counter()
+    features = extract_features(village_data, cache_folder, today)
+    extracted = time.perf_counter()
+    predicted = model.predict(features, village_data["risk_score"].to_numpy())
+    finished = time.perf_counter()
+
+    scores = village_data[["village", "lat", "lon", "risk_score"]].reset_index(drop=True)
+    scores = scores.join(features.reset_index(drop=True))
+    scores["model_score"] = np.round(predicted, 3)
+    scores["model_level"] = pd.cut(
+        scores["model_score"], RISK_BINS, labels=RISK_LEVELS, right=False
+    )
+    scores["model_color"] = scores["model_level"].map(RISK_COLORS).astype(str)
+    timings = {
+        "features_ms": (extracted - started) * 1000,
+        "inference_ms": (finished - extracted) * 1000,
+    }
+    return scores, timings
+
+
+_scores = {}
+_scores_lock = threading.Lock()
+
+
+def village_scores(cache_folder="cache", today=None):
+    """:func:`score_villages` for the registry, reused until its inputs change.
+
+    Results are shared across reruns and sessions and recomputed when the
+    registry file, the cached imagery, the selected model or the day changes.
+    ``timings["cached"]`` tells whether this call reused an earlier result.
+    """
+    today = today or date.today()
+    model_name = os.getenv("RISK_MODEL", DEFAULT_RISK_MODEL)
+    key = (
+        registry_version(),
+        str(cache_folder),
+        get_image_cache(cache_folder).generation,
+        model_name,
+        today,
+    )
+    with _scores_lock:
+        if key in _scores:
+            scores, timings = _scores[key]
+            return scores, {**timings, "cached": True}
+
+    scores, timings = score_villages(
+        load_village_risk_data(), cache_folder, get_risk_model(model_name), today
+    )
+    with _scores_lock:
+        _scores.clear()
+        _scores[key] = (scores, timings)
+    return scores, {**timings, "cached": False}
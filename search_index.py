@@ -0,0 +1,118 @@
+import bisect
+import re
+import unicodedata
+from collections import defaultdict
+
+import numpy as np
+
+
+# German umlauts are spelled out so "Lötschen" and "Loetschen" fold alike.
+UMLAUT_FOLDING = str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss"})
+EXACT_SCORE = 3.0
+NAME_PREFIX_SCORE = 2.0
+WORD_PREFIX_SCORE = 1.5
+# Minimum trigram (Dice) similarity for a fuzzy match.
+MIN_SIMILARITY = 0.35
+MIN_FUZZY_QUERY_LENGTH = 3
+# Prefix hits scanned per requested result; short queries can match thousands.
+PREFIX_SCAN_FACTOR = 4
+
+
+def normalize(text):
+    """Lower-case, accent-fold and collapse punctuation to single spaces."""
+    text = str(text).lower().translate(UMLAUT_FOLDING)
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(re.findall(r"[a-z0-9]+", text))
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[index : index + 3] for index in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """Prefix and trigram index over place names and their aliases.
+
+    Built once, then :meth:`search` answers ranked lookups without
+    scanning every name. Results refer to positions in ``names``.
+    """
+
+    def __init__(self, names, aliases=None):
+        self._names = [str(name) for name in names]
+        self._keys = []
+        self._sizes = []
+        self._trigrams = defaultdict(list)
+        prefixes = []
+        for position, name in enumerate(self._names):
+            labels = [name, *(aliases[position] if aliases is not None else ())]
+            for label in labels:
+                key = normalize(label)
+                if not key:
+                    continue
+                key_id = len(self._keys)
+                self._keys.append((key, position))
+                grams = trigrams(key)
+                self._sizes.append(len(grams))
+                for gram in grams:
+                    self._trigrams[gram].append(key_id)
+                # Whole names sort before equal words of longer names.
+                prefixes.append((key, 0, key_id))
+                prefixes.extend((word, 1, key_id) for word in key.split()[1:])
+
+        prefixes.sort()
+        self._prefixes = prefixes
+        self._trigrams = {
+            gram: np.asarray(key_ids, dtype=np.int32) for gram, key_ids in self._trigrams.items()
+        }
+        self._sizes = np.asarray(self._sizes, dtype=np.float32)
+        self._terms = [term for term, _kind, _key_id in prefixes]
+
+    def __len__(self):
+        return len(self._names)
+
+    def search(self, query, limit=20):
+        """Return up to ``limit`` ``(position, score)`` pairs, best match first.
+
+        Exact names rank above name prefixes, then word prefixes (e.g. "fee"
+        for "Saas-Fee"), then typo-tolerant trigram matches.
+        """
+        query = normalize(query)
+        if not query:
+            return []
+
+        best = {}
+
+        def offer(key_id, score):
+            position = self._keys[key_id][1]
+            if score > best.get(position, 0.0):
+                best[position] = score
+
+        start = bisect.bisect_left(self._terms, query)
+        scan_end = min(len(self._terms), start + limit * PREFIX_SCAN_FACTOR)
+        for term, kind, key_id in self._prefixes[start:scan_end]:
+            if not term.startswith(query):
+                break
+            if kind == 0:
+                offer(key_id, EXACT_SCORE if term == query else NAME_PREFIX_SCORE)
+            else:
+                offer(key_id, WORD_PREFIX_SCORE)
+
+        if len(best) < limit and len(query) >= MIN_FUZZY_QUERY_LENGTH:
+            grams = trigrams(query)
+            postings = [self._trigrams[gram] for gram in grams if gram in self._trigrams]
+            if postings:
+                shared = np.bincount(np.concatenate(postings), minlength=len(self._keys))
+                similarity = 2 * shared / (len(grams) + self._sizes)
+                candidates = np.flatnonzero(similarity >= MIN_SIMILARITY)
+                if len(candidates) > limit:
+                    top = np.argpartition(-similarity[candidates], limit)[:limit]
+                    candidates = candidates[top]
+                for key_id in candidates:
+                    offer(int(key_id), float(similarity[key_id]))
+
+        ranked = sorted(
+            best.items(),
+            key=lambda item: (-item[1], len(self._names[item[0]]), self._names[item[0]]),
+        )
+        return ranked[:limit]
@@ -0,0 +1,421 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import date, timedelta
+from pathlib import Path
+
+from metrics import increment, span
+
+try:
+    import fcntl
+except ImportError:  # Windows: downloads are only coordinated within one process.
+    fcntl = None
+
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+# How long a failed lookup is remembered, by reason. Outcomes that will not
+# change for the same request are kept long; transient failures only briefly.
+NEGATIVE_TTL_SECONDS = {
+    "no_acquisition": 30 * DAY,
+    "dark": 30 * DAY,
+    "low_quality": 30 * DAY,
+    "rejected": DAY,
+    "http_error": 15 * 60,
+    "request_failed": 5 * 60,
+}
+# Permanent outcomes for recent dates may still change while new scenes are
+# being ingested, so they are only trusted for a few hours.
+RECENT_DAYS = 3
+RECENT_TTL_SECONDS = 6 * HOUR
+
+# Disk budget for cached images; override with SENTINEL_CACHE_MAX_MB.
+DEFAULT_CACHE_MAX_MB = 2048
+MANIFEST_FLUSH_SECONDS = 30
+# Cache keys share this many lock files, so the lock directory stays small;
+# two keys on one stripe only serialize their downloads.
+LOCK_STRIPES = 256
+
+
+def request_key(bbox, date_str, evalscript):
+    raw = json.dumps(
+        {"bbox": [float(value) for value in bbox], "date": date_str, "evalscript": evalscript},
+        sort_keys=True,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _write_json_atomic(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp_path.write_text(json.dumps(data, sort_keys=True), encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+def _mtime_ns(path):
+    try:
+        return path.stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive advisory lock on ``path`` across processes (a no-op without fcntl)."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a+b") as handle:
+        if fcntl is not None:
+            with span("file_lock_wait"):
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+
+
+class NegativeCache:
+    """Persistent record of failed (bbox, date, evalscript) lookups with expiry."""
+
+    def __init__(self, path, clock=time.time):
+        self.path = Path(path)
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._loaded_mtime = _mtime_ns(self.path)
+        self._entries = self._load()
+
+    def _load(self):
+        try:
+            entries = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+        now = self.clock()
+        return {key: entry for key, entry in entries.items() if entry["expires_at"] > now}
+
+    def _merge_from_disk(self):
+        """Adopt failures recorded by other processes since the file was last read."""
+        mtime = _mtime_ns(self.path)
+        if mtime == self._loaded_mtime:
+            return
+        self._loaded_mtime = mtime
+        for key, entry in self._load().items():
+            current = self._entries.get(key)
+            if current is None or entry["recorded_at"] > current["recorded_at"]:
+                self._entries[key] = entry
+
+    def ttl_for(self, reason, date_str):
+        ttl = NEGATIVE_TTL_SECONDS.get(reason, NEGATIVE_TTL_SECONDS["request_failed"])
+        recent_cutoff = (date.today() - timedelta(days=RECENT_DAYS)).isoformat()
+        if date_str >= recent_cutoff:
+            ttl = min(ttl, RECENT_TTL_SECONDS)
+        return ttl
+
+    def get(self, bbox, date_str, evalscript):
+        """Return the unexpired failure entry for this request, or None."""
+        key = request_key(bbox, date_str, evalscript)
+        with self._lock:
+            if key not in self._entries:
+                self._merge_from_disk()
+            entry = self._entries.get(key)
+            if entry is not None and entry["expires_at"] <= self.clock():
+                del self._entries[key]
+                entry = None
+        increment("cache_lookups", cache="negative", result="miss" if entry is None else "hit")
+        return dict(entry) if entry is not None else None
+
+    def record(self, bbox, date_str, evalscript, reason, detail, quality=None):
+        now = self.clock()
+        entry = {
+            "date": date_str,
+            "bbox": list(bbox),
+            "reason": reason,
+            "detail": detail,
+            "recorded_at": now,
+            "expires_at": now + self.ttl_for(reason, date_str),
+        }
+        if quality is not None:
+            entry["quality"] = quality
+        with self._lock, file_lock(self.path.with_suffix(".lock")):
+            self._merge_from_disk()
+            self._entries[request_key(bbox, date_str, evalscript)] = entry
+            self._entries = {
+                key: value for key, value in self._entries.items() if value["expires_at"] > now
+            }
+            _write_json_atomic(self.path, self._entries)
+            self._loaded_mtime = _mtime_ns(self.path)
+        return entry
+
+    def clear(self):
+        with self._lock, file_lock(self.path.with_suffix(".lock")):
+            self._entries = {}
+            self.path.unlink(missing_ok=True)
+            self._loaded_mtime = None
+
+
+_negative_caches = {}
+_negative_caches_lock = threading.Lock()
+
+
+def get_negative_cache(path):
+    """Return the shared negative cache for ``path``."""
+    path = Path(path)
+    with _negative_caches_lock:
+        if path not in _negative_caches:
+            _negative_caches[path] = NegativeCache(path)
+        return _negative_caches[path]
+
+
+def payload_key(payload):
+    """Content address of a process-API request: hash of the canonical payload."""
+    raw = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _default_max_bytes():
+    return int(float(os.getenv("SENTINEL_CACHE_MAX_MB", DEFAULT_CACHE_MAX_MB)) * 1024 * 1024)
+
+
+def _bboxes_equal(left, right):
+    return [round(float(value), 5) for value in left] == [round(float(value), 5) for value in right]
+
+
+class ImageCache:
+    """Content-addressed image store with a manifest, a disk budget and LRU eviction.
+
+    Images live in ``<root>/images/<key><suffix>`` where ``key`` hashes the full
+    request payload, so changing the bbox, size, cloud filter or evalscript
+    never returns a stale image. ``manifest.json`` records size, last access and
+    hit count for each entry. ``generation`` changes whenever an entry is
+    added or removed, so derived results can be cached against it.
+
+    Several processes may share one root: image files are written atomically,
+    manifest writes merge entries added by other processes under a file lock,
+    and a miss first adopts entries another process has written since.
+    """
+
+    def __init__(self, root, max_bytes=None, clock=time.time):
+        self.root = Path(root)
+        self.images_dir = self.root / "images"
+        self.manifest_path = self.root / "manifest.json"
+        self.manifest_lock_path = self.root / "manifest.lock"
+        self.max_bytes = _default_max_bytes() if max_bytes is None else max_bytes
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._loaded_mtime = _mtime_ns(self.manifest_path)
+        self._entries = self._load()
+        self._last_flush = self.clock()
+        self.generation = 0
+
+    def _load(self):
+        try:
+            return json.loads(self.manifest_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+
+    def _merge_from_disk(self):
+        """Adopt entries other processes added since the manifest was last read."""
+        mtime = _mtime_ns(self.manifest_path)
+        if mtime == self._loaded_mtime:
+            return
+        self._loaded_mtime = mtime
+        adopted = 0
+        for key, entry in self._load().items():
+            # Entries whose file is gone were evicted by their writer.
+            if key not in self._entries and self._path_for(entry).exists():
+                self._entries[key] = entry
+                adopted += 1
+        if adopted:
+            self.generation += 1
+
+    def _flush(self):
+        with file_lock(self.manifest_lock_path):
+            self._merge_from_disk()
+            _write_json_atomic(self.manifest_path, self._entries)
+            self._loaded_mtime = _mtime_ns(self.manifest_path)
+        self._last_flush = self.clock()
+
+    def _path_for(self, entry):
+        return self.images_dir / entry["file"]
+
+    def total_bytes(self):
+        with self._lock:
+            return sum(entry["size_bytes"] for entry in self._entries.values())
+
+    def entries(self):
+        with self._lock:
+            return {key: dict(entry) for key, entry in self._entries.items()}
+
+    def get(self, payload, touch=True):
+        """Return the cached entry for ``payload`` (with ``path``), or None.
+
+        ``touch=False`` checks for an entry without counting it as an access.
+        """
+        key = payload_key(payload)
+        with self._lock:
+            if key not in self._entries:
+                self._merge_from_disk()
+            entry = self._entries.get(key)
+            if entry is not None:
+                path = self._path_for(entry)
+                if not path.exists():
+                    del self._entries[key]
+                    self._flush()
+                    entry = None
+            if entry is None:
+                if touch:
+                    increment("cache_lookups", cache="image", result="miss")
+                return None
+
+            if not touch:
+                return {**entry, "key": key, "path": str(path)}
+
+            increment("cache_lookups", cache="image", result="hit")
+            entry["last_access"] = self.clock()
+            entry["hits"] += 1
+            # Access stats only steer eviction, so they are flushed lazily.
+            if entry["last_access"] - self._last_flush >= MANIFEST_FLUSH_SECONDS:
+                self._flush()
+            return {**entry, "key": key, "path": str(path)}
+
+    def put(self, payload, content, date, bbox, suffix=".png", **metadata):
+        """Store ``content`` for ``payload`` and return its entry (with ``path``)."""
+        key = payload_key(payload)
+        file_name = f"{key}{suffix}"
+        path = self.images_dir / file_name
+        with span("cache_write"):
+            self.images_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp_path.write_bytes(content)
+            os.replace(tmp_path, path)
+
+        now = self.clock()
+        entry = {
+            "file": file_name,
+            "date": date,
+            "bbox": [float(value) for value in bbox],
+            "size_bytes": len(content),
+            "created_at": now,
+            "last_access": now,
+            "hits": 0,
+            **metadata,
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self.generation += 1
+            self._evict_to_budget(keep=key)
+            self._flush()
+        return {**entry, "key": key, "path": str(path)}
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.generation += 1
+        self._path_for(entry).unlink(missing_ok=True)
+        return entry["size_bytes"]
+
+    def _evict_to_budget(self, keep=None):
+        total = sum(entry["size_bytes"] for entry in self._entries.values())
+        if total <= self.max_bytes:
+            return 0
+
+        evicted = 0
+        by_age = sorted(self._entries, key=lambda key: self._entries[key]["last_access"])
+        for key in by_age:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= self._remove(key)
+            evicted += 1
+        return evicted
+
+    def evict(self, bbox=None, start=None, end=None):
+        """Remove entries matching an AOI and/or inclusive date range; return the count."""
+        with self._lock:
+            matching = [
+                key
+                for key, entry in self._entries.items()
+                if (bbox is None or _bboxes_equal(entry["bbox"], bbox))
+                and (start is None or entry["date"] >= start)
+                and (end is None or entry["date"] <= end)
+            ]
+            for key in matching:
+                self._remove(key)
+            if matching:
+                self._flush()
+            return len(matching)
+
+    def clear(self):
+        return self.evict()
+
+
+_image_caches = {}
+_image_caches_lock = threading.Lock()
+
+
+def get_image_cache(root):
+    """Return the shared image cache rooted at ``root``."""
+    root = Path(root)
+    with _image_caches_lock:
+        if root not in _image_caches:
+            _image_caches[root] = ImageCache(root)
+        return _image_caches[root]
+
+
+class SingleFlight:
+    """Run at most one call per key at a time, across threads and processes.
+
+    Threads asking for a key that is already in flight wait for the owner's
+    result instead of calling again. The owner also holds a file lock for the
+    key, so ``call`` should first re-check the shared cache: another process
+    may have finished the same work while this one waited.
+    """
+
+    def __init__(self, lock_dir):
+        self.lock_dir = Path(lock_dir)
+        self._lock = threading.Lock()
+        self._futures = {}
+
+    def _lock_path(self, key):
+        stripe = int(hashlib.sha256(key.encode("utf-8")).hexdigest()[:8], 16) % LOCK_STRIPES
+        return self.lock_dir / f"{stripe:03d}.lock"
+
+    def run(self, key, call):
+        with self._lock:
+            future = self._futures.get(key)
+            owner = future is None
+            if owner:
+                future = self._futures[key] = Future()
+
+        if not owner:
+            increment("single_flight", result="joined")
+            return future.result()
+
+        increment("single_flight", result="owner")
+        try:
+            with file_lock(self._lock_path(key)):
+                future.set_result(call())
+        except BaseException as exc:
+            future.set_exception(exc)
+        finally:
+            with self._lock:
+                del self._futures[key]
+        return future.result()
+
+
+_single_flights = {}
+_single_flights_lock = threading.Lock()
+
+
+def get_single_flight(lock_dir):
+    """Return the shared single-flight coordinator using locks in ``lock_dir``."""
+    lock_dir = Path(lock_dir)
+    with _single_flights_lock:
+        if lock_dir not in _single_flights:
+            _single_flights[lock_dir] = SingleFlight(lock_dir)
+        return _single_flights[lock_dir]
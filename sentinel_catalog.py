@@ -0,0 +1,168 @@
+import json
+import os
+import threading
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+from sentinel_cache import file_lock
+from sentinel_http import SENTINEL_HUB_BASE_URL
+from sentinel_scheduler import get_scheduler
+from TOKEN import post_with_token
+
+
+CATALOG_URL = f"{SENTINEL_HUB_BASE_URL}/api/v1/catalog/1.0.0/search"
+COLLECTION = "sentinel-2-l2a"
+CATALOG_PAGE_SIZE = 100
+# Scenes can still be ingested a day or two after acquisition, so recent days
+# are looked up again instead of being trusted as "no acquisition".
+INGESTION_LAG_DAYS = 2
+
+
+def bbox_key(bbox):
+    return ",".join(f"{float(value):.5f}" for value in bbox)
+
+
+def search_acquisitions(bbox, start, end):
+    """Return ``{YYYY-MM-DD: cloud_cover}`` for Sentinel-2 scenes intersecting bbox."""
+    body = {
+        "bbox": list(bbox),
+        "datetime": f"{start}T00:00:00Z/{end}T23:59:59Z",
+        "collections": [COLLECTION],
+        "limit": CATALOG_PAGE_SIZE,
+        "fields": {"include": ["properties.datetime", "properties.eo:cloud_cover"]},
+    }
+    acquisitions = {}
+    while True:
+        # Catalog searches are not billed in processing units but count
+        # towards the request rate.
+        get_scheduler().acquire(0)
+        response = post_with_token(CATALOG_URL, json=body)
+        response.raise_for_status()
+        result = response.json()
+
+        for feature in result.get("features", []):
+            properties = feature.get("properties", {})
+            acquired = str(properties.get("datetime", ""))[:10]
+            if not acquired:
+                continue
+            cloud = float(properties.get("eo:cloud_cover", 100.0))
+            # A bbox can span several tiles; the render uses the clearest one.
+            acquisitions[acquired] = min(cloud, acquisitions.get(acquired, cloud))
+
+        next_token = result.get("context", {}).get("next")
+        if next_token is None:
+            return acquisitions
+        body["next"] = next_token
+
+
+def _merge_windows(windows):
+    merged = []
+    for start, end in sorted(windows):
+        if merged and start <= _next_day(merged[-1][1]):
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def _next_day(date_str):
+    return (datetime.strptime(date_str, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+
+
+class AcquisitionIndex:
+    """Local, persistent index of Sentinel-2 acquisition dates per bbox.
+
+    ``search`` defaults to the Sentinel Hub Catalog API and can be replaced
+    with any callable of the same signature, e.g. a local stand-in. Searches
+    run without holding the index lock; results are merged into the file
+    under a cross-process lock, so processes sharing it do not drop each
+    other's windows.
+    """
+
+    def __init__(self, path, search=search_acquisitions):
+        self.path = Path(path)
+        self.lock_path = self.path.with_suffix(".lock")
+        self.search = search
+        self._lock = threading.Lock()
+        self._loaded_mtime = self._mtime()
+        self._data = self._load()
+
+    def _mtime(self):
+        try:
+            return self.path.stat().st_mtime_ns
+        except OSError:
+            return None
+
+    def _load(self):
+        try:
+            return json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+
+    def _merge_from_disk(self):
+        """Adopt windows indexed by other processes since the file was last read."""
+        mtime = self._mtime()
+        if mtime == self._loaded_mtime:
+            return
+        self._loaded_mtime = mtime
+        for key, stored in self._load().items():
+            entry = self._data.setdefault(key, {"windows": [], "dates": {}})
+            entry["dates"] = {**stored["dates"], **entry["dates"]}
+            entry["windows"] = _merge_windows(entry["windows"] + stored["windows"])
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_text(json.dumps(self._data, sort_keys=True), encoding="utf-8")
+        os.replace(tmp_path, self.path)
+        self._loaded_mtime = self._mtime()
+
+    def _covers(self, entry, start, end):
+        return any(low <= start and end <= high for low, high in entry["windows"])
+
+    @staticmethod
+    def _window(entry, start, end):
+        return {
+            acquired: cloud
+            for acquired, cloud in entry["dates"].items()
+            if start <= acquired <= end
+        }
+
+    def acquisitions(self, bbox, start, end):
+        """Return ``{date: cloud_cover}`` for the inclusive ``start``..``end`` window.
+
+        The catalog is only queried when the window is not already indexed.
+        """
+        key = bbox_key(bbox)
+        with self._lock:
+            if not self._covers(self._data.get(key, {"windows": []}), start, end):
+                self._merge_from_disk()
+            entry = self._data.get(key)
+            if entry is not None and self._covers(entry, start, end):
+                return self._window(entry, start, end)
+
+        found = self.search(bbox, start, end)
+
+        settled = (date.today() - timedelta(days=INGESTION_LAG_DAYS)).isoformat()
+        covered_end = min(end, settled)
+        with self._lock, file_lock(self.lock_path):
+            self._merge_from_disk()
+            entry = self._data.setdefault(key, {"windows": [], "dates": {}})
+            entry["dates"].update(found)
+            if start <= covered_end:
+                entry["windows"] = _merge_windows(entry["windows"] + [[start, covered_end]])
+            self._save()
+            return self._window(entry, start, end)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_acquisition_index(path):
+    """Return the shared index for ``path`` so all lookups reuse one instance."""
+    path = Path(path)
+    with _indexes_lock:
+        if path not in _indexes:
+            _indexes[path] = AcquisitionIndex(path)
+        return _indexes[path]
@@ -0,0 +1,96 @@
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from sentinel_scheduler import INTERACTIVE
+
+
+# Override to use another deployment or a local stand-in (see benchmarks/).
+SENTINEL_HUB_BASE_URL = os.getenv(
+    "SENTINEL_HUB_BASE_URL", "https://services.sentinel-hub.com"
+).rstrip("/")
+CONNECT_TIMEOUT_SECONDS = 5
+READ_TIMEOUT_SECONDS = 30
+REQUEST_TIMEOUT = (CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS)
+
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 16
+
+MAX_RETRIES = 4
+BACKOFF_FACTOR = 0.5
+BACKOFF_JITTER = 0.5
+BACKOFF_MAX_SECONDS = 20
+# Retry-After is honoured, but a worker thread never sleeps longer than this.
+MAX_RETRY_AFTER_SECONDS = 60
+# Interactive requests block a Streamlit script run, so they give up after a
+# few seconds of retrying and report the throttle instead.
+INTERACTIVE_MAX_RETRIES = 2
+INTERACTIVE_BACKOFF_MAX_SECONDS = 2
+INTERACTIVE_MAX_RETRY_AFTER_SECONDS = 5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Process, catalog and token requests are POSTs but read-only, so they are
+# safe to repeat.
+RETRY_METHODS = frozenset({"GET", "HEAD", "POST"})
+THROTTLE_STATUSES = (429, 503)
+
+
+class _Retry(Retry):
+    max_retry_after = MAX_RETRY_AFTER_SECONDS
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, self.max_retry_after)
+
+
+class _InteractiveRetry(_Retry):
+    max_retry_after = INTERACTIVE_MAX_RETRY_AFTER_SECONDS
+
+
+def retry_policy(priority=INTERACTIVE):
+    """Return the urllib3 retry policy for requests made at ``priority``."""
+    interactive = priority == INTERACTIVE
+    retry_class = _InteractiveRetry if interactive else _Retry
+    return retry_class(
+        total=INTERACTIVE_MAX_RETRIES if interactive else MAX_RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        backoff_jitter=BACKOFF_JITTER,
+        backoff_max=INTERACTIVE_BACKOFF_MAX_SECONDS if interactive else BACKOFF_MAX_SECONDS,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=RETRY_METHODS,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+
+
+def configure_session(session, priority=INTERACTIVE):
+    """Mount the pooled, retrying adapter on ``session`` and return it."""
+    adapter = HTTPAdapter(
+        pool_connections=POOL_CONNECTIONS,
+        pool_maxsize=POOL_MAXSIZE,
+        max_retries=retry_policy(priority),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(priority=INTERACTIVE):
+    """Return the process-wide keep-alive session used for Sentinel Hub calls.
+
+    Interactive requests share one session with a short retry budget; all
+    background priorities share another.
+    """
+    interactive = priority == INTERACTIVE
+    with _sessions_lock:
+        if interactive not in _sessions:
+            _sessions[interactive] = configure_session(requests.Session(), priority)
+        return _sessions[interactive]
@@ -1,30 +1,196 @@
+import json
+import tarfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 from io import BytesIO
 from pathlib import Path
 
+import numpy as np
 import requests
 from PIL import Image
 
-from TOKEN import make_token
+from image_quality import quality_rejection, score_image
+from metrics import COUNT_BUCKETS, increment, observe, span
+from sentinel_cache import (
+    RECENT_TTL_SECONDS,
+    get_image_cache,
+    get_negative_cache,
+    get_single_flight,
+    payload_key,
+)
+from sentinel_catalog import INGESTION_LAG_DAYS, get_acquisition_index
+from sentinel_http import SENTINEL_HUB_BASE_URL, THROTTLE_STATUSES
+from sentinel_scheduler import (
+    BULK,
+    INTERACTIVE,
+    BudgetExceeded,
+    estimate_processing_units,
+    get_scheduler,
+)
+from TOKEN import make_token, post_with_token
 
 
-PROCESS_URL = "https://services.sentinel-hub.com/api/v1/process"
+PROCESS_URL = f"{SENTINEL_HUB_BASE_URL}/api/v1/process"
 BIRCHGLETSCHER_BBOX = [7.78, 46.38, 7.88, 46.45]
 IMAGE_SIZE = 1024
-REQUEST_TIMEOUT_SECONDS = 30
+# Renders keep the ground resolution of the Birchgletscher view, so smaller
+# areas (e.g. shared village tiles) are requested as smaller images.
+PIXELS_PER_DEGREE = IMAGE_SIZE / (BIRCHGLETSCHER_BBOX[2] - BIRCHGLETSCHER_BBOX[0])
+MIN_IMAGE_SIZE = 64
+MAX_CLOUD_COVERAGE = 20
+MAX_PARALLEL_REQUESTS = 4
+# Lookups needing this many renders fetch them in one time-series request,
+# split into chunks of at most TIME_SERIES_MAX_FRAMES dates.
+TIME_SERIES_MIN_DATES = 3
+TIME_SERIES_MAX_FRAMES = 10
+# Composites mask clouds per pixel, so cloudier scenes can still contribute.
+COMPOSITE_MAX_CLOUD_COVERAGE = 80
+COMPOSITE_NO_SCENE = 255
+TRUE_COLOR_EVALSCRIPT = """
+//VERSION=3
+function setup() {
+    return {input: ["B02", "B03", "B04"], output: {bands: 3}};
+}
+function evaluatePixel(sample) {
+    return [2.5 * sample.B04, 2.5 * sample.B03, 2.5 * sample.B02];
+}
+"""
+# Selects each requested acquisition date from the ORBIT mosaic and returns it
+# as its own response; __FRAMES__ is replaced with a JSON list of dates.
+TIME_SERIES_EVALSCRIPT = """
+//VERSION=3
+var FRAMES = __FRAMES__;
+function frameId(day) {
+    return "t" + day.replace(/-/g, "");
+}
+function setup() {
+    return {
+        input: ["B02", "B03", "B04", "dataMask"],
+        output: FRAMES.map(function (day) { return {id: frameId(day), bands: 3}; }),
+        mosaicking: "ORBIT"
+    };
+}
+function preProcessScenes(collections) {
+    collections.scenes.orbits = collections.scenes.orbits.filter(function (orbit) {
+        return FRAMES.indexOf(orbit.dateFrom.substring(0, 10)) !== -1;
+    });
+    return collections;
+}
+function evaluatePixel(samples, scenes) {
+    var result = {};
+    FRAMES.forEach(function (day) { result[frameId(day)] = [0, 0, 0]; });
+    for (var i = 0; i < samples.length; i++) {
+        var id = frameId(scenes.orbits[i].dateFrom.substring(0, 10));
+        if (samples[i].dataMask === 1 && id in result) {
+            result[id] = [2.5 * samples[i].B04, 2.5 * samples[i].B03, 2.5 * samples[i].B02];
+        }
+    }
+    return result;
+}
+"""
+# Per-pixel least-cloud composite over every tile in the time range. Pixels
+# flagged as cloud, cloud shadow or saturated by the scene classification
+# (SCL) are skipped when a clear sample exists. The "scene" response holds
+# the index of the tile used for each pixel; userdata maps indices to dates.
+COMPOSITE_EVALSCRIPT = """
+//VERSION=3
+var UNUSABLE_SCL = [1, 3, 8, 9, 10];
+function setup() {
+    return {
+        input: ["B02", "B03", "B04", "SCL", "dataMask"],
+        output: [
+            {id: "default", bands: 3},
+            {id: "scene", bands: 1, sampleType: "UINT8"}
+        ],
+        mosaicking: "TILE"
+    };
+}
+function updateOutputMetadata(scenes, inputMetadata, outputMetadata) {
+    outputMetadata.userData = {
+        dates: scenes.tiles.map(function (tile) { return tile.date.substring(0, 10); })
+    };
+}
+function evaluatePixel(samples, scenes) {
+    var best = -1;
+    var fallback = -1;
+    for (var i = 0; i < samples.length; i++) {
+        if (samples[i].dataMask !== 1) {
+            continue;
+        }
+        var cloud = scenes.tiles[i].cloudCoverage;
+        if (fallback === -1 || cloud < scenes.tiles[fallback].cloudCoverage) {
+            fallback = i;
+        }
+        var clear = UNUSABLE_SCL.indexOf(samples[i].SCL) === -1;
+        if (clear && (best === -1 || cloud < scenes.tiles[best].cloudCoverage)) {
+            best = i;
+        }
+    }
+    var pick = best !== -1 ? best : fallback;
+    if (pick === -1) {
+        return {default: [0, 0, 0], scene: [255]};
+    }
+    var sample = samples[pick];
+    return {
+        default: [2.5 * sample.B04, 2.5 * sample.B03, 2.5 * sample.B02],
+        scene: [Math.min(pick, 254)]
+    };
+}
+"""
+# Raw Sentinel-2 L2A bands for the analysis product, stored as digital numbers
+# (reflectance * 10000); SCL is the scene classification.
+ANALYSIS_BANDS = ("B02", "B03", "B04", "B05", "B06", "B07", "B08", "B8A", "B11", "B12", "SCL")
+TRUE_COLOR_BANDS = ("B04", "B03", "B02")
+REFLECTANCE_SCALE = 1 / 10000
+# Gain of the stretched true-colour render (see TRUE_COLOR_EVALSCRIPT).
+TRUE_COLOR_GAIN = 2.5
+# Normalized differences (first - second) / (first + second).
+SPECTRAL_INDICES = {
+    "NDVI": ("B08", "B04"),
+    "NDSI": ("B03", "B11"),
+    "NDMI": ("B8A", "B11"),
+}
+# One 16-bit response per band; __BANDS__ is replaced with a JSON list of bands.
+ANALYSIS_EVALSCRIPT = """
+//VERSION=3
+var BANDS = __BANDS__;
+function setup() {
+    return {
+        input: [{bands: BANDS, units: "DN"}],
+        output: BANDS.map(function (band) {
+            return {id: band, bands: 1, sampleType: "UINT16"};
+        })
+    };
+}
+function evaluatePixel(sample) {
+    var result = {};
+    BANDS.forEach(function (band) { result[band] = [sample[band]]; });
+    return result;
+}
+"""
 
 
 def is_image_dark(image_bytes, threshold=10):
     """Return True when Sentinel Hub returns a mostly black image."""
     try:
-        img = Image.open(BytesIO(image_bytes))
-        grayscale = img.convert("L")
-        avg = sum(grayscale.getdata()) / (grayscale.width * grayscale.height)
-        return avg < threshold
+        with span("image_decode"):
+            return score_image(image_bytes)["mean_brightness"] < threshold
     except Exception:
         return True
 
 
+def image_size(bbox):
+    """Return the square output size in pixels used for renders of ``bbox``."""
+    width = abs(float(bbox[2]) - float(bbox[0]))
+    return max(MIN_IMAGE_SIZE, min(IMAGE_SIZE, round(width * PIXELS_PER_DEGREE)))
+
+
+def _process_units(bbox, input_bands=3, samples=1):
+    size = image_size(bbox)
+    return estimate_processing_units(size, size, input_bands=input_bands, samples=samples)
+
+
 def _candidate_dates(date_obj, max_delta_days):
     seen = set()
     for delta in range(max_delta_days + 1):
@@ -37,6 +203,23 @@ def _candidate_dates(date_obj, max_delta_days):
                 yield date_str
 
 
+def _acquisition_window(date_objs, max_delta_days):
+    start = min(date_objs) - timedelta(days=max_delta_days)
+    end = max(date_objs) + timedelta(days=max_delta_days)
+    return start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")
+
+
+def _known_acquisitions(save_path, bbox, date_objs, max_delta_days):
+    """Return catalog acquisitions for the lookup window, or None if unavailable."""
+    start, end = _acquisition_window(date_objs, max_delta_days)
+    try:
+        index = get_acquisition_index(save_path / "acquisitions.json")
+        return index.acquisitions(bbox, start, end)
+    except Exception:
+        # Fall back to blind probing rather than failing the lookup.
+        return None
+
+
 def _payload_for_date(date_str, bbox):
     return {
         "input": {
@@ -49,14 +232,14 @@ def _payload_for_date(date_str, bbox):
                             "from": f"{date_str}T00:00:00Z",
                             "to": f"{date_str}T23:59:59Z",
                         },
-                        "maxCloudCoverage": 20,
+                        "maxCloudCoverage": MAX_CLOUD_COVERAGE,
                     },
                 }
             ],
         },
         "output": {
-            "width": IMAGE_SIZE,
-            "height": IMAGE_SIZE,
+            "width": image_size(bbox),
+            "height": image_size(bbox),
             "responses": [
                 {
                     "identifier": "default",
@@ -64,15 +247,391 @@ def _payload_for_date(date_str, bbox):
                 }
             ],
         },
-        "evalscript": """
-//VERSION=3
-function setup() {
-    return {input: ["B02", "B03", "B04"], output: {bands: 3}};
-}
-function evaluatePixel(sample) {
-    return [2.5 * sample.B04, 2.5 * sample.B03, 2.5 * sample.B02];
-}
-""",
+        "evalscript": TRUE_COLOR_EVALSCRIPT,
+    }
+
+
+class _Throttled(Exception):
+    """Sentinel Hub kept throttling after retries; stop probing further dates."""
+
+
+class _SharedProbes:
+    """Run each candidate date at most once across a batch of lookups."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._futures = {}
+
+    def run(self, check_date, probe):
+        with self._lock:
+            future = self._futures.get(check_date)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._futures[check_date] = future
+
+        if owner:
+            try:
+                future.set_result(probe())
+            except BaseException as exc:
+                future.set_exception(exc)
+        return future.result()
+
+
+def _http_failure_reason(status_code):
+    """Classify an HTTP failure for the negative cache; None means do not cache."""
+    if status_code in (401, 403) or status_code in THROTTLE_STATUSES:
+        # Credential, quota and overload problems say nothing about the date itself.
+        return None
+    if status_code in (400, 404, 422):
+        return "rejected"
+    return "http_error"
+
+
+def _image_info(check_date, entry, cached):
+    return {
+        "date": check_date,
+        "file_path": entry["path"],
+        "cached": cached,
+        "quality": entry.get("quality"),
+    }
+
+
+def _throttled(status_code):
+    return _Throttled(
+        f"Sentinel Hub is throttling requests (HTTP {status_code}). "
+        "Please try again shortly."
+    )
+
+
+def _record_failure(save_path, bbox, check_date, reason, detail, quality=None):
+    if reason:
+        get_negative_cache(save_path / "negative_cache.json").record(
+            bbox, check_date, TRUE_COLOR_EVALSCRIPT, reason, detail, quality=quality
+        )
+    return None, detail
+
+
+def _known_result(check_date, save_path, bbox, quality_thresholds=None, touch=True):
+    """Return ``(info, error)`` from the local caches, or None if a render is needed."""
+    cached = get_image_cache(save_path).get(_payload_for_date(check_date, bbox), touch=touch)
+    if cached:
+        rejection = cached.get("quality") and quality_rejection(
+            cached["quality"], quality_thresholds
+        )
+        if not rejection:
+            return _image_info(check_date, cached, cached=True), None
+        return None, f"Image for {check_date} was rejected: {rejection}."
+
+    negative_cache = get_negative_cache(save_path / "negative_cache.json")
+    known_failure = negative_cache.get(bbox, check_date, TRUE_COLOR_EVALSCRIPT)
+    if known_failure:
+        # A quality rejection only stands while the thresholds still reject it.
+        quality = known_failure.get("quality")
+        if not quality or quality_rejection(quality, quality_thresholds):
+            return None, known_failure["detail"]
+    return None
+
+
+def _accept_render(check_date, content, save_path, bbox, quality_thresholds=None):
+    """Score a true-colour render and cache it, or record why it was rejected."""
+    try:
+        with span("image_decode"):
+            quality = score_image(content)
+    except Exception:
+        return _record_failure(
+            save_path, bbox, check_date, "dark", f"Image for {check_date} could not be decoded."
+        )
+
+    if quality["nodata_fraction"] >= 1.0:
+        return _record_failure(
+            save_path, bbox, check_date, "no_acquisition", f"No Sentinel-2 data for {check_date}."
+        )
+
+    rejection = quality_rejection(quality, quality_thresholds)
+    if rejection:
+        return _record_failure(
+            save_path,
+            bbox,
+            check_date,
+            "low_quality",
+            f"Image for {check_date} was rejected: {rejection}.",
+            quality,
+        )
+
+    entry = get_image_cache(save_path).put(
+        _payload_for_date(check_date, bbox), content, date=check_date, bbox=bbox, quality=quality
+    )
+    return _image_info(check_date, entry, cached=False), None
+
+
+def _single_flight(save_path):
+    return get_single_flight(save_path / "locks")
+
+
+def _flight_key(payload, quality_thresholds=None):
+    """Single-flight key: the cache entry, plus the thresholds that judge it."""
+    key = payload_key(payload)
+    if quality_thresholds:
+        key += "-" + payload_key(quality_thresholds)
+    return key
+
+
+def _probe_candidate(
+    check_date, save_path, bbox, quality_thresholds=None, priority=INTERACTIVE
+):
+    """Return ``(info, error)`` for one candidate date; exactly one is set.
+
+    Concurrent probes of the same date, from any thread or process sharing
+    ``save_path``, send one render request between them.
+    """
+    known = _known_result(check_date, save_path, bbox, quality_thresholds)
+    if known:
+        return known
+
+    def render():
+        # Another thread or process may have rendered the date while this one waited.
+        known = _known_result(check_date, save_path, bbox, quality_thresholds)
+        if known:
+            return known
+        return _render_candidate(check_date, save_path, bbox, quality_thresholds, priority)
+
+    return _single_flight(save_path).run(
+        _flight_key(_payload_for_date(check_date, bbox), quality_thresholds), render
+    )
+
+
+def _render_candidate(check_date, save_path, bbox, quality_thresholds, priority):
+    units = _process_units(bbox)
+    scheduler = get_scheduler()
+    with span("scheduler_wait"):
+        scheduler.acquire(units, priority)
+    increment("renders_requested", kind="single")
+    try:
+        response = post_with_token(
+            PROCESS_URL, json=_payload_for_date(check_date, bbox), priority=priority
+        )
+    except requests.RequestException as exc:
+        scheduler.refund(units)
+        return _record_failure(
+            save_path,
+            bbox,
+            check_date,
+            "request_failed",
+            f"Request failed for {check_date}: {exc}",
+        )
+
+    if response.status_code != 200:
+        # Only successful renders are billed.
+        scheduler.refund(units)
+        if response.status_code in THROTTLE_STATUSES:
+            # Moving on to the next date would only spend more of the same quota.
+            raise _throttled(response.status_code)
+        return _record_failure(
+            save_path,
+            bbox,
+            check_date,
+            _http_failure_reason(response.status_code),
+            f"Sentinel Hub returned HTTP {response.status_code} for {check_date}.",
+        )
+
+    return _accept_render(check_date, response.content, save_path, bbox, quality_thresholds)
+
+
+def _frame_id(date_str):
+    return "t" + date_str.replace("-", "")
+
+
+def _time_series_payload(date_strs, bbox):
+    """One ORBIT-mosaicked request returning a true-colour PNG per acquisition date."""
+    evalscript = TIME_SERIES_EVALSCRIPT.replace("__FRAMES__", json.dumps(date_strs))
+    return {
+        "input": {
+            "bounds": {"bbox": bbox},
+            "data": [
+                {
+                    "type": "sentinel-2-l2a",
+                    "dataFilter": {
+                        "timeRange": {
+                            "from": f"{min(date_strs)}T00:00:00Z",
+                            "to": f"{max(date_strs)}T23:59:59Z",
+                        },
+                        "maxCloudCoverage": MAX_CLOUD_COVERAGE,
+                    },
+                }
+            ],
+        },
+        "output": {
+            "width": image_size(bbox),
+            "height": image_size(bbox),
+            "responses": [
+                {"identifier": _frame_id(date_str), "format": {"type": "image/png"}}
+                for date_str in date_strs
+            ],
+        },
+        "evalscript": evalscript,
+    }
+
+
+def _read_tar(content):
+    """Return ``{member stem: bytes}`` for a multi-response process-API reply."""
+    with tarfile.open(fileobj=BytesIO(content)) as archive:
+        return {
+            Path(member.name).stem: archive.extractfile(member).read()
+            for member in archive.getmembers()
+            if member.isfile()
+        }
+
+
+def _fetch_time_series(date_strs, save_path, bbox, quality_thresholds=None, priority=BULK):
+    """Render known acquisition dates with one request per chunk and cache every frame.
+
+    Frames land in the same cache entries as single-date lookups, so those
+    then become cache hits. Returns the number of frames received; dates left
+    unrendered after a failure fall back to per-date lookups.
+    """
+    pending = [
+        date_str
+        for date_str in sorted(set(date_strs))
+        if _known_result(date_str, save_path, bbox, quality_thresholds, touch=False) is None
+    ]
+    if len(pending) < TIME_SERIES_MIN_DATES:
+        return 0
+
+    received = 0
+    for offset in range(0, len(pending), TIME_SERIES_MAX_FRAMES):
+        chunk = pending[offset : offset + TIME_SERIES_MAX_FRAMES]
+        frames = _single_flight(save_path).run(
+            _flight_key(_time_series_payload(chunk, bbox), quality_thresholds),
+            lambda chunk=chunk: _render_time_series(
+                chunk, save_path, bbox, quality_thresholds, priority
+            ),
+        )
+        if frames is None:
+            return received
+        received += frames
+    return received
+
+
+def _render_time_series(chunk, save_path, bbox, quality_thresholds, priority):
+    """Render one chunk; returns the frames received, or None when the request failed."""
+    # Dates another thread or process rendered while this one waited are skipped.
+    chunk = [
+        date_str
+        for date_str in chunk
+        if _known_result(date_str, save_path, bbox, quality_thresholds, touch=False) is None
+    ]
+    if not chunk:
+        return 0
+
+    scheduler = get_scheduler()
+    units = _process_units(bbox, samples=len(chunk))
+    with span("scheduler_wait"):
+        scheduler.acquire(units, priority)
+    increment("renders_requested", len(chunk), kind="time_series")
+    try:
+        response = post_with_token(
+            PROCESS_URL,
+            json=_time_series_payload(chunk, bbox),
+            headers={"Accept": "application/x-tar"},
+            priority=priority,
+        )
+    except requests.RequestException:
+        scheduler.refund(units)
+        return None
+
+    if response.status_code != 200:
+        scheduler.refund(units)
+        if response.status_code in THROTTLE_STATUSES:
+            raise _throttled(response.status_code)
+        return None
+
+    try:
+        frames = _read_tar(response.content)
+    except tarfile.TarError:
+        return None
+
+    received = 0
+    for date_str in chunk:
+        content = frames.get(_frame_id(date_str))
+        if content is not None:
+            _accept_render(date_str, content, save_path, bbox, quality_thresholds)
+            received += 1
+    return received
+
+
+def _lookup(
+    date,
+    save_folder,
+    bbox,
+    max_delta_days,
+    quality_thresholds=None,
+    priority=INTERACTIVE,
+    probes=None,
+):
+    save_path = Path(save_folder)
+    save_path.mkdir(parents=True, exist_ok=True)
+    bbox = bbox or BIRCHGLETSCHER_BBOX
+
+    try:
+        date_obj = datetime.strptime(str(date), "%Y-%m-%d")
+    except ValueError:
+        return {
+            "date": str(date),
+            "file_path": None,
+            "error": "Date must use YYYY-MM-DD format.",
+        }
+
+    try:
+        make_token()
+    except Exception as exc:
+        return {"date": str(date), "file_path": None, "error": str(exc)}
+
+    candidates = list(_candidate_dates(date_obj, max_delta_days))
+    known = _known_acquisitions(save_path, bbox, [date_obj], max_delta_days)
+    if known is not None:
+        candidates = [
+            check_date
+            for check_date in candidates
+            if known.get(check_date, float("inf")) <= MAX_CLOUD_COVERAGE
+        ]
+        if not candidates:
+            return {
+                "date": str(date),
+                "file_path": None,
+                "error": (
+                    f"No Sentinel-2 acquisition with at most {MAX_CLOUD_COVERAGE}% "
+                    f"cloud cover within +/- {max_delta_days} days."
+                ),
+            }
+
+    last_error = None
+    probed = 0
+    try:
+        # Candidates are rendered one at a time, nearest first: the first
+        # acceptable one ends the lookup, so most lookups bill a single render.
+        # Multi-date time-series renders are only used for batches.
+        for check_date in candidates:
+            def probe(check_date=check_date):
+                return _probe_candidate(
+                    check_date, save_path, bbox, quality_thresholds, priority
+                )
+
+            probed += 1
+            info, error = probes.run(check_date, probe) if probes else probe()
+            if info:
+                return dict(info)
+            last_error = error
+    except (_Throttled, BudgetExceeded) as exc:
+        return {"date": str(date), "file_path": None, "error": str(exc), "retryable": True}
+    finally:
+        observe("lookup_candidates_probed", probed, COUNT_BUCKETS)
+
+    return {
+        "date": str(date),
+        "file_path": None,
+        "error": last_error
+        or f"No suitable image found within +/- {max_delta_days} days.",
     }
 
 
@@ -81,7 +640,96 @@ def download_sentinel_image(
     save_folder="cache",
     bbox=None,
     max_delta_days=5,
+    quality_thresholds=None,
+    priority=INTERACTIVE,
 ):
+    """Find the closest acceptable image to ``date`` within +/- ``max_delta_days``.
+
+    ``quality_thresholds`` overrides entries of
+    ``image_quality.DEFAULT_QUALITY_THRESHOLDS``; ``priority`` is a
+    ``sentinel_scheduler`` priority.
+    """
+    with span("lookup"):
+        return _lookup(date, save_folder, bbox, max_delta_days, quality_thresholds, priority)
+
+
+def _composite_payload(start, end, bbox):
+    return {
+        "input": {
+            "bounds": {"bbox": bbox},
+            "data": [
+                {
+                    "type": "sentinel-2-l2a",
+                    "dataFilter": {
+                        "timeRange": {
+                            "from": f"{start}T00:00:00Z",
+                            "to": f"{end}T23:59:59Z",
+                        },
+                        "maxCloudCoverage": COMPOSITE_MAX_CLOUD_COVERAGE,
+                        "mosaickingOrder": "leastCC",
+                    },
+                }
+            ],
+        },
+        "output": {
+            "width": image_size(bbox),
+            "height": image_size(bbox),
+            "responses": [
+                {"identifier": "default", "format": {"type": "image/png"}},
+                {"identifier": "scene", "format": {"type": "image/png"}},
+                {"identifier": "userdata", "format": {"type": "application/json"}},
+            ],
+        },
+        "evalscript": COMPOSITE_EVALSCRIPT,
+    }
+
+
+def _scene_contributions(scene_png, scene_dates):
+    """Return ``{date: fraction of pixels}`` from the composite's scene-index band."""
+    scene_index = np.asarray(Image.open(BytesIO(scene_png)).convert("L"))
+    counts = np.bincount(scene_index.ravel(), minlength=COMPOSITE_NO_SCENE + 1)
+    counts[COMPOSITE_NO_SCENE] = 0
+    contributions = {}
+    for index in np.flatnonzero(counts):
+        if index < len(scene_dates):
+            acquired = scene_dates[index]
+            contributions[acquired] = contributions.get(acquired, 0.0) + counts[index]
+    return {
+        acquired: round(float(count) / scene_index.size, 4)
+        for acquired, count in sorted(contributions.items())
+    }
+
+
+def _composite_result(date, entry, cached):
+    return {
+        **_image_info(str(date), entry, cached=cached),
+        "contributing_dates": entry["contributing_dates"],
+        "contributions": entry["contributions"],
+    }
+
+
+def _cached_composite(image_cache, payload, end):
+    """Return the cached composite for ``payload`` unless new scenes may have arrived since."""
+    cached = image_cache.get(payload)
+    settled = (datetime.now() - timedelta(days=INGESTION_LAG_DAYS)).strftime("%Y-%m-%d")
+    if cached and end >= settled:
+        if image_cache.clock() - cached["created_at"] > RECENT_TTL_SECONDS:
+            return None
+    return cached
+
+
+def download_sentinel_composite(
+    date,
+    save_folder="cache",
+    bbox=None,
+    max_delta_days=5,
+    priority=INTERACTIVE,
+):
+    """Render a least-cloud, cloud-masked composite of +/- ``max_delta_days`` in one request.
+
+    The result records ``contributing_dates`` and the share of pixels each
+    acquisition supplied.
+    """
     save_path = Path(save_folder)
     save_path.mkdir(parents=True, exist_ok=True)
     bbox = bbox or BIRCHGLETSCHER_BBOX
@@ -96,46 +744,348 @@ def download_sentinel_image(
         }
 
     try:
-        token = make_token()
+        make_token()
     except Exception as exc:
         return {"date": str(date), "file_path": None, "error": str(exc)}
 
-    last_error = None
-    for check_date in _candidate_dates(date_obj, max_delta_days):
-        file_path = save_path / f"sentinel_image_{check_date}.png"
-        if file_path.exists():
-            return {
-                "date": check_date,
-                "file_path": str(file_path),
-                "cached": True,
-            }
+    start, end = _acquisition_window([date_obj], max_delta_days)
+    payload = _composite_payload(start, end, bbox)
+    cached = _cached_composite(get_image_cache(save_path), payload, end)
+    if cached:
+        return _composite_result(date, cached, cached=True)
 
-        try:
-            response = requests.post(
-                PROCESS_URL,
-                headers={"Authorization": f"Bearer {token}"},
-                json=_payload_for_date(check_date, bbox),
-                timeout=REQUEST_TIMEOUT_SECONDS,
-            )
-        except requests.RequestException as exc:
-            last_error = f"Request failed for {check_date}: {exc}"
-            continue
+    result = _single_flight(save_path).run(
+        payload_key(payload),
+        lambda: _render_composite(
+            date, date_obj, payload, save_path, bbox, end, max_delta_days, priority
+        ),
+    )
+    # Concurrent callers share the owner's result.
+    return dict(result)
 
-        if response.status_code != 200:
-            last_error = (
-                f"Sentinel Hub returned HTTP {response.status_code} for {check_date}."
-            )
-            continue
 
-        if is_image_dark(response.content):
-            last_error = f"Image for {check_date} was empty or mostly dark."
-            continue
+def _render_composite(date, date_obj, payload, save_path, bbox, end, max_delta_days, priority):
+    def failure(error):
+        return {"date": str(date), "file_path": None, "error": error}
+
+    image_cache = get_image_cache(save_path)
+    # Another thread or process may have rendered the composite while this one waited.
+    cached = _cached_composite(image_cache, payload, end)
+    if cached:
+        return _composite_result(date, cached, cached=True)
+
+    known = _known_acquisitions(save_path, bbox, [date_obj], max_delta_days)
+    if known is not None:
+        usable = [day for day, cloud in known.items() if cloud <= COMPOSITE_MAX_CLOUD_COVERAGE]
+        if not usable:
+            return failure(f"No Sentinel-2 acquisition within +/- {max_delta_days} days.")
+        samples = len(usable)
+    else:
+        samples = max_delta_days + 1
+
+    units = _process_units(bbox, input_bands=4, samples=samples)
+    scheduler = get_scheduler()
+    try:
+        with span("scheduler_wait"):
+            scheduler.acquire(units, priority)
+    except BudgetExceeded as exc:
+        return {**failure(str(exc)), "retryable": True}
+    increment("renders_requested", kind="composite")
+
+    try:
+        response = post_with_token(
+            PROCESS_URL,
+            json=payload,
+            headers={"Accept": "application/x-tar"},
+            priority=priority,
+        )
+    except requests.RequestException as exc:
+        scheduler.refund(units)
+        return failure(f"Composite request failed: {exc}")
+
+    if response.status_code != 200:
+        scheduler.refund(units)
+        if response.status_code in THROTTLE_STATUSES:
+            return failure(str(_throttled(response.status_code)))
+        return failure(f"Sentinel Hub returned HTTP {response.status_code} for the composite.")
+
+    try:
+        parts = _read_tar(response.content)
+        image = parts["default"]
+        scene_dates = json.loads(parts["userdata"]).get("dates", [])
+        contributions = _scene_contributions(parts["scene"], scene_dates)
+        quality = score_image(image)
+    except Exception as exc:
+        return failure(f"Could not read the composite response: {exc}")
 
-        file_path.write_bytes(response.content)
-        return {"date": check_date, "file_path": str(file_path), "cached": False}
+    if not contributions:
+        return failure(f"No Sentinel-2 data within +/- {max_delta_days} days.")
 
+    entry = image_cache.put(
+        payload,
+        image,
+        date=str(date),
+        bbox=bbox,
+        quality=quality,
+        contributing_dates=list(contributions),
+        contributions=contributions,
+    )
+    return _composite_result(date, entry, cached=False)
+
+
+def _analysis_payload(date_str, bbox, bands):
+    payload = _payload_for_date(date_str, bbox)
+    payload["output"]["responses"] = [
+        {"identifier": band, "format": {"type": "image/png"}} for band in bands
+    ]
+    payload["evalscript"] = ANALYSIS_EVALSCRIPT.replace("__BANDS__", json.dumps(list(bands)))
+    return payload
+
+
+def _analysis_info(date_str, entry, cached):
     return {
-        "date": str(date),
-        "file_path": None,
-        "error": last_error or "No suitable image found within +/- 5 days.",
+        **_image_info(date_str, entry, cached=cached),
+        "bands": entry["bands"],
+        "shape": entry["shape"],
+        "reflectance_scale": entry["reflectance_scale"],
+    }
+
+
+def true_color_png(stack, bands):
+    """Encode the stretched true-colour render of ``TRUE_COLOR_EVALSCRIPT`` from band data."""
+    rgb = np.stack([stack[list(bands).index(band)] for band in TRUE_COLOR_BANDS], axis=-1)
+    scaled = rgb.astype(np.float32) * (TRUE_COLOR_GAIN * REFLECTANCE_SCALE * 255)
+    buffer = BytesIO()
+    Image.fromarray(np.clip(np.rint(scaled), 0, 255).astype(np.uint8)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def download_analysis_bands(
+    date,
+    save_folder="cache",
+    bbox=None,
+    bands=ANALYSIS_BANDS,
+    quality_thresholds=None,
+    priority=INTERACTIVE,
+):
+    """Fetch raw L2A ``bands`` of one acquisition date as a memory-mappable stack.
+
+    The stack is cached as a ``(band, row, column)`` uint16 ``.npy`` file;
+    open it with :func:`load_analysis_bands`. The true-colour render of the
+    date is derived from the same data and cached, so a later
+    ``download_sentinel_image`` for the date needs no request.
+    """
+    save_path = Path(save_folder)
+    save_path.mkdir(parents=True, exist_ok=True)
+    bbox = bbox or BIRCHGLETSCHER_BBOX
+    date_str = str(date)
+
+    def failure(error):
+        return {"date": date_str, "file_path": None, "error": error}
+
+    try:
+        datetime.strptime(date_str, "%Y-%m-%d")
+    except ValueError:
+        return failure("Date must use YYYY-MM-DD format.")
+
+    unknown = sorted(set(bands) - set(ANALYSIS_BANDS))
+    if unknown:
+        return failure(f"Unsupported band(s): {', '.join(unknown)}.")
+    # The true-colour bands are always fetched so the visual render can be derived.
+    bands = tuple(dict.fromkeys([*bands, *TRUE_COLOR_BANDS]))
+
+    try:
+        make_token()
+    except Exception as exc:
+        return failure(str(exc))
+
+    payload = _analysis_payload(date_str, bbox, bands)
+    cached = get_image_cache(save_path).get(payload)
+    if cached:
+        return _analysis_info(date_str, cached, cached=True)
+
+    result = _single_flight(save_path).run(
+        payload_key(payload),
+        lambda: _render_analysis(
+            date_str, payload, save_path, bbox, bands, quality_thresholds, priority
+        ),
+    )
+    # Concurrent callers share the owner's result.
+    return dict(result)
+
+
+def _render_analysis(date_str, payload, save_path, bbox, bands, quality_thresholds, priority):
+    image_cache = get_image_cache(save_path)
+    negative_cache = get_negative_cache(save_path / "negative_cache.json")
+
+    def failure(reason, error):
+        if reason:
+            negative_cache.record(bbox, date_str, payload["evalscript"], reason, error)
+        return {"date": date_str, "file_path": None, "error": error}
+
+    # Another thread or process may have fetched the bands while this one waited.
+    cached = image_cache.get(payload)
+    if cached:
+        return _analysis_info(date_str, cached, cached=True)
+    known_failure = negative_cache.get(bbox, date_str, payload["evalscript"])
+    if known_failure:
+        return failure(None, known_failure["detail"])
+
+    units = _process_units(bbox, input_bands=len(bands))
+    scheduler = get_scheduler()
+    try:
+        with span("scheduler_wait"):
+            scheduler.acquire(units, priority)
+    except BudgetExceeded as exc:
+        return {**failure(None, str(exc)), "retryable": True}
+    increment("renders_requested", kind="analysis")
+    try:
+        response = post_with_token(
+            PROCESS_URL,
+            json=payload,
+            headers={"Accept": "application/x-tar"},
+            priority=priority,
+        )
+    except requests.RequestException as exc:
+        scheduler.refund(units)
+        return failure("request_failed", f"Request failed for {date_str}: {exc}")
+
+    if response.status_code != 200:
+        scheduler.refund(units)
+        if response.status_code in THROTTLE_STATUSES:
+            return {**failure(None, str(_throttled(response.status_code))), "retryable": True}
+        return failure(
+            _http_failure_reason(response.status_code),
+            f"Sentinel Hub returned HTTP {response.status_code} for {date_str}.",
+        )
+
+    try:
+        with span("image_decode"):
+            parts = _read_tar(response.content)
+            stack = np.stack(
+                [
+                    np.asarray(Image.open(BytesIO(parts[band])), dtype=np.uint16)
+                    for band in bands
+                ]
+            )
+    except Exception as exc:
+        return failure(None, f"Could not read the band data for {date_str}: {exc}")
+
+    if not stack.any():
+        return failure("no_acquisition", f"No Sentinel-2 data for {date_str}.")
+
+    visual, _error = _accept_render(
+        date_str, true_color_png(stack, bands), save_path, bbox, quality_thresholds
+    )
+    buffer = BytesIO()
+    np.save(buffer, stack)
+    entry = image_cache.put(
+        payload,
+        buffer.getvalue(),
+        date=date_str,
+        bbox=bbox,
+        suffix=".npy",
+        product="analysis",
+        bands=list(bands),
+        shape=list(stack.shape),
+        reflectance_scale=REFLECTANCE_SCALE,
+    )
+    return {
+        **_analysis_info(date_str, entry, cached=False),
+        "visual_path": visual["file_path"] if visual else None,
     }
+
+
+def load_analysis_bands(info):
+    """Memory-map the stack of a ``download_analysis_bands`` result; nothing is read yet."""
+    return np.load(info["file_path"], mmap_mode="r")
+
+
+def spectral_index(info, name, rows=slice(None), columns=slice(None)):
+    """Return a ``SPECTRAL_INDICES`` index over a pixel window; NaN where there is no data."""
+    first, second = SPECTRAL_INDICES[name]
+    if first not in info["bands"] or second not in info["bands"]:
+        raise ValueError(f"{name} needs bands {first} and {second}.")
+    stack = load_analysis_bands(info)
+    first = stack[info["bands"].index(first), rows, columns].astype(np.float32)
+    second = stack[info["bands"].index(second), rows, columns].astype(np.float32)
+    total = first + second
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(total > 0, (first - second) / total, np.nan)
+
+
+def _prefetch_batch(requested, save_path, bbox, max_delta_days, quality_thresholds, priority):
+    """Index the batch window with one catalog query and render the likely frames at once."""
+    try:
+        date_objs = [datetime.strptime(date, "%Y-%m-%d") for date in requested]
+    except ValueError:
+        return
+
+    known = _known_acquisitions(save_path, bbox, date_objs, max_delta_days)
+    if known is None:
+        return
+
+    # The nearest usable acquisition of each date is the one most likely to
+    # be picked; farther candidates are only probed if it is rejected.
+    nearest = set()
+    for date_obj in date_objs:
+        for check_date in _candidate_dates(date_obj, max_delta_days):
+            if known.get(check_date, float("inf")) <= MAX_CLOUD_COVERAGE:
+                nearest.add(check_date)
+                break
+
+    try:
+        _fetch_time_series(nearest, save_path, bbox, quality_thresholds, priority)
+    except (_Throttled, BudgetExceeded):
+        # The per-date lookups report the error.
+        pass
+
+
+def download_sentinel_images(
+    dates,
+    save_folder="cache",
+    bbox=None,
+    max_delta_days=5,
+    quality_thresholds=None,
+    priority=BULK,
+    max_workers=MAX_PARALLEL_REQUESTS,
+):
+    """Look up several dates concurrently, yielding ``(date, info)`` as each finishes.
+
+    Acquisitions across the range are rendered with multi-date time-series
+    requests first; candidate dates shared between lookups (e.g. neighbouring
+    days in an animation range) are only requested once per batch.
+    """
+    requested = list(dict.fromkeys(str(date) for date in dates))
+    if not requested:
+        return
+
+    save_path = Path(save_folder)
+    save_path.mkdir(parents=True, exist_ok=True)
+    bbox = bbox or BIRCHGLETSCHER_BBOX
+    with span("batch_prefetch"):
+        _prefetch_batch(requested, save_path, bbox, max_delta_days, quality_thresholds, priority)
+
+    probes = _SharedProbes()
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(requested)))) as pool:
+        futures = {
+            pool.submit(
+                _lookup,
+                date,
+                save_folder,
+                bbox,
+                max_delta_days,
+                quality_thresholds,
+                priority,
+                probes,
+            ): date
+            for date in requested
+        }
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+if __name__ == "__main__":
+    from prefetch import main
+
+    raise SystemExit(main())
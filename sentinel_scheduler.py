@@ -0,0 +1,219 @@
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from sentinel_cache import file_lock
+
+
+# Request priorities; lower numbers are served first.
+INTERACTIVE = 0
+BULK = 1
+PREFETCH = 2
+
+# Sentinel Hub bills one processing unit for a 512x512, 3-band, 8-bit output.
+PU_REFERENCE_PIXELS = 512 * 512
+PU_REFERENCE_BANDS = 3
+MIN_PROCESSING_UNITS = 0.005
+
+DEFAULT_REQUESTS_PER_MINUTE = 300
+DEFAULT_PU_PER_MINUTE = 300
+DEFAULT_DAILY_PU_BUDGET = 1000
+DEFAULT_MONTHLY_PU_BUDGET = 10000
+# Share of each budget that only interactive requests may spend, so bulk
+# animation and prefetch work cannot lock users out.
+INTERACTIVE_RESERVE_FRACTION = 0.1
+DEFAULT_USAGE_PATH = Path("cache") / "pu_usage.json"
+
+
+class BudgetExceeded(RuntimeError):
+    """The daily or monthly processing-unit budget does not allow this request."""
+
+
+def estimate_processing_units(width, height, input_bands=3, samples=1, float32=False):
+    """Estimate the processing units charged for one process-API request."""
+    units = (width * height) / PU_REFERENCE_PIXELS
+    units *= input_bands / PU_REFERENCE_BANDS
+    units *= samples
+    if float32:
+        units *= 2
+    return max(units, MIN_PROCESSING_UNITS)
+
+
+class TokenBucket:
+    """Classic token bucket; callers must hold the scheduler lock."""
+
+    def __init__(self, rate_per_second, capacity, clock=time.monotonic):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+
+def _env_number(name, default):
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+class RequestScheduler:
+    """Process-wide admission control for Sentinel Hub requests.
+
+    Requests wait in priority order for both a request-rate token and
+    enough processing-unit rate, and are refused once the persisted daily
+    or monthly processing-unit budget would be exceeded.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+        pu_per_minute=DEFAULT_PU_PER_MINUTE,
+        daily_budget=DEFAULT_DAILY_PU_BUDGET,
+        monthly_budget=DEFAULT_MONTHLY_PU_BUDGET,
+        usage_path=DEFAULT_USAGE_PATH,
+        clock=time.monotonic,
+    ):
+        self.daily_budget = daily_budget
+        self.monthly_budget = monthly_budget
+        self.usage_path = Path(usage_path)
+        self._usage_lock_path = self.usage_path.with_suffix(".lock")
+        self._requests = TokenBucket(
+            requests_per_minute / 60, max(1.0, requests_per_minute / 10), clock
+        )
+        self._units = TokenBucket(pu_per_minute / 60, max(1.0, pu_per_minute / 10), clock)
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._usage = self._load_usage()
+
+    def _load_usage(self):
+        try:
+            return json.loads(self.usage_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {"daily": {}, "monthly": {}}
+
+    def _save_usage(self):
+        self.usage_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.usage_path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(self._usage, sort_keys=True), encoding="utf-8")
+        os.replace(tmp_path, self.usage_path)
+
+    @staticmethod
+    def _periods():
+        now = datetime.now(timezone.utc)
+        return now.strftime("%Y-%m-%d"), now.strftime("%Y-%m")
+
+    def usage(self):
+        """Return ``(used_today, used_this_month)`` in processing units."""
+        day, month = self._periods()
+        with self._cond:
+            return (
+                self._usage["daily"].get(day, 0.0),
+                self._usage["monthly"].get(month, 0.0),
+            )
+
+    def _check_budget(self, units, priority):
+        if units <= 0:
+            return
+        # Other processes (e.g. the prefetch CLI) may have spent budget since.
+        self._usage = self._load_usage()
+        day, month = self._periods()
+        share = 1.0 if priority == INTERACTIVE else 1.0 - INTERACTIVE_RESERVE_FRACTION
+        for label, used, budget in (
+            ("daily", self._usage["daily"].get(day, 0.0), self.daily_budget),
+            ("monthly", self._usage["monthly"].get(month, 0.0), self.monthly_budget),
+        ):
+            if used + units > budget * share:
+                raise BudgetExceeded(
+                    f"This request would exceed the {label} Sentinel Hub processing-unit "
+                    f"budget ({used:.0f} of {budget:.0f} PU used)."
+                )
+
+    def _charge(self, units):
+        if not units:
+            return
+        day, month = self._periods()
+        # Read-modify-write under a file lock so processes sharing the usage
+        # file add to each other's counts instead of overwriting them.
+        with file_lock(self._usage_lock_path):
+            usage = self._load_usage()
+            # Only the current periods matter; older ones are dropped on write.
+            self._usage = {
+                "daily": {day: usage["daily"].get(day, 0.0) + units},
+                "monthly": {month: usage["monthly"].get(month, 0.0) + units},
+            }
+            self._save_usage()
+
+    def acquire(self, units, priority=INTERACTIVE):
+        """Block until a request costing ``units`` PU may be sent, then charge it."""
+        with self._cond:
+            self._check_budget(units, priority)
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    if self._waiting[0] != ticket:
+                        self._cond.wait()
+                        continue
+                    wait = max(self._requests.wait_time(1), self._units.wait_time(units))
+                    if wait <= 0:
+                        break
+                    self._cond.wait(wait)
+
+                # Budget may have been spent by others while this request queued.
+                self._check_budget(units, priority)
+                self._requests.take(1)
+                self._units.take(units)
+                self._charge(units)
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+
+    def refund(self, units):
+        """Return ``units`` to the budget for a request that was not billed."""
+        with self._cond:
+            self._charge(-units)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Return the process-wide scheduler, configured from the environment."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler(
+                requests_per_minute=_env_number(
+                    "SENTINEL_REQUESTS_PER_MINUTE", DEFAULT_REQUESTS_PER_MINUTE
+                ),
+                pu_per_minute=_env_number("SENTINEL_PU_PER_MINUTE", DEFAULT_PU_PER_MINUTE),
+                daily_budget=_env_number("SENTINEL_DAILY_PU_BUDGET", DEFAULT_DAILY_PU_BUDGET),
+                monthly_budget=_env_number(
+                    "SENTINEL_MONTHLY_PU_BUDGET", DEFAULT_MONTHLY_PU_BUDGET
+                ),
+                usage_path=os.getenv("SENTINEL_USAGE_FILE", DEFAULT_USAGE_PATH),
+            )
+        return _scheduler
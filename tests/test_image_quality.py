@@ -0,0 +1,30 @@
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from image_quality import quality_rejection, score_image
+
+
+def _png(rgb):
+    buffer = BytesIO()
+    Image.fromarray(np.asarray(rgb, dtype=np.uint8)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_saturated_snow_is_not_rejected_as_cloud():
+    # A clear winter scene: the 2.5x stretch clips snow fields to pure white.
+    snowfield = np.full((64, 64, 3), 255)
+    snowfield[48:, :] = (90, 110, 80)
+
+    quality = score_image(_png(snowfield))
+
+    assert quality["snow_fraction"] == 0.75
+    assert quality_rejection(quality) is None
+
+
+def test_cloud_limit_is_opt_in():
+    quality = score_image(_png(np.full((64, 64, 3), 250)))
+
+    assert quality_rejection(quality) is None
+    assert "cloud" in quality_rejection(quality, {"max_cloud_fraction": 0.6})
@@ -0,0 +1,93 @@
+import math
+import os
+import threading
+from pathlib import Path
+
+import pandas as pd
+
+from search_index import SearchIndex
+
+
+# The registry can be swapped for a larger CSV, Parquet or Feather file with
+# the same columns via VILLAGE_REGISTRY.
+VILLAGE_REGISTRY_PATH = Path(__file__).with_name("villages.csv")
+VILLAGE_COLUMNS = ["village", "lat", "lon", "risk_score", "signal"]
+# Optional column of alternative names separated by "|", e.g. "Genf|Geneva".
+ALIASES_COLUMN = "aliases"
+RISK_COLORS = {
+    "Safe": "#10b981",
+    "Medium": "#f59e0b",
+    "High": "#ef4444",
+}
+RISK_LEVELS = ["Safe", "Medium", "High"]
+RISK_BINS = [-math.inf, 0.33, 0.66, math.inf]
+
+
+def _read_registry(path):
+    suffix = path.suffix.lower()
+    if suffix == ".parquet":
+        df = pd.read_parquet(path)
+    elif suffix == ".feather":
+        df = pd.read_feather(path)
+    else:
+        df = pd.read_csv(path, dtype={ALIASES_COLUMN: str})
+    if ALIASES_COLUMN not in df:
+        df[ALIASES_COLUMN] = ""
+    df[ALIASES_COLUMN] = df[ALIASES_COLUMN].fillna("")
+    return df[VILLAGE_COLUMNS + [ALIASES_COLUMN]]
+
+
+def add_risk_columns(df):
+    """Add risk level, marker colour and marker size columns in place."""
+    df["risk_level"] = pd.cut(df["risk_score"], RISK_BINS, labels=RISK_LEVELS, right=False)
+    df["marker_color"] = df["risk_level"].map(RISK_COLORS).astype(str)
+    df["marker_size"] = (100 + df["risk_score"] * 180).round()
+    return df
+
+
+_registry = {}
+_search_indexes = {}
+_registry_lock = threading.Lock()
+
+
+def _registry_key(path):
+    path = Path(path or os.getenv("VILLAGE_REGISTRY", VILLAGE_REGISTRY_PATH))
+    return path, (str(path), path.stat().st_mtime_ns)
+
+
+def registry_version(path=None):
+    """Return a key that changes whenever the registry file does."""
+    return _registry_key(path)[1]
+
+
+def load_village_risk_data(path=None):
+    """Return the village registry with derived risk columns.
+
+    The frame is built once per file version and shared by every caller
+    and session, so it must be treated as read-only. Risk values are fixed
+    demonstration data until the prediction model is connected.
+    """
+    path, key = _registry_key(path)
+    with _registry_lock:
+        if key not in _registry:
+            _registry.clear()
+            _registry[key] = add_risk_columns(_read_registry(path))
+        return _registry[key]
+
+
+def village_search_index(path=None):
+    """Return the search index over village names and aliases, built once per file version.
+
+    Search results are row positions in :func:`load_village_risk_data`.
+    """
+    village_data = load_village_risk_data(path)
+    _path, key = _registry_key(path)
+    with _registry_lock:
+        if key not in _search_indexes:
+            _search_indexes.clear()
+            aliases = [
+                [alias.strip() for alias in value.split("|") if alias.strip()]
+                for value in village_data[ALIASES_COLUMN]
+            ]
+            _search_indexes[key] = SearchIndex(village_data["village"].tolist(), aliases)
+        return _search_indexes[key]